@@ -1,91 +1,310 @@
-from .IA import Interval
+from .IA import Interval, IntervalArray
+import numpy as np
+
+
+class NoiseSymbols:
+    """ Global allocator of noise symbol indices.
+    Every affine form takes fresh symbols from here, so forms built independently
+    never alias each other's noise, and allocating a symbol is O(1).
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def reserve(self, idx):
+        if idx > self.count:
+            self.count = idx
+
+    def fresh(self):
+        self.count += 1
+        return self.count
+
+    def reset(self):
+        self.count = 0
+
+
+noise_symbols = NoiseSymbols()
+
+
+def _frozen(array):
+    array.setflags(write=False)
+    return array
+
+
+def merge_noise(idx0, coef0, idx1, coef1):
+    """ Sums two sparse noise vectors given as sorted symbol indices and coefficients.
+    Coefficients may have leading batch dimensions ([..., symbols]), which are broadcast.
+    Symbols whose coefficients cancel exactly (in every batch element) are dropped.
+    """
+    idx = np.union1d(idx0, idx1)
+    shape = np.broadcast_shapes(coef0.shape[:-1], coef1.shape[:-1]) + idx.shape
+    coef = np.zeros(shape)
+    coef[..., np.searchsorted(idx, idx0)] += coef0
+    coef[..., np.searchsorted(idx, idx1)] += coef1
+    keep = np.any(coef != 0, axis=tuple(range(coef.ndim - 1)))
+    return _frozen(idx[keep]), _frozen(coef[..., keep])
+
 
 class AInterval:
+    """ An affine form base + sum(coef_i * eps_i) with eps_i in [-1, 1].
+    The noise is stored as a sorted array of symbol indices and an array of
+    coefficients; operations never modify their operands.
+    """
+
     def __init__(self, arg0, arg1, *, eps_idx=None):
         if eps_idx is not None:
             assert isinstance(arg0, (float, int))
             assert isinstance(arg1, (float, int))
             lo, hi = arg0, arg1
             self.base = (hi + lo)/2
-            self.noise = {eps_idx: (hi - lo)/2}
+            noise = {eps_idx: (hi - lo)/2}
         else:
             assert isinstance(arg0, (float, int))
-            isinstance(arg1, dict)
+            assert isinstance(arg1, dict)
             self.base = arg0
-            self.noise = arg1
+            noise = arg1
+
+        keys = sorted(noise)
+        self.idx = _frozen(np.array(keys, dtype=np.int64))
+        self.coef = _frozen(np.array([noise[k] for k in keys], dtype=float))
+        if keys:
+            noise_symbols.reserve(keys[-1])
+
+    @classmethod
+    def _from_arrays(cls, base, idx, coef):
+        ret = cls.__new__(cls)
+        ret.base = base
+        ret.idx = idx
+        ret.coef = coef
+        return ret
+
+    @classmethod
+    def from_interval(cls, x: Interval):
+        """ Affine form of an interval on a fresh noise symbol """
+        return cls(x.lo, x.hi, eps_idx=noise_symbols.fresh())
+
+    @property
+    def noise(self):
+        return dict(zip(self.idx.tolist(), self.coef.tolist()))
+
+    @property
+    def radius(self):
+        return float(np.sum(np.abs(self.coef)))
 
     def __str__(self):
-        noise_str = " + ".join(( f"{v}*eps{k}" for k,v in sorted(self.noise.items())))
+        noise_str = " + ".join((f"{v}*eps{k}" for k, v in self.noise.items()))
         return f"{self.base} + {noise_str}"
 
     def __eq__(self, rhs):
-        return rhs.base == rhs.base and rhs.noise==rhs.noise
+        return self.base == rhs.base and np.array_equal(self.idx, rhs.idx) and np.array_equal(self.coef, rhs.coef)
 
     def to_interval(self):
-        lo, hi = self.base, self.base
-        for e, v in self.noise.items():
-            lo -= abs(v)
-            hi += abs(v)
-        return Interval(lo, hi)
+        radius = self.radius
+        return Interval(self.base - radius, self.base + radius)
 
     def __add__(self, rhs):
+        if isinstance(rhs, AIntervalArray):
+            return NotImplemented
         if isinstance(rhs, AInterval):
-            new_base = self.base + rhs.base
-            new_noise = {}
-            es = set(self.noise.keys()).union(rhs.noise.keys())
-            for e in es:
-                noise_val = 0
-                for noise in (self.noise, rhs.noise):
-                    if e in noise:
-                        noise_val += noise[e]
-                new_noise[e] = noise_val
-            return AInterval(new_base, new_noise)
+            idx, coef = merge_noise(self.idx, self.coef, rhs.idx, rhs.coef)
+            return AInterval._from_arrays(self.base + rhs.base, idx, coef)
         else:
-            return AInterval(self.base + rhs, self.noise)
+            return AInterval._from_arrays(self.base + rhs, self.idx, self.coef)
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return AInterval._from_arrays(-self.base, self.idx, _frozen(-self.coef))
 
     def __sub__(self, rhs):
+        if isinstance(rhs, AIntervalArray):
+            return NotImplemented
         if isinstance(rhs, AInterval):
-            new_base = self.base - rhs.base
-            new_noise = self.noise
-            es = set(rhs.noise.keys())
-            for e in es:
-                noise_val = 0
-                for noise in (self.noise, rhs.noise):
-                    if e in noise:
-                        noise_val -= noise[e]
-                new_noise[e] = noise_val
-            return AInterval(new_base, new_noise)
+            idx, coef = merge_noise(self.idx, self.coef, rhs.idx, -rhs.coef)
+            return AInterval._from_arrays(self.base - rhs.base, idx, coef)
         else:
-            return AInterval(self.base - rhs, self.noise)
+            return AInterval._from_arrays(self.base - rhs, self.idx, self.coef)
+
+    def __rsub__(self, lhs):
+        return (-self) + lhs
 
     def __mul__(self, rhs):
+        if isinstance(rhs, AIntervalArray):
+            return NotImplemented
         if isinstance(rhs, AInterval):
-            x_sum = 0
-            y_sum = 0
-
-            es1 = self.noise.copy()
-            for key in es1:
-                x_sum += abs(es1[key])
-                es1[key] *=  rhs.base
-
-            es2 = rhs.noise.copy()
-            for key in es2:
-                y_sum += abs(es2[key])
-                es2[key] *=  self.base
-
-            new_noise = self.merge_dicts(es1, es2)
-            new_noise[max(set(new_noise.keys())) + 1] = x_sum * y_sum
-            return AInterval(self.base * rhs.base, new_noise)
+            # x*y = x0*y0 + x0*dy + y0*dx + dx*dy, where |dx*dy| <= rad(x)*rad(y)
+            # is bounded by a new noise symbol
+            idx, coef = merge_noise(self.idx, self.coef * rhs.base,
+                                    rhs.idx, rhs.coef * self.base)
+            new_coef = np.sum(np.abs(self.coef)) * np.sum(np.abs(rhs.coef))
+            if new_coef != 0:
+                idx = _frozen(np.append(idx, noise_symbols.fresh()))
+                coef = _frozen(np.append(coef, new_coef))
+            return AInterval._from_arrays(self.base * rhs.base, idx, coef)
+        else:
+            return AInterval._from_arrays(self.base * rhs, self.idx, _frozen(self.coef * rhs))
+
+    __rmul__ = __mul__
+
+
+def _element_noise(radius, element_dims):
+    """ Noise bounding each element of radius by a fresh symbol of its own.
+    The trailing element_dims axes of radius index independent elements, which must
+    not share a symbol; the leading (batch) axes share them.
+    Returns:
+        (idx, coef): the new symbols and their [*radius.shape, symbols] coefficients
+    """
+    if element_dims == 0:
+        return np.array([noise_symbols.fresh()], dtype=np.int64), radius[..., None]
+    batch, elements = radius.shape[:-element_dims], radius.shape[-element_dims:]
+    n = int(np.prod(elements))
+    idx = np.array([noise_symbols.fresh() for i in range(n)], dtype=np.int64)
+    coef = (radius.reshape(batch + (n,))[..., None] * np.eye(n)).reshape(radius.shape + (n,))
+    return idx, coef
+
+
+class AIntervalArray:
+    """ A batch of affine forms sharing one set of noise symbols.
+    base has shape [batch] and coef has shape [batch, symbols] (one column per
+    symbol in the sorted idx array), so a whole batch of input boxes is propagated
+    through a dag with a few array operations per node. The trailing element_dims
+    axes of base are the elements of vector/matrix values rather than the batch.
+    """
+
+    # NumPy operands defer to the reflected operators instead of broadcasting over us
+    __array_ufunc__ = None
+
+    def __init__(self, lo, hi, *, eps_idx):
+        lo, hi = np.broadcast_arrays(np.asarray(lo, dtype=float),
+                                     np.asarray(hi, dtype=float))
+        assert np.all(lo <= hi), f"{lo} must be less than {hi}"
+        self.base = _frozen((hi + lo)/2)
+        self.idx = _frozen(np.array([eps_idx], dtype=np.int64))
+        self.coef = _frozen(((hi - lo)/2)[..., None])
+        self.element_dims = 0
+        noise_symbols.reserve(eps_idx)
+
+    @classmethod
+    def _from_arrays(cls, base, idx, coef, element_dims=0):
+        ret = cls.__new__(cls)
+        ret.base = base
+        ret.idx = idx
+        ret.coef = coef
+        ret.element_dims = min(element_dims, base.ndim)
+        return ret
+
+    @classmethod
+    def from_interval_array(cls, x: IntervalArray, element_dims=0):
+        """ Affine forms of a batch of intervals on one fresh noise symbol.
+        Args:
+            x: The intervals
+            element_dims: Number of trailing axes that index the (independent) elements
+                of a vector or matrix value rather than the batch; every element gets a
+                fresh noise symbol of its own, shared across the batch
+        """
+        if element_dims == 0:
+            return cls(x.lo, x.hi, eps_idx=noise_symbols.fresh())
+        idx, coef = _element_noise((x.hi - x.lo)/2, element_dims)
+        return cls._from_arrays(_frozen((x.hi + x.lo)/2), _frozen(idx), _frozen(coef), element_dims)
+
+    @property
+    def shape(self):
+        return self.base.shape
+
+    def __len__(self):
+        return len(self.base)
+
+    def __getitem__(self, index):
+        # coef has one more (trailing) axis than base
+        coef_index = index + (slice(None),) if isinstance(index, tuple) else index
+        base = np.asarray(self.base[index])
+        if isinstance(index, tuple) and len(index) > 0 and index[0] is Ellipsis:
+            # Indexing from the end only changes element axes
+            element_dims = self.element_dims + base.ndim - self.base.ndim
         else:
-            for key in self.noise:
-                self.noise[key] *=  rhs
-            return AInterval(self.base * rhs, self.noise)
-
-    def merge_dicts(self, dict1, dict2):
-        new_dict = dict1
-        for key in set(dict2.keys()):
-            if key in new_dict:
-                new_dict[key] += dict2[key]
-            else:
-                new_dict[key] = dict2[key]
-        return new_dict
+            # Indexing from the front drops batch axes first
+            batch_dims = max(self.base.ndim - self.element_dims - (self.base.ndim - base.ndim), 0)
+            element_dims = base.ndim - batch_dims
+        return AIntervalArray._from_arrays(_frozen(base), self.idx, _frozen(self.coef[coef_index]), element_dims)
+
+    def sum(self, axis=-1):
+        """ Sum over an axis of the batch; exact, since the forms share their symbols """
+        axis = axis % self.base.ndim
+        element_dims = self.element_dims - (axis >= self.base.ndim - self.element_dims)
+        return AIntervalArray._from_arrays(_frozen(np.asarray(np.sum(self.base, axis=axis))), self.idx,
+                                           _frozen(np.sum(self.coef, axis=axis)), element_dims)
+
+    def __matmul__(self, rhs):
+        # Matrix product over the last two axes (leading axes are broadcast)
+        if not isinstance(rhs, AIntervalArray):
+            rhs = np.asarray(rhs)
+        return (self[..., :, :, None] * rhs[..., None, :, :]).sum(axis=-2)
+
+    def __rmatmul__(self, lhs):
+        lhs = np.asarray(lhs)
+        return (self[..., None, :, :] * lhs[..., :, :, None]).sum(axis=-2)
+
+    @property
+    def radius(self):
+        return np.sum(np.abs(self.coef), axis=-1)
+
+    def to_interval(self):
+        radius = self.radius
+        return IntervalArray._from_bounds(self.base - radius, self.base + radius)
+
+    @staticmethod
+    def _parts(x):
+        if isinstance(x, (AIntervalArray, AInterval)):
+            return x.base, x.idx, x.coef
+        return x, None, None
+
+    def _element_dims(self, rhs):
+        # Element axes are trailing, so they line up under broadcasting; constant
+        # operands only have element axes
+        if isinstance(rhs, AIntervalArray):
+            return max(self.element_dims, rhs.element_dims)
+        return max(self.element_dims, np.ndim(self._parts(rhs)[0]))
+
+    def __add__(self, rhs):
+        base, idx, coef = self._parts(rhs)
+        element_dims = self._element_dims(rhs)
+        if idx is None:
+            return AIntervalArray._from_arrays(_frozen(self.base + base), self.idx, self.coef, element_dims)
+        idx, coef = merge_noise(self.idx, self.coef, idx, coef)
+        return AIntervalArray._from_arrays(_frozen(self.base + base), idx, coef, element_dims)
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return AIntervalArray._from_arrays(_frozen(-self.base), self.idx, _frozen(-self.coef), self.element_dims)
+
+    def __sub__(self, rhs):
+        return self + (-rhs)
+
+    def __rsub__(self, lhs):
+        return (-self) + lhs
+
+    def __mul__(self, rhs):
+        base, idx, coef = self._parts(rhs)
+        element_dims = self._element_dims(rhs)
+        if idx is None:
+            base = np.asarray(base)
+            return AIntervalArray._from_arrays(_frozen(self.base * base), self.idx,
+                                               _frozen(self.coef * base[..., None]), element_dims)
+
+        # Same rule as AInterval.__mul__, with one new symbol per element shared by
+        # the whole batch
+        base = np.asarray(base)
+        idx, new_coef = merge_noise(self.idx, self.coef * base[..., None],
+                                    idx, coef * self.base[..., None])
+        shape = np.broadcast_shapes(self.base.shape, base.shape)
+        radius = np.sum(np.abs(self.coef), axis=-1) * \
+            np.sum(np.abs(coef), axis=-1)
+        if np.any(radius != 0):
+            remainder_idx, remainder = _element_noise(np.broadcast_to(radius, shape), element_dims)
+            idx = _frozen(np.concatenate([idx, remainder_idx]))
+            new_coef = _frozen(np.concatenate(
+                [np.broadcast_to(new_coef, shape + new_coef.shape[-1:]), remainder], axis=-1))
+        return AIntervalArray._from_arrays(_frozen(self.base * base), idx, new_coef, element_dims)
+
+    __rmul__ = __mul__
@@ -1,7 +1,8 @@
 from BitFlow.node import Input, Constant, Dag, Add, Sub, Mul, DagNode, Round, Output, Select
-from DagVisitor import Visitor, Transformer, AbstractDag
+from DagVisitor import Visitor
 from BitFlow.IA import Interval
 from BitFlow.Eval import IAEval, NumEval, AbstractEval
+from BitFlow.Program import Program
 import torch
 
 
@@ -44,24 +45,96 @@ class NodePrinter(Visitor):
             print(f"  {child_node}:  {self.node_values[child_node]}")
 
 
-class AddRoundNodes(Transformer):
+def group_by_tensor(node: DagNode):
+    """ Groups the elements selected from a tensor, and input tensors with their elements """
+    if not isinstance(node, (Select, Input)):
+        return None
+    while isinstance(node, Select):
+        node = next(node.children())
+    return ("tensor", node)
+
+
+def group_by_role(dag: Dag):
+    """ Groups nodes of the same kind that feed the same set of outputs, e.g. the
+    coefficients (or the products) of one row of a matrix-vector product. Inputs keep
+    their own precision.
+    Returns:
+        A grouping function for AddRoundNodes
+    """
+    consumers = {}
+    for (i, root) in enumerate(dag.roots()):
+        for node in Program.topological_order(Dag(outputs=[root], inputs=[])):
+            consumers.setdefault(node, set()).add(i)
+
+    def role(node: DagNode):
+        if isinstance(node, Input):
+            return None
+        return ("role", node.kind()[0], frozenset(consumers[node]))
+    return role
+
 
-    def __init__(self, W, O):
+class AddRoundNodes:
+
+    def __init__(self, W, O, groups=None):
+        """
+        Args:
+            W, O: Inputs holding the precisions of the inner nodes and of the outputs
+            groups: Optional precision grouping: a dict of node name to group, a
+                function of a node returning its group (None for its own precision,
+                see group_by_tensor and group_by_role), or a list of these, tried in
+                order. Nodes of a group share one W slot.
+        """
         self.W = W
         #self.X = X
         self.O = O
+        self.groups = groups
         self.round_count = 0
         self.input_count = 0
         self.output_count = 0
         self.rounded_outputs = []
         self.allroots = []
+        # W slot of every group, and of every rounded node by name
+        self.slots = {}
+        self.slot_map = {}
+
+    def group_of(self, node: DagNode):
+        groups = self.groups
+        if not isinstance(groups, list):
+            groups = [] if groups is None else [groups]
+        for group in groups:
+            key = group.get(node.name) if isinstance(group, dict) else group(node)
+            if key is not None:
+                return key
+        return node
+
+    def slot(self, node: DagNode):
+        key = self.keys[node]
+        if key not in self.slots:
+            self.slots[key] = self.round_count
+            self.round_count += 1
+        self.slot_map[node.name] = self.slots[key]
+        return self.slots[key]
 
     def doit(self, dag: Dag):  # takes a Dag and returns new Dag with round nodes added in
 
         new_inputs = dag.inputs
 
         self.allroots = list(dag.roots())
-        self.run(dag)
+        # Names and groups are those of the dag before its nodes get Round children
+        # (derived names would otherwise include the Round nodes)
+        nodes = Program.topological_order(dag)
+        for node in nodes:
+            node.name = node.name
+        self.keys = {node: self.group_of(node) for node in nodes}
+
+        # Children first, without recursion, so arbitrarily deep dags can be rounded
+        rounded = {}
+        for node in nodes:
+            if isinstance(node, Output):
+                rounded[node] = node
+                continue
+            node.set_children(*(rounded[child] for child in node.children()))
+            rounded[node] = self.round(node)
 
         new_inputs.append(self.W)
         # new_inputs.append(self.X)
@@ -72,23 +145,16 @@ class AddRoundNodes(Transformer):
         # return dag that has taken precision as an input
         return Dag(outputs=new_outputs, inputs=new_inputs)
 
-    def generic_visit(self, node: DagNode):
-
-        if isinstance(node, Output):
-            return None
-
-        # make sure code run on all children nodes first
-        Transformer.generic_visit(self, node)
-
+    def round(self, node: DagNode):
+        """ The Round node of node, whose children are already rounded """
         for child in node.children():
             assert isinstance(child, Round)
 
         if isinstance(node, Input):
             # current node + need to get prec_input
             returnNode = Round(node, Select(
-                self.W, self.round_count), name=node.name + "_round")
+                self.W, self.slot(node)), name=node.name + "_round")
             self.input_count += 1
-            self.round_count += 1
 
         else:
             if(node in self.allroots):
@@ -99,7 +165,6 @@ class AddRoundNodes(Transformer):
                 self.output_count += 1
 
             else:
-                returnNode = Round(node, Select(self.W, self.round_count),
+                returnNode = Round(node, Select(self.W, self.slot(node)),
                                    name=node.name + "_round_W")
-                self.round_count += 1
         return returnNode
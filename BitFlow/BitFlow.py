@@ -3,8 +3,15 @@ from .IA import Interval
 from .Eval.IAEval import IAEval
 from .Eval.NumEval import NumEval
 from .Eval.TorchEval import TorchEval
+from .Eval.CompiledTorchEval import CompiledTorchEval
 from .Optimization import BitFlowVisitor, BitFlowOptimizer
 from .AddRoundNodes import AddRoundNodes
+from .Expr import compile_expr
+from .torch.export import export
+from .Verification import precision_scale, ulp_error, sample_inputs, evaluate_rows, verify
+from .Parallel import map_chunks
+from .DataCache import DatasetCache
+from .RangeAnalysis import input_boxes, RangeRefinement
 
 import torch
 from torch.utils import data
@@ -20,7 +27,8 @@ class BitFlow:
         Args: Input dag (should already have Round nodes)
         Returns: A trainable model
         """
-        self.evaluator = TorchEval(dag)
+        # One fused rounding op per level of the dag (see CompiledTorchEval)
+        self.evaluator = CompiledTorchEval(dag, fuse_rounds=True)
 
         def model(**kwargs):
             return self.evaluator.eval(**kwargs)
@@ -36,7 +44,7 @@ class BitFlow:
                 W[index] = math.ceil(weight)
         return torch.tensor(W)
 
-    def gen_data(self, model, dataset_size, size_w, size_output, data_range, range_bits, true_width=20., dist=0):
+    def gen_data(self, model, dataset_size, size_w, size_output, data_range, range_bits, true_width=20., dist=0, chunk_size=None, workers=None, cache=None, dag=None):
         """ Generates ground-truth data from user specifications and model.
         Args:
             model: A dag already set up for torch evaluatiion
@@ -48,106 +56,136 @@ class BitFlow:
                 1 ==> NORMAL
                 2 ==> ARCSINE
             mean, std: statistics for normal distribution to generate data from
+            chunk_size: Number of samples evaluated per model call (defaults to the whole dataset)
+            workers: If given, evaluate the chunks in this many processes, each compiling
+                its own model of dag; the data does not depend on the number of workers
+            cache: A DatasetCache (or its directory) to load the data from, or to store
+                it in when it is not cached yet (keyed by dag)
+            dag: The dag of model (see gen_model), required with workers or cache
         Returns:
             (X, Y): generated data
         """
+        if dag is None and (workers is not None or cache is not None):
+            raise ValueError("generating data with workers or a cache needs the dag of the model")
+        if isinstance(cache, str):
+            cache = DatasetCache(cache)
 
         class Dataset(data.Dataset):
-            def __init__(self, model, dataset_size, size_w, size_output, data_range, range_bits, true_width, dist):
-                self.X = {k: [] for k in data_range}
-                self.Y = []
+            def __init__(self, model, dataset_size, size_w, size_output, data_range, range_bits, true_width, dist, chunk_size, workers, cache):
+                if cache is not None:
+                    key = cache.key(dag, data_range, range_bits,
+                                    dist, true_width, dataset_size)
+                    cached = cache.load(key)
+                    if cached is not None:
+                        self.X, self.Y = cached
+                        self.multi_output = self.Y.dim() > 1
+                        return
 
                 # TODO: create a mode to set constant precision for inputs
 
                 W = torch.Tensor(1, size_w).fill_(true_width)[0]
                 torch.manual_seed(42)
 
-                for key in data_range:
-                    # Create random tensor
-                    input_range = data_range[key]
-
-                    # calculate range bounds using range bits
-                    ib = range_bits[key]
-                    min_range = -1 * (2 ** (ib - 1))
-                    max_range = 2 ** (ib - 1) - 1
-
-                    val = 0
-                    if dist == 1:
-                        mean = (input_range[1]+input_range[0])/2
-                        std = (mean - input_range[0])/3
-                        val = torch.normal(
-                            mean=mean, std=std, size=(1, dataset_size)).squeeze()
-                    elif dist == 2:
-                        beta = torch.distributions.beta.Beta(
-                            torch.tensor([0.5]), torch.tensor([0.5]))
-                        val = (input_range[1] - input_range[0]) * \
-                            beta.sample((dataset_size,)).squeeze() + \
-                            input_range[0]
-                    else:
-                        val = (input_range[1] - input_range[0]) * \
-                            torch.rand(dataset_size) + input_range[0]
-
-                    val = torch.clamp(val, min_range, max_range)
-                    self.X[key] = val
-
-                for i in range(dataset_size):
-                    inputs = {k: self.X[k][i] for k in data_range}
-
-                    inputs["W"] = W
-                    inputs["O"] = torch.Tensor(
-                        1, size_output).fill_(true_width)[0]
-                    new_y = model(**inputs)
-                    self.Y.append(new_y)
+                self.X = sample_inputs(data_range, range_bits, dataset_size, dist)
+
+                # Evaluate the reference model over whole chunks of samples at once
+                O = torch.Tensor(1, size_output).fill_(true_width)[0]
+                if chunk_size is None:
+                    chunk_size = max(dataset_size, 1)
+
+                tasks = [({k: self.X[k][start:start + chunk_size] for k in data_range}, W, O,
+                          min(chunk_size, dataset_size - start))
+                         for start in range(0, dataset_size, chunk_size)]
+                if workers is None:
+                    chunks = [evaluate_rows(model, *task) for task in tasks]
+                else:
+                    chunks = list(map_chunks(dag, evaluate_rows, tasks, workers))
+
+                # Y is [dataset_size] for single-output dags and [num_outputs, dataset_size] otherwise
+                self.multi_output = size_output > 1
+                Y = torch.cat(chunks, dim=-1) if chunks else torch.empty(size_output, 0)
+                self.Y = (Y if self.multi_output else Y[0]).contiguous()
+
+                if cache is not None:
+                    cache.store(key, self.X, self.Y)
 
             def __len__(self):
                 return len(self.X[list(data_range.keys())[0]])
 
             def __getitem__(self, index):
+                if self.multi_output:
+                    return {k: self.X[k][index] for k in data_range}, [y[index] for y in self.Y]
                 return {k: self.X[k][index] for k in data_range}, self.Y[index]
 
-        return Dataset(model, dataset_size, size_w, size_output, data_range, range_bits, true_width, dist)
+        return Dataset(model, dataset_size, size_w, size_output, data_range, range_bits, true_width, dist, chunk_size, workers, cache)
 
-    def update_dag(self, dag):
+    def update_dag(self, dag, groups=None):
         """
         Args:
             dag: Input dag
+            groups: Optional precision grouping (see AddRoundNodes); the W slot of
+                every node is kept in self.slots
         Returns:
             updated dag: A dag which BitFlow can be run on
         """
         W = Input(name="W")
         O = Input(name="O")
 
-        rounder = AddRoundNodes(W, O)
+        rounder = AddRoundNodes(W, O, groups)
         roundedDag = rounder.doit(dag)
+        self.slots = rounder.slot_map
 
         return roundedDag, rounder.round_count, rounder.input_count, rounder.output_count
 
+    def export(self, path=None, batch_size=1):
+        """ Exports the trained rounded dag as a standalone TorchScript module.
+        Args:
+            path: If given, save the module to this path (load with torch.jit.load)
+            batch_size: Batch size of the example inputs used for tracing
+        Returns:
+            The traced module; it takes the data inputs positionally (in dag input order)
+        """
+        example_inputs = [torch.zeros(batch_size) for dag_input in self.dag.inputs
+                          if dag_input.name not in ("W", "O")]
+        return export(self.dag, self.W, self.O, example_inputs, path=path)
+
+    def verify(self, num_samples, W=None, O=None, **kwargs):
+        """ Streams random inputs from the data range through the trained model and
+        checks every output against the full precision results (see Verification.verify).
+        Args:
+            num_samples: Maximum number of samples
+            W, O: Precisions to check (default to the trained ones)
+            kwargs: chunk_size, dist, seed, target_accuracy, confidence
+        Returns:
+            A VerificationReport
+        """
+        W = self.W if W is None else W
+        O = self.O if O is None else O
+        return verify(self.model, W, O, self.data_range, self.range_bits, num_samples, dag=self.dag, **kwargs)
+
     def round_to_precision(self, num, precision):
-        if len(precision) > 1:
-            num = num.clone()
-            scale = 2.0**precision
-            for (ind, val) in enumerate(scale):
-                num[ind] *= val
-            num = torch.round(num)
-            for (ind, val) in enumerate(scale):
-                num[ind] /= val
-            return num
-        else:
-            scale = 2.0**precision
-            return torch.round(num * scale) / scale
+        scale = precision_scale(num, precision)
+        return torch.mul(num, scale).round_().div_(scale)
 
     def is_within_ulp(self, num, truth, precision):
-        r = torch.abs(num - self.round_to_precision(truth, precision))
-        ulp = 2**-(precision + 1)
-        if len(precision) > 1:
-            sol = torch.ones(r.shape)
-            for (y, row) in enumerate(r):
-                for (x, val) in enumerate(row):
-                    if val > ulp[y]:
-                        sol[y][x] = 0
-            return sol
-        else:
-            return(torch.where(r <= ulp, torch.ones(r.shape), torch.zeros(r.shape)))
+        return self.ulp_mask(num, truth, precision).float()
+
+    def ulp_mask(self, num, truth, precision):
+        """ Whether each result is within half an ulp of the rounded truth """
+        return ulp_error(num, truth, precision).le(0.5)
+
+    def ulp_pass_counts(self, num, truth, precision):
+        """ Number of results within half an ulp of the truth, per output
+        Args:
+            num, truth: [outputs, N] (or [N] for a single output)
+            precision: Output precisions
+        Returns:
+            Tensor of pass counts, one per output
+        """
+        mask = self.ulp_mask(num, truth, precision)
+        if mask.dim() > 1:
+            return mask.sum(dim=tuple(range(1, mask.dim())))
+        return mask.sum().view(1)
 
     def calc_accuracy(self, name, test_gen, W, O, precision, model, should_print):
         success = 0
@@ -164,18 +202,20 @@ class BitFlow:
             else:
                 Y = Y.squeeze()
 
-            ulp = self.is_within_ulp(res, Y, precision)
-            success += torch.sum(ulp)
-            total += torch.numel(ulp)
+            success += self.ulp_pass_counts(res, Y, precision)
+            total += res[0].numel() if len(precision) > 1 else res.numel()
 
             if should_print and len(precision) == 1:
-                indices = (ulp == 0).nonzero()[:, 0].tolist()
+                ulp = self.ulp_mask(res, Y, precision)
+                indices = (~ulp).nonzero()[:, 0].tolist()
                 for index in indices:
                     print(
                         f"guess: {res[index]}, true: {self.round_to_precision(Y[index], precision)} ")
 
-        acc = (success * 1.)/total
+        acc = (torch.sum(success) * 1.)/(total * len(success))
         print(f"accuracy: {acc}")
+        if len(success) > 1:
+            print(f"accuracy per output: {((success * 1.)/total).tolist()}")
 
     def within_ulp_err(self, num, truth, precision):
         diff = torch.abs(truth - num)
@@ -205,52 +245,67 @@ class BitFlow:
 
         return filtered_vars
 
-    def calculateRange(self, evaluator, outputs):
-        node_values = evaluator.node_values
-        visitor = BitFlowVisitor(node_values)
-        visitor.run(evaluator.dag)
+    def calculateRange(self, evaluator, outputs, visitor=None):
+        if visitor is None:
+            visitor = BitFlowVisitor(evaluator.node_values)
+            visitor.run(evaluator.dag)
 
         filtered_vars = self.filterDAGFromOutputs(visitor, outputs)
 
         range_bits = visitor.IBs
         return range_bits, filtered_vars
 
-    def constructOptimizationFunctions(self, dag, outputs, data_range):
-        evaluator = NumEval(dag)
+    def constructOptimizationFunctions(self, dag, outputs, data_range, analysis=None, subdivisions=1, refine=None):
+        # Sound ranges: intervals over the whole input box (optionally split into
+        # subdivisions**inputs boxes, or adaptively with refine, to tighten them; see
+        # RangeAnalysis.py)
+        eval_dict = input_boxes(data_range, subdivisions)
 
-        eval_dict = data_range.copy()
-        for key in eval_dict:
-            eval_dict[key] = int(max(abs(eval_dict[key][0]),
-                                     abs(eval_dict[key][1])))
+        if analysis is not None and refine is None:
+            # Cached or incremental analysis (see Incremental.py)
+            bfo = analysis.optimizer(dag, outputs, **eval_dict)
+            bfo.calculateInitialValues()
+            return bfo, bfo.visitor.IBs, self.filterDAGFromOutputs(bfo.visitor, outputs)
 
+        if refine is None:
+            evaluator = IAEval(dag)
+        else:
+            # Adaptive bisection of the input box (refine holds RangeRefinement options);
+            # refined ranges are not cached
+            evaluator = RangeRefinement(dag, **refine)
+            eval_dict = input_boxes(data_range)
         evaluator.eval(**eval_dict)
 
-        range_bits, filtered_vars = self.calculateRange(evaluator, outputs)
-
+        # The ranges come from the optimizer's visitor, so the dag is analysed once
         bfo = BitFlowOptimizer(evaluator, outputs)
+        range_bits, filtered_vars = self.calculateRange(evaluator, outputs, bfo.visitor)
         bfo.calculateInitialValues()
         return bfo, range_bits, filtered_vars
 
-    def createExecutableConstraintFunctions(self, area_fn, error_fn, filtered_vars):
-        exec(f'''def AreaOptimizerFn(W):
-             {','.join(filtered_vars)} = W
-             return  {area_fn}''', globals())
+    def createExecutableConstraintFunctions(self, area_fn, error_fn, filtered_vars, analysis=None):
+        # Functions of the whole W vector, evaluated level by level (see Expr.py)
+        compile_fn = compile_expr if analysis is None else analysis.compile
+        self.AreaOptimizerFn = compile_fn(
+            area_fn, filtered_vars, backend="vector")
+        self.ErrorConstraintFn = compile_fn(
+            error_fn, filtered_vars, backend="vector")
 
-        exec(f'''def ErrorConstraintFn(x):
-             {','.join(filtered_vars)} = x
-             return  {error_fn}''', globals())
-
-    def initializeData(self, model, training_size, testing_size, weight_size, output_size, data_range, range_bits, batch_size):
+    def initializeData(self, model, training_size, testing_size, weight_size, output_size, data_range, range_bits, batch_size, workers=None, cache=None, dag=None):
         data_params = dict(
             batch_size=batch_size
         )
 
-        # generate testing/training data
+        # generate testing/training data (with workers, one chunk per worker)
+        def chunk_size(size):
+            return None if workers is None else max(math.ceil(size / workers), 1)
+
         training_set = self.gen_data(
-            model, training_size, weight_size, output_size, data_range, range_bits)
+            model, training_size, weight_size, output_size, data_range, range_bits,
+            chunk_size=chunk_size(training_size), workers=workers, cache=cache, dag=dag)
         train_gen = data.DataLoader(training_set, **data_params)
         test_set = self.gen_data(
-            model, testing_size, weight_size, output_size, data_range, range_bits)
+            model, testing_size, weight_size, output_size, data_range, range_bits,
+            chunk_size=chunk_size(testing_size), workers=workers, cache=cache, dag=dag)
         test_gen = data.DataLoader(test_set, **data_params)
 
         return train_gen, test_gen
@@ -280,11 +335,7 @@ class BitFlow:
                 1 ==> Paper Error
                 2 ==> Soft-Loss on ULP
         """
-        unpacked_W = []
-        for weight in W:
-            unpacked_W.append(weight)
-
-        area = AreaOptimizerFn(unpacked_W)
+        area = self.AreaOptimizerFn(W)
 
         if isinstance(target, list):
             target = torch.stack(target)
@@ -294,7 +345,7 @@ class BitFlow:
         if error_type == 1:
 
             # Calculate erros
-            constraint_err = ErrorConstraintFn(unpacked_W)
+            constraint_err = self.ErrorConstraintFn(W)
 
             # Sanity error check
             if shouldErrorCheck:
@@ -356,25 +407,28 @@ class BitFlow:
 
         return loss
 
-    def __init__(self, dag, outputs, data_range, training_size=2000, testing_size=200, epochs=10, batch_size=16, lr=1e-4, error_type=1, test_optimizer=True, test_ufb=False):
+    def __init__(self, dag, outputs, data_range, training_size=2000, testing_size=200, epochs=10, batch_size=16, lr=1e-4, error_type=1, test_optimizer=True, test_ufb=False, workers=None, cache=None, groups=None, analysis=None, subdivisions=1, refine=None):
 
-        # Run a basic evaluator on the DAG to construct error and area functions
+        # Run a basic evaluator on the DAG to construct error and area functions. Given an
+        # AnalysisCache (IAEval analyses) shared across runs, repeated analyses are reused;
+        # with an IncrementalAnalysis shared across edits of a dag, only what changed is
+        # analysed (see Incremental.py)
         bfo, range_bits, filtered_vars = self.constructOptimizationFunctions(
-            dag, outputs, data_range)
+            dag, outputs, data_range, analysis, subdivisions, refine)
+
+        # Update the dag with round nodes and set up the model for torch training
+        dag, weight_size, input_size, output_size = self.update_dag(dag, groups)
+        model = self.gen_model(dag)
 
-        # Generate error and area functions from the visitor
+        # Generate error and area functions of W from the visitor (grouped nodes share a slot)
         error_fn = bfo.error_fn
         area_fn = bfo.area_fn
         self.createExecutableConstraintFunctions(
-            area_fn, error_fn, filtered_vars)
-
-        # Update the dag with round nodes and set up the model for torch training
-        dag, weight_size, input_size, output_size = self.update_dag(dag)
-        model = self.gen_model(dag)
+            area_fn, error_fn, {var: self.slots[var] for var in filtered_vars}, analysis)
 
         # create the data according to specifications
         train_gen, test_gen = self.initializeData(model, training_size, testing_size,
-                                                  weight_size, output_size, data_range, range_bits, batch_size)
+                                                  weight_size, output_size, data_range, range_bits, batch_size, workers, cache, dag)
 
         # initialize the weights and outputs with appropriate gradient toggle
         O, precision, W, init_W = self.initializeWeights(
@@ -398,7 +452,7 @@ class BitFlow:
                 y = model(**inputs)
 
                 if isinstance(y, list):
-                    y = torch.stack(model(**inputs))
+                    y = torch.stack(y)
                     target_y = torch.stack(target_y).squeeze()
 
                 loss = self.compute_loss(target_y, y, W, iter, batch_size, precision, epochs, training_size,
@@ -429,20 +483,23 @@ class BitFlow:
                                O, precision, model, False)
 
         print("\n##### MODEL DETAILS #####")
-        print(f"ERROR: {ErrorConstraintFn(W.tolist())}")
-        print(f"AREA: {AreaOptimizerFn(W.tolist())}")
+        print(f"ERROR: {self.ErrorConstraintFn(W.tolist())}")
+        print(f"AREA: {self.AreaOptimizerFn(W.tolist())}")
 
         if test_optimizer:
             print("\n##### FROM OPTIMIZER ######")
-            bfo.solve()
-            test = list(bfo.fb_sols.values())
-            print(f"ERROR: {ErrorConstraintFn(test)}")
-            print(f"AREA: {AreaOptimizerFn(test)}")
+            bfo.solve(slots=self.slots)
+            test = bfo.solution
+            print(f"ERROR: {self.ErrorConstraintFn(test)}")
+            print(f"AREA: {self.AreaOptimizerFn(test)}")
 
             self.calc_accuracy("OPTIMIZER TEST", test_gen, torch.tensor(test),
                                O, precision, model, False)
 
         # Save outputs to object
+        self.dag = dag
         self.model = model
         self.W = W
         self.O = O
+        self.data_range = data_range
+        self.range_bits = range_bits
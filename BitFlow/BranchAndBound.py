@@ -0,0 +1,147 @@
+import time
+import numpy as np
+from scipy.optimize import minimize
+
+from .Expr import Expr, compile_expr, compile_grad, variable_count
+from .IA import IntervalArray
+
+'''
+Integer precision solver.
+
+Minimizes the area model over integer fractional bit widths subject to the error
+constraint (error_fn >= 0), instead of solving the continuous relaxation and
+rounding up. A repaired continuous relaxation followed by a greedy descent gives a
+feasible incumbent quickly, then a depth-first branch and bound over boxes of bit
+widths improves it or proves it optimal. Boxes are bounded by evaluating the
+expressions with interval arithmetic, which is sound whatever the signs of the error
+terms, and are processed in batches so each step is a few vectorized operations.
+'''
+
+
+def _evaluate(fn, X):
+    # constant expressions compile to scalars
+    return np.broadcast_to(fn(X), X.shape[1:])
+
+
+def _uniform_start(error, num_vars, lo, hi):
+    # The smallest uniform precision that meets the error constraint
+    uniform = np.tile(np.arange(lo, hi + 1, dtype=float), (num_vars, 1))
+    feasible = np.flatnonzero(_evaluate(error, uniform) >= 0)
+    return uniform[:, feasible[0]] if len(feasible) else None
+
+
+def _relaxed_start(area_fn, error_fn, variables, x0, lo, hi):
+    # Solve the continuous relaxation from x0, round up, and add bits to the
+    # variable that buys the most error margin per unit of area until feasible
+    area, error = compile_expr(area_fn, variables), compile_expr(error_fn, variables)
+    con = {'type': 'ineq', 'fun': error, 'jac': compile_grad(error_fn, variables)}
+    relaxed = minimize(area, x0, jac=compile_grad(area_fn, variables), method="SLSQP",
+                       bounds=[(lo, hi)] * variable_count(variables), constraints=[con])
+    x = np.clip(np.ceil(relaxed.x - 1e-9), lo, hi)
+
+    while error(x) < 0:
+        movable = np.flatnonzero(x < hi)
+        if len(movable) == 0:
+            return None
+        candidates = np.repeat(x[:, None], len(movable), axis=1)
+        candidates[movable, np.arange(len(movable))] += 1
+        gain = _evaluate(error, candidates) - error(x)
+        cost = np.maximum(_evaluate(area, candidates) - area(x), 1e-12)
+        x = candidates[:, np.argmax(gain / cost)]
+    return x
+
+
+def greedy_descent(area, error, x, lo=0):
+    """ Repeatedly lowers the single variable of a feasible point that reduces the
+    area the most while staying feasible.
+    Args:
+        area, error: Compiled area and error functions
+        x: Feasible integer starting point
+        lo: Lower bound of every variable
+    Returns:
+        (x, area)
+    """
+    best = float(area(x))
+    while True:
+        movable = np.flatnonzero(x > lo)
+        if len(movable) == 0:
+            break
+        candidates = np.repeat(x[:, None], len(movable), axis=1)
+        candidates[movable, np.arange(len(movable))] -= 1
+        areas = np.where(_evaluate(error, candidates) >= 0,
+                         _evaluate(area, candidates), np.inf)
+        i = np.argmin(areas)
+        if not areas[i] < best:
+            break
+        x, best = candidates[:, i], float(areas[i])
+    return x, best
+
+
+def branch_and_bound(area_fn: Expr, error_fn: Expr, variables, lo=0, hi=64, time_limit=60, batch_size=256):
+    """ Minimizes area_fn subject to error_fn >= 0 over integer points in [lo, hi]^n.
+    Args:
+        area_fn, error_fn: Area and error expressions
+        variables: Variable names in vector order, or a dict of name to index (names
+            sharing an index are one variable)
+        lo, hi: Bounds of every variable
+        time_limit: Seconds after which the search stops and returns the incumbent
+            (None to search until optimal, which can take exponential time)
+        batch_size: Number of boxes bounded per step
+    Returns:
+        (solution, optimal): the best feasible point found as a list of ints (None
+        if none was found), and whether the search finished (so it is optimal)
+    """
+    start = time.monotonic()
+    n = variable_count(variables)
+    area = compile_expr(area_fn, variables)
+    error = compile_expr(error_fn, variables)
+    area_bounds = compile_expr(area_fn, variables, backend="interval")
+    error_bounds = compile_expr(error_fn, variables, backend="interval")
+
+    best, best_area = None, np.inf
+    start_point = _uniform_start(error, n, lo, hi)
+    if start_point is not None:
+        starts = [start_point, _relaxed_start(area_fn, error_fn, variables, start_point, lo, hi)]
+        for x in starts:
+            if x is not None:
+                x, x_area = greedy_descent(area, error, x, lo)
+                if x_area < best_area:
+                    best, best_area = x, x_area
+
+    stack = [(np.full(n, lo, dtype=float), np.full(n, hi, dtype=float))]
+    while stack:
+        if time_limit is not None and time.monotonic() - start > time_limit:
+            break
+
+        boxes = stack[-batch_size:]
+        del stack[-batch_size:]
+        L = np.stack([box[0] for box in boxes], axis=1)
+        H = np.stack([box[1] for box in boxes], axis=1)
+        box = IntervalArray._from_bounds(L, H)
+
+        # Prune boxes that cannot beat the incumbent or cannot be feasible
+        area_lo = _evaluate(lambda x: area_bounds(x).lo, box)
+        error_hi = _evaluate(lambda x: error_bounds(x).hi, box)
+        alive = (area_lo < best_area) & (error_hi >= 0)
+
+        # The lower corner of every box is a candidate point
+        corner_area = np.where(_evaluate(error, L) >= 0, _evaluate(area, L), np.inf)
+        i = np.argmin(np.where(alive, corner_area, np.inf))
+        if alive[i] and corner_area[i] < best_area:
+            best, best_area = L[:, i].copy(), float(corner_area[i])
+
+        # Split the widest variable of the remaining boxes
+        width = H - L
+        alive &= (area_lo < best_area) & (np.max(width, axis=0) > 0)
+        for b in reversed(np.flatnonzero(alive)):
+            v = np.argmax(width[:, b])
+            mid = np.floor((L[v, b] + H[v, b]) / 2)
+            upper_lo = L[:, b].copy()
+            upper_lo[v] = mid + 1
+            lower_hi = H[:, b].copy()
+            lower_hi[v] = mid
+            stack.append((upper_lo, H[:, b].copy()))
+            stack.append((L[:, b].copy(), lower_hi))
+
+    solution = None if best is None else [int(v) for v in best]
+    return solution, not stack
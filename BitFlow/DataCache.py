@@ -0,0 +1,69 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import torch
+
+from .Serialization import digest
+
+'''
+Content-addressed on-disk cache of generated datasets.
+
+An entry is keyed by the structure of the dag and every parameter that determines the
+generated data (ranges, range bits, distribution, reference width and size); chunking
+and worker counts do not change the data, so they are not part of the key. Entries are
+directories of .npy files that are memory-mapped copy-on-write when loaded, so a hit
+costs no model evaluation and no copy.
+'''
+
+
+class DatasetCache:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(dag, data_range, range_bits, dist, true_width, dataset_size, seed=42):
+        spec = {
+            "dag": digest(dag),
+            "data_range": {k: [float(v) for v in data_range[k]] for k in data_range},
+            "range_bits": {k: int(range_bits[k]) for k in data_range},
+            "dist": dist,
+            "true_width": float(true_width),
+            "dataset_size": dataset_size,
+            "seed": seed,
+        }
+        return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def load(self, key):
+        """ Returns (X, Y) of an entry, or None if it is not cached """
+        path = self.path(key)
+        if not os.path.isdir(path):
+            return None
+        with open(os.path.join(path, "inputs.json")) as f:
+            names = json.load(f)
+        X = {name: torch.from_numpy(np.load(os.path.join(path, f"X{i}.npy"), mmap_mode="c"))
+             for (i, name) in enumerate(names)}
+        Y = torch.from_numpy(np.load(os.path.join(path, "Y.npy"), mmap_mode="c"))
+        return X, Y
+
+    def store(self, key, X, Y):
+        # Written to a temporary directory first, so readers never see partial entries
+        tmp = tempfile.mkdtemp(dir=self.directory)
+        try:
+            with open(os.path.join(tmp, "inputs.json"), "w") as f:
+                json.dump(list(X), f)
+            for (i, name) in enumerate(X):
+                np.save(os.path.join(tmp, f"X{i}.npy"), X[name].numpy())
+            np.save(os.path.join(tmp, "Y.npy"), Y.numpy())
+            os.rename(tmp, self.path(key))
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(self.path(key)):
+                raise
@@ -0,0 +1,53 @@
+from .AbstractEval import AbstractEval
+from ..node import DagNode
+from ..IA import Interval, IntervalArray
+from ..AA import AInterval, AIntervalArray
+import numpy as np
+
+
+class AAEval(AbstractEval):
+    def __init__(self, dag, element_dims=None):
+        """
+        Args:
+            dag: The dag to evaluate
+            element_dims: Dict of input name to the number of trailing axes of its
+                IntervalArray that are vector/matrix elements rather than a batch of
+                boxes (see AIntervalArray.from_interval_array); defaults to none
+        """
+        super().__init__(dag)
+        self.element_dims = {} if element_dims is None else element_dims
+
+    def eval_Input(self, node: DagNode):
+        # Intervals (or batches of intervals) are given a fresh noise symbol per input
+        val = self.input_values[node.name]
+        if isinstance(val, Interval):
+            return AInterval.from_interval(val)
+        if isinstance(val, IntervalArray):
+            return AIntervalArray.from_interval_array(val, self.element_dims.get(node.name, 0))
+        return val
+
+    def eval_Constant(self, node: DagNode):
+        if isinstance(node.value, (list, tuple)):
+            return np.asarray(node.value, dtype=float)
+        return node.value
+
+    def eval_Add(self, a, b, node: DagNode):
+        return a + b
+
+    def eval_Sub(self, a, b, node: DagNode):
+        return a - b
+
+    def eval_Mul(self, a, b, node: DagNode):
+        return a * b
+
+    def eval_Select(self, a, node: DagNode):
+        return a[node.index]
+
+    def eval_Sum(self, a, node: DagNode):
+        return a.sum(axis=-1)
+
+    def eval_Dot(self, a, b, node: DagNode):
+        return (a * b).sum(axis=-1)
+
+    def eval_MatMul(self, a, b, node: DagNode):
+        return a @ b
@@ -1,9 +1,9 @@
-from DagVisitor import Visitor
 from abc import abstractmethod
-from ..node import Dag, DagNode, Input, Constant, Add, Mul, Select, Output, Round
+from ..node import Dag, DagNode, Input, Constant, Add, Mul, Select, Output, Round, Sum, Dot, MatMul
+from ..Program import Program
 
 
-class AbstractEval(Visitor):
+class AbstractEval:
     def __init__(self, dag: Dag):
         self.dag = dag
         self.node_values = {}
@@ -14,15 +14,17 @@ class AbstractEval(Visitor):
         for dag_input in self.dag.inputs:
             if dag_input.name not in input_values:
                 raise ValueError(f"Missing {dag_input} in input values")
-        super().run(self.dag)
+        # Children first, without recursion, so arbitrarily deep dags can be evaluated
+        for node in Program.topological_order(self.dag):
+            self.visit(node)
         outputs = [self.node_values[root] for root in self.dag.roots()]
         #print(outputs, len(outputs), outputs[0])
         if len(outputs) == 1:
             return outputs[0]
         return outputs
 
-    def generic_visit(self, node: DagNode):
-        Visitor.generic_visit(self, node)
+    def visit(self, node: DagNode):
+        """ Evaluates one node whose children are already evaluated """
         child_values = [self.node_values[child] for child in node.children()]
         eval_name = f"eval_{node.kind()[0]}"
         assert hasattr(self, eval_name)
@@ -53,3 +55,16 @@ class AbstractEval(Visitor):
     @abstractmethod
     def eval_Select(self, a, node: DagNode):
         pass
+
+    # Vector ops reduce over the last axis of their operands
+    @abstractmethod
+    def eval_Sum(self, a, node: DagNode):
+        pass
+
+    @abstractmethod
+    def eval_Dot(self, a, b, node: DagNode):
+        pass
+
+    @abstractmethod
+    def eval_MatMul(self, a, b, node: DagNode):
+        pass
@@ -0,0 +1,165 @@
+from ..node import Dag
+from ..Program import Program
+from ..torch.functions import IntRound
+import torch as t
+
+
+def _select(a, index):
+    return a[index] if len(a.shape) == 1 else a[:, index]
+
+
+def _round_level(round_fn, values, precisions):
+    """ Rounds values[i] to precisions[..., i] fractional bits, like Round nodes. With
+    one precision per value, every value goes through a single call of round_fn.
+    """
+    if precisions.dim() != 1:
+        # Precisions per sample
+        scales = [2.0 ** precisions[..., i] for i in range(len(values))]
+        return [round_fn(v * s) / s for (v, s) in zip(values, scales)]
+    values = [t.as_tensor(v) for v in values]
+    sizes = [v.numel() for v in values]
+    scale = (2.0 ** precisions).repeat_interleave(t.tensor(sizes))
+    rounded = round_fn(t.cat([v.reshape(-1) for v in values]) * scale) / scale
+    return [r.view(v.shape) for (r, v) in zip(rounded.split(sizes), values)]
+
+
+class CompiledTorchEval:
+    """ Torch evaluator that lowers the dag once into a straight-line python function.
+    Produces exactly the same values (and gradients) as TorchEval, but repeated calls
+    to eval do no visitor recursion, reflection or dict writes per node.
+
+    With fuse_rounds, Round nodes whose operands are ready at the same depth of the dag
+    are rounded together by one op, so the number of rounding ops follows the depth of
+    the dag, not its size. Values are unchanged; gradients of the precisions are summed
+    in a different order, so they agree up to float rounding.
+    """
+
+    _templates = {
+        "Add": "{0} + {1}",
+        "Sub": "{0} - {1}",
+        "Mul": "{0} * {1}",
+        "Sum": "{0}.sum(-1)",
+        "Dot": "({0} * {1}).sum(-1)",
+        "MatMul": "{0} @ {1}",
+    }
+
+    def __init__(self, dag: Dag, fuse_rounds=False):
+        self.dag = dag
+        self.program = Program.from_dag(dag)
+        self.source, self._fn = self.codegen(self.program, fuse_rounds=fuse_rounds)
+
+    @classmethod
+    def codegen(cls, program: Program, round_fn=IntRound, arg_names=None, fuse_rounds=False):
+        """ Generates the python source of a program and executes it.
+        Args:
+            program: The lowered dag
+            round_fn: Function used to round the scaled values of Round nodes
+            arg_names: If given, the function takes these inputs positionally and
+                returns a tuple; otherwise it takes a dict of inputs and returns
+                a value (single output) or a list
+            fuse_rounds: Round each level of Round nodes with one fused op (the fused
+                op depends on the sizes of the values, so traced functions should not)
+        Returns:
+            (source, function)
+        """
+        namespace = {"_round": round_fn, "_select": _select, "_round_level": _round_level, "t": t}
+        if arg_names is None:
+            lines = ["def _program(_inputs):"]
+        else:
+            params = ", ".join(f"_i{i}" for i in range(len(arg_names)))
+            lines = [f"def _program({params}):"]
+
+        # Fused rounds order instructions by depth (a topological order) with the Round
+        # nodes of each depth last, so they are all ready together. Otherwise program
+        # order is kept: it creates autograd nodes in TorchEval's order, so gradients
+        # of shared values are accumulated in the same order
+        instrs = program.instrs
+        order = list(range(len(instrs)))
+        levels = {}
+        if fuse_rounds:
+            depths = []
+            for instr in instrs:
+                depths.append(1 + max((depths[arg] for arg in instr.args), default=-1))
+            order.sort(key=lambda slot: (depths[slot], instrs[slot].op == "Round", slot))
+            for slot in order:
+                if instrs[slot].op == "Round":
+                    levels.setdefault(depths[slot], []).append(slot)
+        fused = {slot: level for level in levels.values() if len(level) > 1 for slot in level}
+
+        # Only instructions some output depends on are emitted (precisions that fused
+        # rounds gather from a vector are not selected one by one)
+        live = set(program.outputs)
+        for slot in reversed(order):
+            if slot in live:
+                instr = instrs[slot]
+                args = instr.args
+                if slot in fused and cls._gathered(program, fused[slot]) is not None:
+                    args = (args[0], instrs[args[1]].args[0])
+                live.update(args)
+
+        for slot in order:
+            if slot not in live:
+                continue
+            if slot in fused:
+                if slot == fused[slot][0]:
+                    lines += cls._fused_round(program, fused[slot])
+                continue
+            instr = instrs[slot]
+            args = [f"v{arg}" for arg in instr.args]
+            if instr.op == "Input":
+                if arg_names is None:
+                    expr = f"_inputs[{instr.attr!r}]"
+                else:
+                    expr = f"_i{arg_names.index(instr.attr)}"
+            elif instr.op == "Constant":
+                namespace[f"_c{slot}"] = t.Tensor([instr.attr])
+                expr = f"_c{slot}"
+            elif instr.op == "Select":
+                a, index = args[0], instr.attr
+                expr = f"{a}[{index!r}] if len({a}.shape) == 1 else {a}[:, {index!r}]"
+            elif instr.op == "Round":
+                lines.append(f"    _s = 2.0 ** {args[1]}")
+                expr = f"_round({args[0]} * _s) / _s"
+            elif instr.op in cls._templates:
+                expr = cls._templates[instr.op].format(*args)
+            else:
+                raise NotImplementedError(f"Cannot compile {instr.op} nodes")
+            lines.append(f"    v{slot} = {expr}")
+
+        outputs = [f"v{slot}" for slot in program.outputs]
+        if arg_names is not None:
+            lines.append(f"    return ({', '.join(outputs)},)")
+        elif len(outputs) == 1:
+            lines.append(f"    return {outputs[0]}")
+        else:
+            lines.append(f"    return [{', '.join(outputs)}]")
+
+        source = "\n".join(lines)
+        exec(source, namespace)
+        return source, namespace["_program"]
+
+    @staticmethod
+    def _gathered(program: Program, level):
+        # (vector slot, indices) if the precisions of a level are all selected from one
+        # vector (W or O), so that a single gather fetches them
+        precisions = [program.instrs[program.instrs[slot].args[1]] for slot in level]
+        if all(p.op == "Select" and p.args == precisions[0].args for p in precisions):
+            return precisions[0].args[0], [p.attr for p in precisions]
+        return None
+
+    @classmethod
+    def _fused_round(cls, program: Program, level):
+        values = ", ".join(f"v{program.instrs[slot].args[0]}" for slot in level)
+        gathered = cls._gathered(program, level)
+        if gathered is not None:
+            precisions = f"_select(v{gathered[0]}, {gathered[1]!r})"
+        else:
+            precisions = "t.stack([" + ", ".join(f"v{program.instrs[slot].args[1]}" for slot in level) + "], -1)"
+        targets = "".join(f"v{slot}, " for slot in level)
+        return [f"    {targets}= _round_level(_round, [{values}], {precisions})"]
+
+    def eval(self, **input_values):
+        for name in self.program.input_names:
+            if name not in input_values:
+                raise ValueError(f"Missing {name} in input values")
+        return self._fn(input_values)
@@ -1,8 +1,11 @@
 from .AbstractEval import AbstractEval
 from ..node import DagNode
+import numpy as np
 
 class IAEval(AbstractEval):
     def eval_Constant(self, node: DagNode):
+        if isinstance(node.value, (list, tuple)):
+            return np.asarray(node.value, dtype=float)
         return node.value
 
     def eval_Add(self, a, b, node: DagNode):
@@ -15,4 +18,13 @@ class IAEval(AbstractEval):
         return a * b
 
     def eval_Select(self, a, node: DagNode):
-        raise NotImplementedError("TODO")
+        return a[node.index]
+
+    def eval_Sum(self, a, node: DagNode):
+        return a.sum(axis=-1)
+
+    def eval_Dot(self, a, b, node: DagNode):
+        return (a * b).sum(axis=-1)
+
+    def eval_MatMul(self, a, b, node: DagNode):
+        return a @ b
@@ -1,18 +1,34 @@
 from .AbstractEval import AbstractEval
 from ..node import DagNode
+import numpy as np
+
+
+def _array(x):
+    # Vectors may be given as (nested) lists, which must not concatenate or repeat
+    return np.asarray(x) if isinstance(x, (list, tuple)) else x
+
 
 class NumEval(AbstractEval):
     def eval_Constant(self, node: DagNode):
         return node.value
 
     def eval_Add(self, a, b, node: DagNode):
-        return a + b
+        return _array(a) + _array(b)
 
     def eval_Sub(self, a, b, node: DagNode):
-        return a - b
+        return _array(a) - _array(b)
 
     def eval_Mul(self, a, b, node: DagNode):
-        return a * b
+        return _array(a) * _array(b)
 
     def eval_Select(self, a, node: DagNode):
         return a[node.index]
+
+    def eval_Sum(self, a, node: DagNode):
+        return np.sum(a, axis=-1)
+
+    def eval_Dot(self, a, b, node: DagNode):
+        return np.sum(np.multiply(a, b), axis=-1)
+
+    def eval_MatMul(self, a, b, node: DagNode):
+        return np.matmul(a, b)
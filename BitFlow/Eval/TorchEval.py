@@ -26,3 +26,12 @@ class TorchEval(AbstractEval):
             return a[node.index]
         else:
             return a[:, node.index]
+
+    def eval_Sum(self, a, node: DagNode):
+        return a.sum(-1)
+
+    def eval_Dot(self, a, b, node: DagNode):
+        return (a * b).sum(-1)
+
+    def eval_MatMul(self, a, b, node: DagNode):
+        return t.matmul(a, b)
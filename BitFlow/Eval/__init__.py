@@ -1,2 +1,3 @@
 from .NumEval import NumEval
 from .IAEval import IAEval
+from .AAEval import AAEval
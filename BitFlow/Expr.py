@@ -0,0 +1,407 @@
+import math
+import numpy as np
+from .IA import IntervalArray
+
+'''
+Symbolic expressions for the area and error models.
+
+Expressions are nodes of an ExprGraph, which hash-conses them: building the same
+expression twice returns the same node, so common subexpressions are shared and
+each is evaluated once. Constants are folded and like terms of sums are merged
+while building. A graph compiles to a straight-line python function over a vector
+of variables (numpy or torch), and to its analytic gradient.
+
+The "vector" backend evaluates an expression one depth level at a time instead: each
+level is a few gathers and reductions over the values of the levels below it, so a
+call runs a number of torch ops that follows the depth of the expression, not its
+size (which keeps autograd graphs small when training over W).
+'''
+
+LN2 = math.log(2)
+
+
+class Expr:
+    __slots__ = ("graph", "op", "args", "value", "id")
+
+    def __init__(self, graph, op, args, value, id):
+        self.graph = graph
+        self.op = op
+        self.args = args
+        self.value = value
+        self.id = id
+
+    def __add__(self, rhs):
+        return self.graph.add(self, rhs)
+
+    __radd__ = __add__
+
+    def __sub__(self, rhs):
+        return self.graph.sub(self, rhs)
+
+    def __rsub__(self, lhs):
+        return self.graph.sub(lhs, self)
+
+    def __mul__(self, rhs):
+        return self.graph.mul(self, rhs)
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return self.graph.mul(-1.0, self)
+
+    def __str__(self):
+        strs = {}
+        for node in topological_order([self]):
+            args = [strs[arg.id] for arg in node.args]
+            if node.op == "const":
+                s = repr(node.value)
+            elif node.op == "var":
+                s = node.value
+            elif node.op == "add":
+                s = "(" + " + ".join(args) + ")"
+            elif node.op == "mul":
+                s = "*".join(args)
+            elif node.op == "max":
+                s = f"max({args[0]}, {args[1]})"
+            elif node.op == "exp2":
+                s = f"2**{args[0]}"
+            strs[node.id] = s
+        return strs[self.id]
+
+
+def topological_order(exprs):
+    """ Every node reachable from exprs, operands first (iterative, so deep graphs are fine) """
+    order = []
+    seen = set()
+    for expr in exprs:
+        if expr.id in seen:
+            continue
+        seen.add(expr.id)
+        stack = [(expr, iter(expr.args))]
+        while stack:
+            node, args = stack[-1]
+            for arg in args:
+                if arg.id not in seen:
+                    seen.add(arg.id)
+                    stack.append((arg, iter(arg.args)))
+                    break
+            else:
+                stack.pop()
+                order.append(node)
+    return order
+
+
+class ExprGraph:
+    def __init__(self):
+        self.table = {}
+        self.num_nodes = 0
+
+    def _make(self, op, args=(), value=None):
+        key = (op, tuple(arg.id for arg in args), value)
+        node = self.table.get(key)
+        if node is None:
+            node = Expr(self, op, args, value, self.num_nodes)
+            self.num_nodes += 1
+            self.table[key] = node
+        return node
+
+    def _wrap(self, x):
+        if isinstance(x, Expr):
+            assert x.graph is self
+            return x
+        return self.const(x)
+
+    def const(self, value):
+        return self._make("const", value=float(value))
+
+    def var(self, name):
+        return self._make("var", value=name)
+
+    def _split_coefficient(self, x):
+        # c*rest -> (rest, c)
+        if x.op == "mul" and x.args[0].op == "const":
+            rest = x.args[1:]
+            return (rest[0] if len(rest) == 1 else self._make("mul", rest)), x.args[0].value
+        return x, 1.0
+
+    def add(self, *args):
+        args = [self._wrap(arg) for arg in args]
+        const = 0.0
+        coefficients = {}
+        terms = {}
+        stack = list(reversed(args))
+        while stack:
+            arg = stack.pop()
+            if arg.op == "add":
+                stack.extend(reversed(arg.args))
+            elif arg.op == "const":
+                const += arg.value
+            else:
+                term, c = self._split_coefficient(arg)
+                terms[term.id] = term
+                coefficients[term.id] = coefficients.get(term.id, 0.0) + c
+
+        new_args = []
+        for (id, term) in sorted(terms.items()):
+            c = coefficients[id]
+            if c != 0:
+                new_args.append(term if c == 1 else self.mul(c, term))
+        if const != 0 or not new_args:
+            new_args.insert(0, self.const(const))
+        if len(new_args) == 1:
+            return new_args[0]
+        return self._make("add", tuple(new_args))
+
+    def sub(self, a, b):
+        return self.add(a, self.mul(-1.0, b))
+
+    def mul(self, *args):
+        args = [self._wrap(arg) for arg in args]
+        const = 1.0
+        factors = []
+        stack = list(reversed(args))
+        while stack:
+            arg = stack.pop()
+            if arg.op == "mul":
+                stack.extend(reversed(arg.args))
+            elif arg.op == "const":
+                const *= arg.value
+            else:
+                factors.append(arg)
+
+        if const == 0:
+            return self.const(0.0)
+        factors.sort(key=lambda x: x.id)
+        if not factors:
+            return self.const(const)
+        if const == 1 and len(factors) == 1:
+            return factors[0]
+        if const != 1:
+            # distribute constants over sums so that like terms can merge
+            if len(factors) == 1 and factors[0].op == "add":
+                return self.add(*(self.mul(const, arg) for arg in factors[0].args))
+            factors.insert(0, self.const(const))
+        return self._make("mul", tuple(factors))
+
+    def max(self, a, b):
+        a, b = self._wrap(a), self._wrap(b)
+        if a is b:
+            return a
+        if a.op == "const" and b.op == "const":
+            return self.const(max(a.value, b.value))
+        # operands are not reordered: ties resolve to the first one, like python's max
+        return self._make("max", (a, b))
+
+    def exp2(self, a):
+        a = self._wrap(a)
+        if a.op == "const":
+            return self.const(2.0 ** a.value)
+        return self._make("exp2", (a,))
+
+
+def _torch_max(a, b):
+    import torch
+    a, b = torch.as_tensor(a), torch.as_tensor(b)
+    return torch.where(b > a, b, a)
+
+
+def _torch_namespace():
+    return {"_max": _torch_max, "_exp2": lambda a: 2.0 ** a}
+
+
+def _numpy_namespace():
+    return {"_max": lambda a, b: np.where(b > a, b, a), "_exp2": np.exp2}
+
+
+def _interval_max(a, b):
+    (a_lo, a_hi), (b_lo, b_hi) = IntervalArray._bounds(a), IntervalArray._bounds(b)
+    return IntervalArray._from_bounds(np.maximum(a_lo, b_lo), np.maximum(a_hi, b_hi))
+
+
+def _interval_exp2(a):
+    # exp2 is monotone, so the bounds map to the bounds
+    return IntervalArray._from_bounds(np.exp2(a.lo), np.exp2(a.hi))
+
+
+def _interval_namespace():
+    return {"_max": _interval_max, "_exp2": _interval_exp2}
+
+
+_namespaces = {
+    "numpy": _numpy_namespace,
+    "torch": _torch_namespace,
+    "interval": _interval_namespace,
+}
+
+
+def _pack(grads):
+    return np.stack(np.broadcast_arrays(*(np.asarray(g, dtype=float) for g in grads)))
+
+
+def _variable_indices(variables):
+    if isinstance(variables, dict):
+        return variables
+    return {name: i for (i, name) in enumerate(variables)}
+
+
+def variable_count(variables):
+    """ Length of the vector x for variables (a list of names or a dict of name to index) """
+    indices = _variable_indices(variables)
+    return max(indices.values()) + 1 if indices else 0
+
+
+def _forward_lines(order, indices):
+    lines = []
+    for node in order:
+        args = [f"t{arg.id}" for arg in node.args]
+        if node.op == "const":
+            expr = repr(node.value)
+        elif node.op == "var":
+            if node.value not in indices:
+                raise KeyError(f"Unknown variable {node.value}")
+            expr = f"x[{indices[node.value]}]"
+        elif node.op == "add":
+            expr = " + ".join(args)
+        elif node.op == "mul":
+            expr = " * ".join(args)
+        elif node.op == "max":
+            expr = f"_max({args[0]}, {args[1]})"
+        elif node.op == "exp2":
+            expr = f"_exp2({args[0]})"
+        lines.append(f"    t{node.id} = {expr}")
+    return lines
+
+
+def _compile_levels(expr: Expr, indices):
+    import torch
+    order = topological_order([expr])
+    depths = {}
+    for node in order:
+        depths[node.id] = 1 + max((depths[arg.id] for arg in node.args), default=-1)
+
+    # Slots of the value table: 0.0 and 1.0 (padding of sums and products), the
+    # constants, the variables, then every level grouped by op and (rounded up to a
+    # power of two, so long sums do not pad short ones) by number of operands
+    consts = [node for node in order if node.op == "const"]
+    variables = [node for node in order if node.op == "var"]
+    for node in variables:
+        if node.value not in indices:
+            raise KeyError(f"Unknown variable {node.value}")
+    slots = {}
+    for node in consts + variables:
+        slots[node.id] = len(slots) + 2
+    const_values = torch.tensor([0.0, 1.0] + [node.value for node in consts], dtype=torch.float64)
+    var_index = torch.tensor([indices[node.value] for node in variables], dtype=torch.long)
+
+    levels = []
+    for depth in range(1, depths[expr.id] + 1):
+        groups = {}
+        for node in order:
+            if depths[node.id] == depth:
+                groups.setdefault((node.op, (len(node.args) - 1).bit_length()), []).append(node)
+        steps = []
+        for ((op, _), nodes) in sorted(groups.items()):
+            width = max(len(node.args) for node in nodes)
+            pad = 0 if op == "add" else 1
+            index = torch.tensor([[slots[arg.id] for arg in node.args] + [pad] * (width - len(node.args))
+                                  for node in nodes], dtype=torch.long)
+            steps.append((op, index))
+            for node in nodes:
+                slots[node.id] = len(slots) + 2
+        levels.append(steps)
+    result = slots[expr.id]
+
+    def _fn(x):
+        x = torch.as_tensor(x)
+        if not x.is_floating_point():
+            x = x.to(torch.get_default_dtype())
+        batch = x.shape[1:]
+        consts = const_values.to(x).reshape((-1,) + (1,) * len(batch)).expand((-1,) + batch)
+        values = torch.cat([consts, x[var_index]])
+        for steps in levels:
+            new_values = []
+            for (op, index) in steps:
+                args = values[index]
+                if op == "add":
+                    new_values.append(args.sum(1))
+                elif op == "mul":
+                    new_values.append(args.prod(1))
+                elif op == "max":
+                    a, b = args[:, 0], args[:, 1]
+                    new_values.append(torch.where(b > a, b, a))
+                else:
+                    new_values.append(2.0 ** args[:, 0])
+            values = torch.cat([values] + new_values)
+        return values[result]
+
+    return _fn
+
+
+def compile_expr(expr: Expr, variables, backend="numpy"):
+    """ Compiles an expression into a function of a single vector x of variable values.
+    Args:
+        expr: The expression
+        variables: Variable names in vector order, or a dict mapping names to indices
+            (several names may share an index)
+        backend: "numpy", "torch", "vector" (torch, evaluated level by level) or
+            "interval" (x is an IntervalArray and f(x) bounds the expression over
+            the box); x may also hold extra trailing (batch) dimensions
+    Returns:
+        f(x)
+    """
+    indices = _variable_indices(variables)
+    if backend == "vector":
+        return _compile_levels(expr, indices)
+    namespace = _namespaces[backend]()
+    lines = ["def _fn(x):"]
+    lines += _forward_lines(topological_order([expr]), indices)
+    lines.append(f"    return t{expr.id}")
+    exec("\n".join(lines), namespace)
+    return namespace["_fn"]
+
+
+def compile_grad(expr: Expr, variables):
+    """ Compiles the analytic gradient of an expression (reverse mode, numpy).
+    Returns:
+        g(x), an array with the same shape as x
+    """
+    indices = _variable_indices(variables)
+    size = variable_count(indices)
+    namespace = _numpy_namespace()
+    namespace["_pack"] = _pack
+    namespace["LN2"] = LN2
+
+    order = topological_order([expr])
+    lines = ["def _grad(x):"]
+    lines += _forward_lines(order, indices)
+
+    adjoints = {expr.id: ["1.0"]}
+    grads = [[] for _ in range(size)]
+    for node in reversed(order):
+        if node.id not in adjoints:
+            continue
+        lines.append(f"    g{node.id} = " + " + ".join(adjoints[node.id]))
+        g = f"g{node.id}"
+        contributions = []
+        if node.op == "var":
+            grads[indices[node.value]].append(g)
+        elif node.op == "add":
+            contributions = [(arg, g) for arg in node.args]
+        elif node.op == "mul":
+            for (i, arg) in enumerate(node.args):
+                others = [f"t{other.id}" for (j, other) in enumerate(node.args) if j != i]
+                contributions.append((arg, " * ".join([g] + others)))
+        elif node.op == "max":
+            a, b = node.args
+            contributions = [(a, f"{g} * (t{b.id} <= t{a.id})"),
+                             (b, f"{g} * (t{b.id} > t{a.id})")]
+        elif node.op == "exp2":
+            contributions = [(node.args[0], f"{g} * t{node.id} * LN2")]
+        for (arg, c) in contributions:
+            if arg.op != "const":
+                adjoints.setdefault(arg.id, []).append(f"({c})")
+
+    grad_exprs = [" + ".join(g) if g else "0.0" for g in grads]
+    lines.append(f"    return _pack([{', '.join(grad_exprs)}])")
+    exec("\n".join(lines), namespace)
+    return namespace["_grad"]
@@ -1,4 +1,7 @@
 from itertools import product
+import numpy as np
+
+
 class Interval:
     def __init__(self, lo, hi):
         assert lo <= hi, f"{lo} must be less than {hi}"
@@ -8,24 +11,38 @@ class Interval:
     def __add__(self, rhs):
         if isinstance(rhs, Interval):
             return Interval(self.lo + rhs.lo, self.hi + rhs.hi)
-        else:
-            assert isinstance(rhs, int)
+        elif isinstance(rhs, (int, float)):
             return Interval(self.lo + rhs, self.hi + rhs)
+        return NotImplemented
+
+    __radd__ = __add__
 
     def __sub__(self, rhs):
         if isinstance(rhs, Interval):
             lo = self.lo - rhs.hi
             hi = self.hi - rhs.lo
             return Interval(lo, hi)
-        else:
+        elif isinstance(rhs, (int, float)):
             return Interval(self.lo - rhs, self.hi - rhs)
+        return NotImplemented
+
+    def __rsub__(self, lhs):
+        if isinstance(lhs, (int, float)):
+            return Interval(lhs - self.hi, lhs - self.lo)
+        return NotImplemented
+
+    def __neg__(self):
+        return Interval(-self.hi, -self.lo)
 
     def __mul__(self, rhs):
         if isinstance(rhs, Interval):
             poss = list(map(lambda x: x[0]*x[1], product(self.interval, rhs.interval) ))
             return Interval(min(poss), max(poss))
-        else:
-            return Interval(self.lo * rhs, self.hi *rhs)
+        elif isinstance(rhs, (int, float)):
+            return Interval(min(self.lo * rhs, self.hi * rhs), max(self.lo * rhs, self.hi * rhs))
+        return NotImplemented
+
+    __rmul__ = __mul__
 
     def __eq__(self, rhs):
         assert isinstance(rhs, Interval)
@@ -37,3 +54,123 @@ class Interval:
     @property
     def interval(self):
         return [self.lo, self.hi]
+
+
+class IntervalArray:
+    """ An array of intervals backed by two NumPy arrays of lower and upper bounds.
+    Supports +, -, * with other IntervalArrays, Intervals and constants (with NumPy
+    broadcasting), so it can be used as a value type for IAEval to propagate many
+    input boxes through a single dag walk.
+    """
+
+    # NumPy operands defer to the reflected operators instead of broadcasting over us
+    __array_ufunc__ = None
+
+    def __init__(self, lo, hi):
+        lo, hi = np.broadcast_arrays(np.asarray(lo, dtype=float),
+                                     np.asarray(hi, dtype=float))
+        assert np.all(lo <= hi), f"{lo} must be less than {hi}"
+        self.lo = lo
+        self.hi = hi
+
+    @classmethod
+    def _from_bounds(cls, lo, hi):
+        # Results of interval operations are well formed by construction
+        ret = cls.__new__(cls)
+        ret.lo = lo
+        ret.hi = hi
+        return ret
+
+    @classmethod
+    def from_intervals(cls, intervals):
+        return cls([x.lo for x in intervals], [x.hi for x in intervals])
+
+    @staticmethod
+    def _bounds(x):
+        if isinstance(x, (IntervalArray, Interval)):
+            return x.lo, x.hi
+        elif isinstance(x, (int, float, np.number, np.ndarray)):
+            return x, x
+        return None
+
+    def __add__(self, rhs):
+        bounds = self._bounds(rhs)
+        if bounds is None:
+            return NotImplemented
+        lo, hi = bounds
+        return IntervalArray._from_bounds(self.lo + lo, self.hi + hi)
+
+    __radd__ = __add__
+
+    def __sub__(self, rhs):
+        bounds = self._bounds(rhs)
+        if bounds is None:
+            return NotImplemented
+        lo, hi = bounds
+        return IntervalArray._from_bounds(self.lo - hi, self.hi - lo)
+
+    def __rsub__(self, lhs):
+        bounds = self._bounds(lhs)
+        if bounds is None:
+            return NotImplemented
+        lo, hi = bounds
+        return IntervalArray._from_bounds(lo - self.hi, hi - self.lo)
+
+    def __neg__(self):
+        return IntervalArray._from_bounds(-self.hi, -self.lo)
+
+    def __mul__(self, rhs):
+        bounds = self._bounds(rhs)
+        if bounds is None:
+            return NotImplemented
+        lo, hi = bounds
+        p0, p1 = self.lo * lo, self.lo * hi
+        p2, p3 = self.hi * lo, self.hi * hi
+        return IntervalArray._from_bounds(
+            np.minimum(np.minimum(p0, p1), np.minimum(p2, p3)),
+            np.maximum(np.maximum(p0, p1), np.maximum(p2, p3)))
+
+    __rmul__ = __mul__
+
+    def __getitem__(self, index):
+        return IntervalArray._from_bounds(self.lo[index], self.hi[index])
+
+    def sum(self, axis=-1):
+        return IntervalArray._from_bounds(np.sum(self.lo, axis=axis), np.sum(self.hi, axis=axis))
+
+    def __matmul__(self, rhs):
+        # Matrix product over the last two axes (leading axes are broadcast)
+        bounds = self._bounds(rhs)
+        if bounds is None:
+            return NotImplemented
+        lo, hi = bounds
+        rhs = IntervalArray._from_bounds(np.asarray(lo), np.asarray(hi))
+        return (self[..., :, :, None] * rhs[..., None, :, :]).sum(axis=-2)
+
+    def __rmatmul__(self, lhs):
+        return IntervalArray._from_bounds(np.asarray(lhs), np.asarray(lhs)) @ self
+
+    def __len__(self):
+        return len(self.lo)
+
+    @property
+    def shape(self):
+        return self.lo.shape
+
+    @property
+    def width(self):
+        return self.hi - self.lo
+
+    def __eq__(self, rhs):
+        assert isinstance(rhs, IntervalArray)
+        return np.array_equal(self.lo, rhs.lo) and np.array_equal(self.hi, rhs.hi)
+
+    def __str__(self):
+        return "[" + ", ".join(str(x) for x in self.to_intervals()) + "]"
+
+    def hull(self):
+        """ The smallest Interval containing every interval of the array """
+        return Interval(float(np.min(self.lo)), float(np.max(self.hi)))
+
+    def to_intervals(self):
+        return [Interval(lo, hi) for (lo, hi) in zip(self.lo.ravel().tolist(), self.hi.ravel().tolist())]
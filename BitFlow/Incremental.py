@@ -0,0 +1,236 @@
+import hashlib
+from collections import OrderedDict, deque
+import numpy as np
+
+from .node import Dag, Input, Constant, Select
+from .IA import Interval, IntervalArray
+from .Eval.NumEval import NumEval
+from .Expr import ExprGraph, compile_expr
+from .Optimization import BitFlowVisitor, BitFlowOptimizer
+from .Program import Program
+from .Serialization import dumps
+
+'''
+Incremental range, error and area analysis.
+
+Design-space exploration edits a dag many times (a constant here, an output there),
+and each edit used to mean evaluating and analysing the whole dag again. Here every
+node gets a Merkle signature: its kind, name and attribute (for inputs, the value
+bound to them) together with the signatures of its children, hash-consed into a
+small integer so equal signatures are matched exactly. The results of a node (its
+value, integer bits, error and area terms) are cached by signature, so analysing an
+edited dag only recomputes the nodes whose signature changed, i.e. the edited nodes
+and their downstream cone. Expressions are built in one persistent ExprGraph, so
+unchanged error and area expressions are the same nodes as before and their compiled
+functions are reused as well. Results are kept for the nodes of the last few dags
+analysed, so memory stays bounded however many versions are explored.
+
+AnalysisCache sits in front of this: it keeps the complete analyses of the most
+recently used (dag, input values) pairs, so repeating a run skips the analysis.
+Both are opt-in: BitFlow only caches analyses in the one it is given (analysis=).
+
+Dags are analysed before Round nodes are added (see AddRoundNodes).
+'''
+
+
+def _value_key(x):
+    # Hashable, content-based key of an input or constant value
+    if isinstance(x, (list, tuple)):
+        return tuple(_value_key(v) for v in x)
+    if isinstance(x, Interval):
+        return ("Interval", x.lo, x.hi)
+    if isinstance(x, IntervalArray):
+        return ("IntervalArray", x.shape, x.lo.tobytes(), x.hi.tobytes())
+    if isinstance(x, np.ndarray):
+        return ("array", x.shape, str(x.dtype), x.tobytes())
+    return x
+
+
+class _CompiledCache:
+    """ LRU cache of compile_expr results, keyed by the expression (and its graph), the
+    variables and the backend
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def compile(self, expr, variables, backend):
+        names = tuple(variables.items()) if isinstance(variables, dict) else tuple(variables)
+        key = (expr.graph, expr.id, names, backend)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        else:
+            self.entries[key] = compile_expr(expr, variables, backend)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return self.entries[key]
+
+
+class IncrementalAnalysis:
+    """ Analyses successive versions of a dag, reusing the results of unchanged cones.
+    Attributes:
+        graph: The ExprGraph every error and area expression is built in
+        hits, misses: Number of nodes reused / analysed by the last call to analyze
+    """
+
+    def __init__(self, evaluator=NumEval, max_versions=8, max_compiled=32):
+        """
+        Args:
+            evaluator: Evaluator class of the analyses
+            max_versions: Number of most recently analysed dags whose node results are
+                kept (results that none of them use are dropped)
+            max_compiled: Number of compiled functions kept
+        """
+        self.evaluator = evaluator
+        self.graph = ExprGraph()
+        self.signatures = {}
+        self.results = {}
+        self.versions = deque(maxlen=max_versions)
+        self.compiled = _CompiledCache(max_compiled)
+        self.next_signature = 0
+        self.hits = 0
+        self.misses = 0
+
+    def signature(self, node, children, input_values):
+        if isinstance(node, Input):
+            attr = _value_key(input_values[node.name])
+        elif isinstance(node, Constant):
+            attr = _value_key(node.value)
+        elif isinstance(node, Select):
+            attr = node.index
+        else:
+            attr = None
+        key = (node.kind()[0], node.name, attr, children)
+        sig = self.signatures.get(key)
+        if sig is None:
+            sig = self.signatures[key] = self.next_signature
+            self.next_signature += 1
+        return sig
+
+    def analyze(self, dag: Dag, **input_values):
+        """ Evaluates and analyses a dag like NumEval(dag).eval(**input_values) followed by
+        BitFlowVisitor(node_values).run(dag), recomputing only nodes not seen before.
+        Returns:
+            (evaluator, visitor)
+        """
+        for dag_input in dag.inputs:
+            if dag_input.name not in input_values:
+                raise ValueError(f"Missing {dag_input} in input values")
+
+        evaluator = self.evaluator(dag)
+        evaluator.input_values = input_values
+        evaluator.node_values = {}
+        visitor = BitFlowVisitor(evaluator.node_values)
+        visitor.graph = self.graph
+
+        self.hits = self.misses = 0
+        signatures = {}
+        for node in Program.topological_order(dag):
+            sig = self.signature(node, tuple(signatures[child] for child in node.children()), input_values)
+            signatures[node] = sig
+            result = self.results.get(sig)
+            if result is None:
+                num_terms = len(visitor.area_terms)
+                evaluator.visit(node)
+                visitor.visit(node)
+                result = (evaluator.node_values[node], visitor.IBs.get(node.name),
+                          visitor.errors.get(node.name), visitor.area_terms[num_terms:])
+                self.results[sig] = result
+                self.misses += 1
+            else:
+                value, ib, error, area_terms = result
+                evaluator.node_values[node] = value
+                if ib is not None:
+                    visitor.IBs[node.name] = ib
+                if error is not None:
+                    visitor.errors[node.name] = error
+                visitor.area_terms.extend(area_terms)
+                self.hits += 1
+        self._keep(set(signatures.values()))
+        return evaluator, visitor
+
+    def _keep(self, signatures):
+        # Drops the results (and signatures) that none of the kept versions use
+        evicted = len(self.versions) == self.versions.maxlen
+        self.versions.append(signatures)
+        if evicted:
+            live = set().union(*self.versions)
+            self.results = {sig: result for (sig, result) in self.results.items() if sig in live}
+            self.signatures = {key: sig for (key, sig) in self.signatures.items() if sig in live}
+
+    def optimizer(self, dag: Dag, outputs, **input_values):
+        """ A BitFlowOptimizer of the dag (see analyze) """
+        evaluator, visitor = self.analyze(dag, **input_values)
+        return BitFlowOptimizer(evaluator, outputs, visitor)
+
+    def compile(self, expr, variables, backend="numpy"):
+        """ compile_expr, reusing the function compiled for an unchanged expression """
+        return self.compiled.compile(expr, variables, backend)
+
+
+def _analyze(evaluator_cls, dag, input_values):
+    evaluator = evaluator_cls(dag)
+    evaluator.eval(**input_values)
+    visitor = BitFlowVisitor(evaluator.node_values)
+    visitor.run(dag)
+    return evaluator, visitor
+
+
+class AnalysisCache:
+    """ LRU cache of complete analyses (evaluated values, integer bits, errors and area
+    model), keyed by the dag (structure and names) and the values bound to its inputs.
+    Attributes:
+        hits, misses: Number of analyses reused / run so far
+    """
+
+    def __init__(self, maxsize=32, analysis=None, evaluator=NumEval):
+        """
+        Args:
+            maxsize: Number of analyses kept
+            analysis: Optional IncrementalAnalysis that runs the analyses not cached, so
+                edited dags still reuse their unchanged cones
+            evaluator: Evaluator class of the analyses (that of analysis, if given)
+        """
+        self.maxsize = maxsize
+        self.analysis = analysis
+        self.evaluator = evaluator if analysis is None else analysis.evaluator
+        self.entries = OrderedDict()
+        # The constraint functions of a few analyses each
+        self.compiled = _CompiledCache(4 * maxsize)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, dag: Dag, input_values):
+        values = sorted((name, _value_key(value)) for (name, value) in input_values.items())
+        spec = repr((self.evaluator.__name__, dumps(dag), values))
+        return hashlib.sha256(spec.encode()).hexdigest()
+
+    def analyze(self, dag: Dag, **input_values):
+        """ Returns (evaluator, visitor), as IncrementalAnalysis.analyze; cached results
+        must not be modified
+        """
+        key = self.key(dag, input_values)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if self.analysis is None:
+            entry = _analyze(self.evaluator, dag, input_values)
+        else:
+            entry = self.analysis.analyze(dag, **input_values)
+        self.entries[key] = entry
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        self.misses += 1
+        return entry
+
+    def optimizer(self, dag: Dag, outputs, **input_values):
+        """ A BitFlowOptimizer of the dag (see analyze) """
+        evaluator, visitor = self.analyze(dag, **input_values)
+        return BitFlowOptimizer(evaluator, outputs, visitor)
+
+    def compile(self, expr, variables, backend="numpy"):
+        """ compile_expr, reusing the function compiled for the same expression """
+        return self.compiled.compile(expr, variables, backend)
@@ -1,29 +1,77 @@
-from .node import Input, Constant, Dag, Add, Sub, Mul, DagNode, Select
-from DagVisitor import Visitor
-from .IA import Interval
+from .node import Input, Constant, Dag, Add, Sub, Mul, DagNode, Select, Sum, Dot, MatMul
+from .IA import Interval, IntervalArray
+from .AA import AInterval, AIntervalArray
 from .Eval.IAEval import IAEval
 from .Eval.NumEval import NumEval
 from math import log2, ceil
+import numpy as np
 from .Precision import PrecisionNode
+from .Program import Program
+from .Expr import ExprGraph, compile_expr, compile_grad, variable_count
+from .BranchAndBound import branch_and_bound
 from scipy.optimize import fsolve, minimize, basinhopping
 
 
-class BitFlowVisitor(Visitor):
+class BitFlowVisitor:
     def __init__(self, node_values):
         self.node_values = node_values
         self.errors = {}
         self.IBs = {}
-        self.area_fn = ""
+        self.graph = ExprGraph()
+        self.area_terms = []
+
+    def run(self, dag: Dag):
+        # Children first, without recursion, so arbitrarily deep dags can be analysed
+        for node in Program.topological_order(dag):
+            self.visit(node)
+        return self
+
+    def visit(self, node: DagNode):
+        """ Analyses one node whose children are already analysed """
+        for kind in node.kind():
+            visit_kind = getattr(self, f"visit_{kind}", None)
+            if visit_kind is not None:
+                visit_kind(node)
+                return
+
+    def range_of(self, node):
+        """ The value of a node, with affine forms and interval arrays collapsed to an Interval """
+        x = self.node_values[node]
+        if isinstance(x, (AInterval, AIntervalArray)):
+            x = x.to_interval()
+        if isinstance(x, IntervalArray):
+            x = x.hull()
+        if isinstance(x, (list, tuple, np.ndarray)):
+            x = Interval(float(np.min(x)), float(np.max(x)))
+        return x
+
+    def shape_of(self, node):
+        x = self.node_values[node]
+        if isinstance(x, (IntervalArray, AIntervalArray)):
+            return x.shape
+        return np.shape(x)
+
+    def magnitude(self, node):
+        x = self.range_of(node)
+        if isinstance(x, Interval):
+            return max(abs(x.lo), abs(x.hi))
+        return x
 
     def handleIB(self, node):
         ib = 0
-        x = self.node_values[node]
-        if isinstance(x, Interval):
-            alpha = 2 if (log2(abs(x.hi)).is_integer()) else 1
-            ib = ceil(log2(max(abs(x.lo), abs(x.hi)))) + alpha
+        x = self.range_of(node)
+        if not isinstance(x, Interval):
+            x = Interval(x, x)
+        hi = abs(x.hi)
+        magnitude = max(abs(x.lo), hi)
+        if magnitude == 0:
+            # Only zero: a sign bit
+            ib = 1
         else:
-            alpha = 2 if (log2(abs(x)).is_integer()) else 1
-            ib = ceil(log2(abs(x))) + alpha
+            # A positive power of two needs one bit more than its negation, unless a
+            # larger negative bound sets the magnitude
+            alpha = 2 if hi == magnitude and log2(magnitude).is_integer() else 1
+            ib = ceil(log2(magnitude)) + alpha
         self.IBs[node.name] = int(ib)
 
     def getChildren(self, node):
@@ -36,69 +84,97 @@ class BitFlowVisitor(Visitor):
     def visit_Input(self, node: Input):
         self.handleIB(node)
 
-        val = 0
-        if isinstance(self.node_values[node], Interval):
-            x = self.node_values[node]
-            val = max(abs(x.lo), abs(x.hi))
-        else:
-            val = self.node_values[node]
-
-        self.errors[node.name] = PrecisionNode(val, node.name, [])
+        self.errors[node.name] = PrecisionNode(self.magnitude(node), node.name, [])
 
     def visit_Select(self, node: Select):
-        Visitor.generic_visit(self, node)
+        # Selecting is exact: the element has the error of its tensor
+        self.handleIB(node)
+        child = next(node.children())
+        self.errors[node.name] = PrecisionNode(self.magnitude(node), node.name, self.errors[child.name].error)
 
     def visit_Constant(self, node: Constant):
         self.handleIB(node)
 
-        val = self.node_values[node]
-        self.errors[node.name] = PrecisionNode(val, node.name, [])
+        self.errors[node.name] = PrecisionNode(self.magnitude(node), node.name, [])
 
     def visit_Add(self, node: Add):
-        Visitor.generic_visit(self, node)
-
         self.handleIB(node)
         lhs, rhs = self.getChildren(node)
         self.errors[node.name] = self.errors[lhs.name].add(
             self.errors[rhs.name], node.name)
-        # self.area_fn += f"+m.max2({self.IBs[lhs.name]} + {lhs.name}, {self.IBs[rhs.name]} + {rhs.name})"
-        self.area_fn += f"+max({self.IBs[lhs.name]} + {lhs.name}, {self.IBs[rhs.name]} + {rhs.name})"
+        self.area_terms.append(self.graph.max(
+            self.IBs[lhs.name] + self.graph.var(lhs.name), self.IBs[rhs.name] + self.graph.var(rhs.name)))
 
     def visit_Sub(self, node: Sub):
-        Visitor.generic_visit(self, node)
-
         self.handleIB(node)
         lhs, rhs = self.getChildren(node)
         self.errors[node.name] = self.errors[lhs.name].sub(
             self.errors[rhs.name], node.name)
-        # self.area_fn += f"+m.max2({self.IBs[lhs.name]} + {lhs.name}, {self.IBs[rhs.name]} + {rhs.name})"
-        self.area_fn += f"+max({self.IBs[lhs.name]} + {lhs.name}, {self.IBs[rhs.name]} + {rhs.name})"
+        self.area_terms.append(self.graph.max(
+            self.IBs[lhs.name] + self.graph.var(lhs.name), self.IBs[rhs.name] + self.graph.var(rhs.name)))
 
     def visit_Mul(self, node: Mul):
-        Visitor.generic_visit(self, node)
-
         self.handleIB(node)
         lhs, rhs = self.getChildren(node)
         self.errors[node.name] = self.errors[lhs.name].mul(
             self.errors[rhs.name], node.name)
-        self.area_fn += f"+1 * ({self.IBs[lhs.name]} + {lhs.name})*({self.IBs[rhs.name]} + {rhs.name})"
+        self.area_terms.append(
+            (self.IBs[lhs.name] + self.graph.var(lhs.name)) * (self.IBs[rhs.name] + self.graph.var(rhs.name)))
+
+    # Vector ops are charged for every scalar operation they stand for: each of the
+    # output elements (the product of its shape) reduces length terms of the last axis
+
+    def width(self, node):
+        return self.IBs[node.name] + self.graph.var(node.name)
+
+    def dot_area(self, lhs, rhs, length, count):
+        product = self.width(lhs) + self.width(rhs)
+        return count * (length * (self.width(lhs) * self.width(rhs)) + (length - 1) * product)
+
+    def visit_Sum(self, node: Sum):
+        self.handleIB(node)
+        child = next(node.children())
+        length = self.shape_of(child)[-1]
+        self.errors[node.name] = self.errors[child.name].sum(length, node.name)
+        self.area_terms.append(int(np.prod(self.shape_of(node))) * (length - 1) * self.width(child))
+
+    def visit_Dot(self, node: Dot):
+        self.handleIB(node)
+        lhs, rhs = self.getChildren(node)
+        length = max(self.shape_of(lhs)[-1:] + self.shape_of(rhs)[-1:])
+        self.errors[node.name] = self.errors[lhs.name].dot(
+            self.errors[rhs.name], length, node.name)
+        self.area_terms.append(self.dot_area(lhs, rhs, length, int(np.prod(self.shape_of(node)))))
+
+    def visit_MatMul(self, node: MatMul):
+        self.handleIB(node)
+        lhs, rhs = self.getChildren(node)
+        length = self.shape_of(lhs)[-1]
+        self.errors[node.name] = self.errors[lhs.name].dot(
+            self.errors[rhs.name], length, node.name)
+        self.area_terms.append(self.dot_area(lhs, rhs, length, int(np.prod(self.shape_of(node)))))
+
+    @property
+    def area_fn(self):
+        return self.graph.add(*self.area_terms)
 
 
 class BitFlowOptimizer():
-    def __init__(self, evaluator, outputs):
+    def __init__(self, evaluator, outputs, visitor=None):
+        # visitor: an already run BitFlowVisitor of the evaluator's values (see Incremental.py)
 
         node_values = evaluator.node_values
-        visitor = BitFlowVisitor(node_values)
-        visitor.run(evaluator.dag)
+        if visitor is None:
+            visitor = BitFlowVisitor(node_values)
+            visitor.run(evaluator.dag)
 
         self.visitor = visitor
-        self.error_fn = ""
-        self.ufb_fn = ""
-        for output in outputs:
-            self.error_fn += f"+2**(-{outputs[output]}-1) - (" + \
-                visitor.errors[output].getExecutableError() + ")"
-            self.ufb_fn += visitor.errors[output].getExecutableUFB()
-        self.area_fn = visitor.area_fn[1:]
+        graph = visitor.graph
+        self.error_fn = graph.add(*(2**(-outputs[output]-1) - visitor.errors[output].getErrorExpr(graph)
+                                    for output in outputs))
+        self.ufb_fn = graph.add(*(visitor.errors[output].getUFBExpr(graph) - 2**(-outputs[output]-1)
+                                  for output in outputs))
+        self.area_fn = visitor.area_fn
         self.outputs = outputs
 
         vars = list(visitor.node_values)
@@ -106,20 +182,22 @@ class BitFlowOptimizer():
             vars[i] = var.name
         self.vars = vars
 
+    def set_solution(self, variables, solution):
+        if not isinstance(variables, dict):
+            variables = {var: i for (i, var) in enumerate(variables)}
+        self.solution = list(solution)
+        self.fb_sols = {var: solution[i] for (var, i) in variables.items()}
+        for key in self.fb_sols:
+            print(f"{key}: {self.fb_sols[key]}")
+
     def calculateInitialValues(self):
         #print("CALCULATING INITIAL VALUES USING UFB METHOD...")
-        # bnd = f"{-2**(-self.output_precision-1)} == 0"
-        bnd = ""
-        for output in self.outputs:
-            bnd += f"{-2**(-self.outputs[output]-1)}"
-        self.ufb_fn += bnd
         #print(f"UFB EQ: {self.ufb_fn}")
         # print(f"-----------")
 
-        exec(f'''def UFBOptimizerFn(UFB):
-             return  {self.ufb_fn}''', globals())
+        UFBOptimizerFn = compile_expr(self.ufb_fn, ["UFB"])
 
-        sol = ceil(fsolve(UFBOptimizerFn, 0.01))
+        sol = ceil(fsolve(lambda UFB: [UFBOptimizerFn(UFB)], 0.01)[0])
         self.initial = sol
 
         # m = GEKKO()
@@ -137,7 +215,18 @@ class BitFlowOptimizer():
         # self.initial = sol
         # print(f"UFB = {sol}\n")
 
-    def solve(self):
+    def solve(self, method="basinhopping", time_limit=60, slots=None):
+        """ Solves for the fractional bits of every node.
+        Args:
+            method: "basinhopping" (continuous SLSQP, rounded up) or "bnb" (exact
+                integer branch and bound, see BranchAndBound.py)
+            time_limit: Seconds allowed for "bnb", after which the best feasible
+                solution found so far is returned (None searches until optimal,
+                which can take exponential time)
+            slots: Optional dict of node name to W index (see AddRoundNodes); nodes
+                sharing a slot are solved for as one variable
+        Sets fb_sols (node name to fractional bits) and solution (the W vector).
+        """
         self.calculateInitialValues()
         print("SOLVING AREA/ERROR...")
         # self.error_fn = f"2**(-{self.output_precision}-1)>=" + self.error_fn
@@ -150,33 +239,40 @@ class BitFlowOptimizer():
         for var in self.vars:
             if var not in self.outputs:
                 filtered_vars.append(var)
-
-        exec(f'''def ErrorConstraintFn(x):
-             {','.join(filtered_vars)} = x
-             return  {self.error_fn}''', globals())
-
-        exec(f'''def AreaOptimizerFn(x):
-             {','.join(filtered_vars)} = x
-             return  {self.area_fn}''', globals())
-
-        x0 = [self.initial for i in range(len(filtered_vars))]
-        bounds = [(0, 64) for i in range(len(filtered_vars))]
-
-        con = {'type': 'ineq', 'fun': ErrorConstraintFn}
+        if slots is not None:
+            filtered_vars = {var: slots[var] for var in filtered_vars}
+
+        if method == "bnb":
+            solution, self.optimal = branch_and_bound(
+                self.area_fn, self.error_fn, filtered_vars, 0, 64, time_limit)
+            if solution is None and self.optimal:
+                raise ValueError("No precisions in [0, 64] satisfy the error constraint")
+            if solution is None:
+                raise ValueError(f"No precisions satisfying the error constraint found in {time_limit}s")
+            self.set_solution(filtered_vars, solution)
+            return
+        elif method != "basinhopping":
+            raise ValueError(f"Unknown method {method}")
+
+        ErrorConstraintFn = compile_expr(self.error_fn, filtered_vars)
+        AreaOptimizerFn = compile_expr(self.area_fn, filtered_vars)
+        # exact gradients, so SLSQP does not finite-difference every variable
+        ErrorConstraintJac = compile_grad(self.error_fn, filtered_vars)
+        AreaOptimizerJac = compile_grad(self.area_fn, filtered_vars)
+
+        x0 = [self.initial for i in range(variable_count(filtered_vars))]
+        bounds = [(0, 64) for i in range(variable_count(filtered_vars))]
+
+        con = {'type': 'ineq', 'fun': ErrorConstraintFn,
+               'jac': ErrorConstraintJac}
 
         # note: minimize uses SLSQP by default but I specify it to be explicit; we're using basinhopping to find the global minimum while using SLSQP to find local minima
         minimizer_kwargs = {'constraints': (
-            [con]), 'bounds': bounds, 'method': "SLSQP"}
+            [con]), 'bounds': bounds, 'method': "SLSQP", 'jac': AreaOptimizerJac}
         solution = basinhopping(AreaOptimizerFn, x0,
                                 minimizer_kwargs=minimizer_kwargs)
 
-        sols = dict(zip(filtered_vars, solution.x))
-
-        for key in sols:
-            sols[key] = ceil(sols[key])
-            print(f"{key}: {sols[key]}")
-
-        self.fb_sols = sols
+        self.set_solution(filtered_vars, [ceil(x) for x in solution.x])
 
         # namespace = {"m": GEKKO()}
         # m = namespace["m"]
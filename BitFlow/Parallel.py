@@ -0,0 +1,84 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import torch
+
+from .Eval.CompiledTorchEval import CompiledTorchEval
+
+'''
+Process pool evaluation of a dag.
+
+Compiled models hold exec'd code and cannot be pickled, so every worker receives the
+dag once and compiles its own copy. Work is split into chunks whose results only
+depend on the chunk (never on which worker ran it), and results are returned in chunk
+order, so a run gives the same answer for any number of workers.
+
+Workers build their model with a picklable function of the dag (by default a compiled
+torch model), so other evaluators can be spread over processes the same way.
+
+Workers are spawned, so scripts that use them need the usual
+`if __name__ == "__main__":` guard around their entry point.
+'''
+
+_model = None
+
+
+def compile_model(dag):
+    return CompiledTorchEval(dag).eval
+
+
+def _init_worker(dag, num_threads, build):
+    global _model
+    torch.set_num_threads(num_threads)
+    _model = build(dag)
+
+
+def _call(task):
+    fn, args = task
+    return fn(_model, *args)
+
+
+def pool(dag, workers, num_threads=1, build=compile_model):
+    """ A process pool whose workers each hold model = build(dag), for run_chunks.
+    Pools are context managers; reusing one saves spawning workers for every batch.
+    """
+    # spawn rather than fork: forking a process that already ran torch can deadlock
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker, initargs=(dag, num_threads, build))
+
+
+def run_chunks(executor, fn, tasks, window):
+    """ Yields fn(model, *args) for every args in tasks, in order (see map_chunks).
+    At most window tasks are submitted ahead of the result being yielded, so tasks are
+    only built as workers catch up; stopping early cancels the ones not yet started.
+    """
+    pending = deque()
+    try:
+        for args in tasks:
+            pending.append(executor.submit(_call, (fn, args)))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def map_chunks(dag, fn, tasks, workers, num_threads=1, build=compile_model):
+    """ Yields fn(model, *args) for every args in tasks, in order.
+    Args:
+        dag: The dag each worker builds its model of
+        fn: Picklable (module level) function of the model and a task's arguments
+        tasks: Iterable of argument tuples
+        workers: Number of processes
+        num_threads: Torch threads per worker
+        build: Picklable function of the dag returning the model; by default the
+            compiled torch model (called as model(**inputs))
+    """
+    executor = pool(dag, workers, num_threads, build)
+    try:
+        yield from run_chunks(executor, fn, tasks, 2 * workers)
+    finally:
+        # Stopping early (e.g. a decided verification) has cancelled the chunks not yet started
+        executor.shutdown(wait=True)
@@ -1,167 +1,248 @@
-import copy
-
 '''
 Since every instance of epsilon is only associated with precision bit error term, we can bundle them together under one class.
+
+An error is kept in canonical form: a dict mapping terms to coefficients. A first or second
+order ε-monomial is the sorted tuple of the node symbols it multiplies, so ("a",) is ε_a and
+("a", "b") is ε_a*ε_b. Like terms merge on insertion and terms that cancel are dropped.
+
+Products are only expanded where both factors are first order. Every other part of a product
+stays factored as an FPEpsilonMultiplier term, which references the error dicts of its
+operands instead of copying or expanding them. Error dicts are never modified after they are
+built, so these references are shared across nodes. An error is therefore built in time
+proportional to its distinct terms, not to the expansion of its history (a chain of squares
+would otherwise double its degree at every step). Equal products compare and hash equal, so
+two errors built the same way are equal exactly when their dicts are.
 '''
 
 
+def merge_errors(*errors, scale=1):
+    """ Sum of error dicts (each multiplied by scale), without zero terms """
+    result = {}
+    for error in errors:
+        for (term, coef) in error.items():
+            result[term] = result.get(term, 0) + coef * scale
+    return {term: coef for (term, coef) in result.items() if coef != 0}
+
+
+def split_error(error):
+    """ (first order terms, other terms) of an error dict """
+    linear, rest = {}, {}
+    for (term, coef) in error.items():
+        if isinstance(term, tuple) and len(term) == 1:
+            linear[term] = coef
+        else:
+            rest[term] = coef
+    return linear, rest
+
+
+def multiply_errors(lhs, rhs, lhs_parts=None, rhs_parts=None):
+    """ Product of two error dicts: first order products are expanded into monomials,
+    everything else is kept as factored FPEpsilonMultiplier terms.
+    Args:
+        lhs_parts, rhs_parts: split_error of lhs and rhs, if already known (sharing
+            them lets equal products share their operands)
+    """
+    lx, px = split_error(lhs) if lhs_parts is None else lhs_parts
+    ly, py = split_error(rhs) if rhs_parts is None else rhs_parts
+    result = {}
+    for (m0, c0) in lx.items():
+        for (m1, c1) in ly.items():
+            monomial = tuple(sorted(m0 + m1))
+            result[monomial] = result.get(monomial, 0) + c0 * c1
+    # (lx + px)(ly + py) = lx*ly + lx*py + ly*px + px*py
+    for (a, b) in ((lx, py), (ly, px), (px, py)):
+        if a and b:
+            term = FPEpsilonMultiplier(a, b)
+            result[term] = result.get(term, 0) + 1
+    return merge_errors(result)
+
+
+def to_error(terms):
+    """ Canonical error dict of a dict or a list of FPEpsilon/FPEpsilonMultiplier terms """
+    if isinstance(terms, dict):
+        return merge_errors(terms)
+    return merge_errors(*(term.monomials() for term in terms))
+
+
+def term_str(term):
+    if isinstance(term, FPEpsilonMultiplier):
+        return str(term)
+    return "*".join(f"ε_{node}" for node in term)
+
+
+def error_str(error):
+    return "".join(f" +{coef}*{term_str(term)}" if coef >= 0 else f" {coef}*{term_str(term)}"
+                   for (term, coef) in error.items())
+
+
+def _error_hash(error):
+    return hash(frozenset(error.items()))
+
+
 class FPEpsilon:
+    __slots__ = ("node", "val")
+
     def __init__(self, node, val=1):
         assert isinstance(node, str)
-        self.node = node
-        self.val = val
+        object.__setattr__(self, "node", node)
+        object.__setattr__(self, "val", val)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FPEpsilon is immutable")
+
+    def monomials(self):
+        return {(self.node,): self.val}
 
     def __str__(self):
         return f" +{self.val}*2^(-FB{self.node}-1)ε_{self.node}" if self.val >= 0 else f" {self.val} * 2^(FB{self.node}-1)ε_{self.node}"
 
     def __eq__(self, rhs):
-        return self.val == rhs.val
+        return self.monomials() == rhs.monomials()
 
 
 '''
-The most tricky part is multiplying two errors; this object abstracts those error multipliications
+The most tricky part is multiplying two errors; this object abstracts those error multipliications.
+Ex and Ey are the (immutable) error dicts of the operands, shared rather than copied. As a term of
+an error it stands for the product Ex*Ey; the product is commutative, so Ex and Ey may be swapped.
 '''
 
 
 class FPEpsilonMultiplier:
+    __slots__ = ("Ex", "Ey", "val", "_hash")
+
     def __init__(self, Ex, Ey, val=1):
-        assert isinstance(Ex, list)
-        assert isinstance(Ey, list)
-        self.Ex = Ex
-        self.Ey = Ey
-        self.val = val
-        self.output = ""
-
-    def generate_print(self):
-        self.output += "("
-        for err in self.Ex:
-            self.output += str(err)
-        self.output += " )("
-        for err in self.Ey:
-            self.output += str(err)
-        self.output += " ) "
-        return self.output
+        assert isinstance(Ex, (list, tuple, dict))
+        assert isinstance(Ey, (list, tuple, dict))
+        # Dicts are canonical errors and are shared; term lists are collected first
+        Ex = Ex if isinstance(Ex, dict) else to_error(Ex)
+        Ey = Ey if isinstance(Ey, dict) else to_error(Ey)
+        object.__setattr__(self, "Ex", Ex)
+        object.__setattr__(self, "Ey", Ey)
+        object.__setattr__(self, "val", val)
+        hx, hy = _error_hash(Ex), _error_hash(Ey)
+        object.__setattr__(self, "_hash", hash((min(hx, hy), max(hx, hy), val)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FPEpsilonMultiplier is immutable")
+
+    def monomials(self):
+        return merge_errors(multiply_errors(self.Ex, self.Ey), scale=self.val)
 
     def __str__(self):
-        self.output = f" +{self.val}*"
-        return self.generate_print()
-
-    def check_error_equality(self, rhs, lhs):
-        rhs_error = copy.deepcopy(rhs)
-        for err in lhs:
-            try:
-                i = rhs_error.index(err)
-                del rhs_error[i]
-            except ValueError:
-                return False
-        return rhs_error == []
+        return f"({error_str(self.Ex)} )({error_str(self.Ey)} )"
+
+    def __hash__(self):
+        return self._hash
 
     def __eq__(self, rhs):
-        return self.check_error_equality(rhs.Ex, self.Ex) and self.check_error_equality(rhs.Ey, self.Ey) and self.val == rhs.val
+        if self is rhs:
+            return True
+        if not isinstance(rhs, FPEpsilonMultiplier):
+            return NotImplemented
+        if self._hash != rhs._hash or self.val != rhs.val:
+            return False
+        return (self.Ex == rhs.Ex and self.Ey == rhs.Ey) or (self.Ex == rhs.Ey and self.Ey == rhs.Ex)
 
 
 class PrecisionNode:
     def __init__(self, val, symbol, error):
         assert isinstance(val, (int, float))
         assert isinstance(symbol, str)
-        assert isinstance(error, list)
+        assert isinstance(error, (list, tuple, dict))
 
         self.val = val
         self.symbol = symbol
-        self.error = error
-        self.error.append(FPEpsilon(symbol))
-        self.output = ""
-
-    def generate_print(self, errors):
-        for err in errors:
-            self.output += str(err)
-        return self.output
+        # Errors are never modified after construction, so nodes and products share them
+        self.error = merge_errors(to_error(error), {(symbol,): 1})
+        self._parts = None
 
     def __str__(self):
         print(f"NODE {self.symbol}:")
-        self.output = f"{self.val}"
-        return self.generate_print(self.error) + "\n"
-
-    def constructErrorFn(self, errors):
-        myfn = ""
-        for err in errors:
-            if isinstance(err, FPEpsilon):
-                if err.node == self.symbol:
-                    return myfn
-                myfn += f"+{err.val}*2**(-{err.node}-1)" if err.val > 0 else f"{err.val}*2**(-{err.node}-1)"
-            elif isinstance(err, FPEpsilonMultiplier):
-                myfn += f"+{err.val}*("
-                myfn += self.constructErrorFn(err.Ex)
-                myfn += ")*("
-                myfn += self.constructErrorFn(err.Ey)
-                myfn += ")"
-        return myfn
-
-    def constructUFBFn(self, errors):
-        myfn = ""
-        for err in errors:
-            if isinstance(err, FPEpsilon):
-                myfn += f"+{err.val}*2**(-UFB-1)" if err.val > 0 else f"{err.val}*2**(-UFB-1)"
-            elif isinstance(err, FPEpsilonMultiplier):
-                myfn += f"+{err.val}*("
-                myfn += self.constructUFBFn(err.Ex)
-                myfn += ")*("
-                myfn += self.constructUFBFn(err.Ey)
-                myfn += ")"
-        return myfn
-
-    def getExecutableError(self):
-        return self.constructErrorFn(self.error)
-
-    def getExecutableUFB(self):
-        return self.constructUFBFn(self.error)
+        return f"{self.val}" + error_str(self.error) + "\n"
+
+    def parts(self):
+        """ split_error of this node's error, computed once so products share the parts """
+        if self._parts is None:
+            self._parts = split_error(self.error)
+        return self._parts
+
+    def _own_error(self, exclude_self):
+        if not exclude_self:
+            return self.error
+        return {m: coef for (m, coef) in self.error.items() if m != (self.symbol,)}
+
+    def constructErrorExpr(self, graph, var, exclude_self):
+        # Each monomial c*ε_x*ε_y becomes c*2**(-(x+1) - (y+1)), and each product the
+        # product of its operands' expressions. memo maps shared error dicts to their
+        # expressions, so every dict is converted once however often products reference it
+        memo = {}
+
+        def expr(error):
+            key = id(error)
+            if key not in memo:
+                terms = []
+                for (term, coef) in error.items():
+                    if isinstance(term, FPEpsilonMultiplier):
+                        terms.append(coef * term.val * expr(term.Ex) * expr(term.Ey))
+                    else:
+                        exponent = graph.add(*(var(node) + 1 for node in term))
+                        terms.append(coef * graph.exp2(-exponent))
+                # keep error alive so its id is not reused while memo exists
+                memo[key] = (error, graph.add(*terms))
+            return memo[key][1]
+
+        return expr(self._own_error(exclude_self))
+
+    def getErrorExpr(self, graph):
+        """ The error of this node (without its own rounding error) as an expression of the FB variables """
+        return self.constructErrorExpr(graph, graph.var, True)
+
+    def getUFBExpr(self, graph):
+        """ The error of this node with every FB variable replaced by a single UFB variable """
+        ufb = graph.var("UFB")
+        return self.constructErrorExpr(graph, lambda node: ufb, False)
 
     def add(self, rhs, symbol):
         assert isinstance(rhs, PrecisionNode)
         assert isinstance(symbol, str)
 
-        return PrecisionNode(self.val + rhs.val, symbol, self.error + rhs.error)
+        return PrecisionNode(self.val + rhs.val, symbol, merge_errors(self.error, rhs.error))
 
     def sub(self, rhs, symbol):
         assert isinstance(rhs, PrecisionNode)
         assert isinstance(symbol, str)
 
         # negate every element in the rhs error (the one being subtracted)
-        subtracted_error = copy.deepcopy(rhs.error)
-        for (i, error) in enumerate(subtracted_error):
-            subtracted_error[i].val *= -1
+        subtracted_error = merge_errors(rhs.error, scale=-1)
 
-        return PrecisionNode(self.val - rhs.val, symbol, self.error + subtracted_error)
+        return PrecisionNode(self.val - rhs.val, symbol, merge_errors(self.error, subtracted_error))
+
+    def _product_error(self, rhs):
+        # (x + Ex)(y + Ey) = xy + y*Ex + x*Ey + Ex*Ey
+        lhs_error = merge_errors(self.error, scale=rhs.val)
+        rhs_error = merge_errors(rhs.error, scale=self.val)
+        mixed_err = multiply_errors(self.error, rhs.error, self.parts(), rhs.parts())
+        return merge_errors(lhs_error, rhs_error, mixed_err)
 
     def mul(self, rhs, symbol):
         assert isinstance(rhs, PrecisionNode)
         assert isinstance(symbol, str)
 
-        mixed_err = FPEpsilonMultiplier(
-            copy.deepcopy(rhs.error), copy.deepcopy(self.error))
-
-        rhs_error = copy.deepcopy(rhs.error)
-        for (i, error) in enumerate(rhs_error):
-            rhs_error[i].val *= self.val
+        return PrecisionNode(self.val * rhs.val, symbol, self._product_error(rhs))
 
-        lhs_error = copy.deepcopy(self.error)
-        for (i, error) in enumerate(lhs_error):
-            lhs_error[i].val *= rhs.val
+    def sum(self, length, symbol):
+        """ Sum of length elements that each have this node's bound and error, rounded once """
+        assert isinstance(symbol, str)
 
-        total_err = lhs_error + rhs_error
-        total_err.append(mixed_err)
+        return PrecisionNode(self.val * length, symbol, merge_errors(self.error, scale=length))
 
-        return PrecisionNode(self.val * rhs.val, symbol, total_err)
+    def dot(self, rhs, length, symbol):
+        """ Sum of length products of elements of this node and rhs, rounded once """
+        assert isinstance(rhs, PrecisionNode)
+        assert isinstance(symbol, str)
 
-    def check_error_equality(self, rhs):
-        rhs_error = copy.deepcopy(rhs)
-        for err in self.error:
-            try:
-                i = rhs_error.index(err)
-                del rhs_error[i]
-            except ValueError:
-                return False
-        return rhs_error == []
+        return PrecisionNode(self.val * rhs.val * length, symbol,
+                             merge_errors(self._product_error(rhs), scale=length))
 
     def __eq__(self, rhs):
-        return self.check_error_equality(rhs.error) and self.val == rhs.val
+        return self.error == rhs.error and self.val == rhs.val
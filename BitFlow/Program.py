@@ -0,0 +1,78 @@
+from .node import Dag, Input, Constant, Select
+import typing as tp
+
+
+class Instr(tp.NamedTuple):
+    """ A single straight-line instruction.
+    Args:
+        op: Node kind (e.g. "Add", "Round")
+        args: Slots of the operands (slot i holds the result of instruction i)
+        attr: Input name, constant value or select index (None otherwise)
+    """
+    op: str
+    args: tp.Tuple[int, ...]
+    attr: tp.Any = None
+
+
+class Program:
+    """ A Dag lowered once into a topologically ordered, slot-indexed instruction list.
+
+    Instruction i writes slot i, so evaluating the program is a single forward
+    pass over `instrs` without any visitor dispatch or name-keyed lookups.
+    """
+
+    def __init__(self, instrs, input_names, outputs, nodes):
+        self.instrs = instrs
+        self.input_names = input_names
+        self.outputs = outputs
+        self.nodes = nodes
+
+    def __len__(self):
+        return len(self.instrs)
+
+    @staticmethod
+    def topological_order(dag: Dag):
+        """ Post-order over the dag starting from its roots (children first, in order).
+        This matches the visit order of DagVisitor's Visitor but does not recurse,
+        so arbitrarily deep dags can be lowered.
+        """
+        order = []
+        seen = set()
+        for root in dag.roots():
+            if root in seen:
+                continue
+            stack = [(root, iter(root.children()))]
+            seen.add(root)
+            while stack:
+                node, children = stack[-1]
+                for child in children:
+                    if child not in seen:
+                        seen.add(child)
+                        stack.append((child, iter(child.children())))
+                        break
+                else:
+                    stack.pop()
+                    order.append(node)
+        return order
+
+    @classmethod
+    def from_dag(cls, dag: Dag):
+        nodes = cls.topological_order(dag)
+        slots = {node: i for (i, node) in enumerate(nodes)}
+
+        instrs = []
+        for node in nodes:
+            args = tuple(slots[child] for child in node.children())
+            if isinstance(node, Input):
+                attr = node.name
+            elif isinstance(node, Constant):
+                attr = node.value
+            elif isinstance(node, Select):
+                attr = node.index
+            else:
+                attr = None
+            instrs.append(Instr(node.kind()[0], args, attr))
+
+        input_names = [dag_input.name for dag_input in dag.inputs]
+        outputs = [slots[root] for root in dag.roots()]
+        return cls(instrs, input_names, outputs, nodes)
@@ -0,0 +1,287 @@
+import time
+import numpy as np
+
+from .IA import Interval, IntervalArray
+from .Eval.IAEval import IAEval
+from .Parallel import pool, run_chunks
+from .Program import Program
+
+'''
+Sound range analysis.
+
+Integer bits are derived from interval bounds of every node over the whole input
+box, so they hold for every input in the data ranges (a single probe point does not
+bound Sub or mixed-sign Mul). Interval arithmetic loses precision when an input
+appears more than once in an expression; splitting the box into sub-boxes and taking
+the hull of their results tightens the bounds while staying sound.
+
+input_boxes splits every input evenly, which grows exponentially with the number of
+inputs. RangeRefinement instead bisects adaptively: only boxes whose bounds reach the
+hull of some node can tighten it, so each round splits the widest of those, along the
+input dimension whose halves give the narrowest ranges. The values at box midpoints
+bound the true ranges from inside, so refinement stops once the interval bounds are
+within a tolerance of them (or on a box or time budget). Boxes are evaluated in
+vectorized batches, optionally across a process pool.
+'''
+
+
+def input_boxes(data_range, subdivisions=1, max_boxes=2**16):
+    """ Interval values of the inputs for range analysis.
+    Args:
+        data_range: Dict of input name to (lo, hi)
+        subdivisions: Number of equal pieces every input range is split into. The
+            subdivisions**inputs boxes of the grid are evaluated serially in one walk;
+            for many inputs use RangeRefinement (BitFlow's refine=), which splits only
+            the boxes that matter and can evaluate them in a process pool
+        max_boxes: Largest grid to build
+    Returns:
+        Dict of input name to an Interval, or with subdivisions, to an IntervalArray
+        holding that input's side of every box of the grid (subdivisions**inputs
+        boxes, which IAEval evaluates in a single walk)
+    """
+    if subdivisions == 1:
+        return {k: Interval(float(lo), float(hi)) for (k, (lo, hi)) in data_range.items()}
+
+    if subdivisions ** len(data_range) > max_boxes:
+        raise ValueError(f"{subdivisions} subdivisions of {len(data_range)} inputs make "
+                         f"{subdivisions ** len(data_range)} boxes (more than {max_boxes}); "
+                         f"use refine= to split boxes adaptively instead")
+
+    names = list(data_range)
+    cells = np.meshgrid(*[np.arange(subdivisions)] * len(names), indexing="ij")
+    boxes = {}
+    for (k, cell) in zip(names, cells):
+        lo, hi = data_range[k]
+        edges = np.linspace(lo, hi, subdivisions + 1)
+        boxes[k] = IntervalArray(edges[cell.ravel()], edges[cell.ravel() + 1])
+    return boxes
+
+
+class BoxEval(IAEval):
+    """ IAEval of a batch of input boxes: input values (and so every value computed
+    from them) have a leading axis over the boxes
+    """
+
+    def eval_Select(self, a, node):
+        if isinstance(a, IntervalArray):
+            return a[:, node.index]
+        return a[node.index]
+
+
+def _box_ranges(evaluator, inputs):
+    # Bounds of every node (in topological order) over a batch of boxes, as (lo, hi)
+    # arrays of shape (boxes, elements); None for values that do not depend on the inputs
+    evaluator.eval(**inputs)
+    ranges = []
+    for node in Program.topological_order(evaluator.dag):
+        x = evaluator.node_values[node]
+        if isinstance(x, IntervalArray):
+            ranges.append((x.lo.reshape(len(x), -1), x.hi.reshape(len(x), -1)))
+        else:
+            ranges.append(None)
+    return ranges
+
+
+def _concatenate(results):
+    ranges = []
+    for k in range(len(results[0])):
+        if results[0][k] is None:
+            ranges.append(None)
+        else:
+            ranges.append((np.concatenate([r[k][0] for r in results]),
+                           np.concatenate([r[k][1] for r in results])))
+    return ranges
+
+
+def _take(ranges, index):
+    return [None if r is None else (r[0][index], r[1][index]) for r in ranges]
+
+
+class RangeRefinement:
+    """ Range analysis of a dag that adaptively bisects the input domain.
+
+    Used like an evaluator: eval binds intervals to the inputs and sets node_values to
+    the hull of every node over the final boxes, so it can be given to BitFlowVisitor or
+    BitFlowOptimizer in place of an IAEval. Every scalar element of an input is a
+    dimension of the domain.
+    Attributes:
+        boxes: (lo, hi) arrays of shape (boxes, dimensions) partitioning the domain
+        rounds: Number of refinement rounds run by the last eval
+    """
+
+    def __init__(self, dag, tolerance=0.01, time_limit=None, max_boxes=4096, batch_size=32, workers=None, chunk_size=1024):
+        """
+        Args:
+            tolerance: Stop once every range exceeds the values seen at box midpoints
+                by at most this fraction of its unrefined width
+            time_limit: Seconds after which no new round is started
+            max_boxes: Largest number of boxes
+            batch_size: Number of boxes split per round
+            workers: Number of processes evaluating boxes, or None to evaluate here
+            chunk_size: Number of boxes per evaluation (and per task given to a worker)
+        """
+        self.dag = dag
+        self.tolerance = tolerance
+        self.time_limit = time_limit
+        self.max_boxes = max_boxes
+        self.batch_size = batch_size
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.node_values = {}
+
+    def _inputs(self, lo, hi):
+        inputs = {}
+        start = 0
+        for (name, shape) in self.shapes.items():
+            size = int(np.prod(shape))
+            shape = (len(lo),) + shape
+            inputs[name] = IntervalArray._from_bounds(lo[:, start:start + size].reshape(shape),
+                                                      hi[:, start:start + size].reshape(shape))
+            start += size
+        return inputs
+
+    def _evaluate(self, lo, hi, executor):
+        tasks = [(self._inputs(lo[i:i + self.chunk_size], hi[i:i + self.chunk_size]),)
+                 for i in range(0, len(lo), self.chunk_size)]
+        if executor is None:
+            evaluator = BoxEval(self.dag)
+            results = [_box_ranges(evaluator, *task) for task in tasks]
+        else:
+            results = list(run_chunks(executor, _box_ranges, tasks, 2 * self.workers))
+        return _concatenate(results)
+
+    def _hull(self, ranges, hull=None):
+        # Hull of the tracked ranges over all boxes (and an earlier hull)
+        hull = {} if hull is None else hull
+        for k in self.tracked:
+            lo, hi = ranges[k][0].min(axis=0), ranges[k][1].max(axis=0)
+            if k in hull:
+                lo, hi = np.minimum(lo, hull[k][0]), np.maximum(hi, hull[k][1])
+            hull[k] = (lo, hi)
+        return hull
+
+    def _points(self, lo, hi, executor):
+        mid = (lo + hi) / 2
+        return self._evaluate(mid, mid, executor)
+
+    def _widths(self, ranges, axis=None):
+        # Widths of the tracked ranges relative to their unrefined widths, summed per box
+        # (or for the hull over an axis of boxes)
+        total = 0
+        for k in self.tracked:
+            lo, hi = ranges[k]
+            if axis is not None:
+                lo, hi = lo.min(axis=axis), hi.max(axis=axis)
+            total = total + ((hi - lo) / self.scale[k]).sum(axis=-1)
+        return total
+
+    def _candidates(self, lo, hi, ranges):
+        # Boxes reaching a bound of some node's hull (the only ones whose splitting can
+        # tighten it), widest ranges first
+        critical = np.zeros(len(lo), dtype=bool)
+        for k in self.tracked:
+            r_lo, r_hi = ranges[k]
+            bound = (r_lo == r_lo.min(axis=0)) | (r_hi == r_hi.max(axis=0))
+            critical |= bound[:, np.isfinite(self.scale[k])].any(axis=1)
+        candidates = np.flatnonzero(critical & (hi > lo).any(axis=1))
+        widths = self._widths(_take(ranges, candidates))
+        return candidates[np.argsort(-widths, kind="stable")]
+
+    def _split(self, lo, hi, executor):
+        # Both halves of every box along every dimension, evaluated in one batch; keeps
+        # the halves whose ranges are narrowest
+        n, dims = lo.shape
+        mid = (lo + hi) / 2
+        along = np.eye(dims, dtype=bool)
+        child_lo = np.stack([np.broadcast_to(lo[:, None], (n, dims, dims)),
+                             np.where(along, mid[:, None], lo[:, None])], axis=2)
+        child_hi = np.stack([np.where(along, mid[:, None], hi[:, None]),
+                             np.broadcast_to(hi[:, None], (n, dims, dims))], axis=2)
+        ranges = self._evaluate(child_lo.reshape(-1, dims), child_hi.reshape(-1, dims), executor)
+        ranges = [None if r is None else (r[0].reshape(n, dims, 2, -1), r[1].reshape(n, dims, 2, -1))
+                  for r in ranges]
+
+        widths = np.where(hi > lo, self._widths(ranges, axis=2), np.inf)
+        best = (np.arange(n), widths.argmin(axis=1))
+        ranges = [None if r is None else (r[0][best].reshape(2 * n, -1), r[1][best].reshape(2 * n, -1))
+                  for r in ranges]
+        return child_lo[best].reshape(2 * n, dims), child_hi[best].reshape(2 * n, dims), ranges
+
+    def eval(self, **input_values):
+        """ Refines the ranges of every node over the input intervals.
+        Args:
+            input_values: Interval or IntervalArray of every input
+        Returns:
+            The ranges of the outputs (a list, for several outputs)
+        """
+        for dag_input in self.dag.inputs:
+            if dag_input.name not in input_values:
+                raise ValueError(f"Missing {dag_input} in input values")
+        start_time = time.time()
+
+        self.shapes = {}
+        los, his = [], []
+        for dag_input in self.dag.inputs:
+            lo, hi = IntervalArray._bounds(input_values[dag_input.name])
+            lo, hi = np.asarray(lo, dtype=float), np.asarray(hi, dtype=float)
+            self.shapes[dag_input.name] = lo.shape
+            los.append(lo.ravel())
+            his.append(hi.ravel())
+        lo, hi = np.concatenate(los)[None], np.concatenate(his)[None]
+
+        # The whole domain, evaluated here, gives the values of constant nodes and the
+        # unrefined widths
+        evaluator = BoxEval(self.dag)
+        ranges = _box_ranges(evaluator, self._inputs(lo, hi))
+        nodes = Program.topological_order(self.dag)
+        self.tracked = [k for (k, node) in enumerate(nodes)
+                        if ranges[k] is not None and node not in self.dag.inputs]
+        self.scale = {}
+        for k in self.tracked:
+            width = ranges[k][1][0] - ranges[k][0][0]
+            self.scale[k] = np.where(width > 0, width, np.inf)
+
+        executor = None if self.workers is None else pool(self.dag, self.workers, build=BoxEval)
+        try:
+            inner = self._hull(self._points(lo, hi, None))
+            self.rounds = 0
+            while len(lo) < self.max_boxes:
+                outer = self._hull(ranges)
+                gap = max([((outer[k][1] - inner[k][1] + inner[k][0] - outer[k][0]) / self.scale[k]).max()
+                           for k in self.tracked], default=0)
+                if gap <= self.tolerance:
+                    break
+                if self.time_limit is not None and time.time() - start_time > self.time_limit:
+                    break
+                split = self._candidates(lo, hi, ranges)[:min(self.batch_size, self.max_boxes - len(lo))]
+                if len(split) == 0:
+                    break
+                keep = np.ones(len(lo), dtype=bool)
+                keep[split] = False
+                child_lo, child_hi, child_ranges = self._split(lo[split], hi[split], executor)
+                lo = np.concatenate([lo[keep], child_lo])
+                hi = np.concatenate([hi[keep], child_hi])
+                ranges = [None if r is None else (np.concatenate([r[0][keep], c[0]]), np.concatenate([r[1][keep], c[1]]))
+                          for (r, c) in zip(ranges, child_ranges)]
+                inner = self._hull(self._points(child_lo, child_hi, executor), inner)
+                self.rounds += 1
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.boxes = (lo, hi)
+        self.input_values = input_values
+        self.node_values = {}
+        for (k, node) in enumerate(nodes):
+            x = evaluator.node_values[node]
+            if ranges[k] is None:
+                self.node_values[node] = x
+            elif x.shape[1:] == ():
+                self.node_values[node] = Interval(float(ranges[k][0].min()), float(ranges[k][1].max()))
+            else:
+                self.node_values[node] = IntervalArray(ranges[k][0].min(axis=0).reshape(x.shape[1:]),
+                                                       ranges[k][1].max(axis=0).reshape(x.shape[1:]))
+        outputs = [self.node_values[root] for root in self.dag.roots()]
+        if len(outputs) == 1:
+            return outputs[0]
+        return outputs
@@ -0,0 +1,128 @@
+import hashlib
+import json
+
+from .node import Dag, DagNode
+from .Program import Program
+
+'''
+Canonical serialization and structural hashing of dags.
+
+A dag is written as JSON: a topologically ordered node table (kind, name, child
+indices and attribute) plus the indices of the inputs and outputs. Nodes with the same
+kind, children, attribute and name are hash-consed into one entry, so equal dags
+serialize to the same text. Loading builds the nodes directly from the table, without
+going through the node constructors or operators.
+
+The digest only hashes structure: internal names are left out (inputs keep theirs,
+since values are bound to them), so structurally equal subtrees share an entry and
+two dags that compute the same thing from the same inputs have the same digest.
+'''
+
+FORMAT_VERSION = 1
+
+# Attributes that node kinds carry besides their children
+_attributes = {
+    "Constant": "value",
+    "Select": "index",
+}
+
+
+def _node_kinds():
+    kinds = {}
+    classes = [DagNode]
+    while classes:
+        cls = classes.pop()
+        kinds[cls.__name__] = cls
+        classes.extend(cls.__subclasses__())
+    return kinds
+
+
+def _attribute(node):
+    attr = _attributes.get(type(node).__name__)
+    return None if attr is None else getattr(node, attr)
+
+
+def _nodes(dag: Dag):
+    # Every node of the dag in post-order, including inputs that no output uses
+    nodes = Program.topological_order(dag)
+    seen = set(nodes)
+    return [node for node in dag.inputs if node not in seen] + nodes
+
+
+def _table(dag: Dag, with_names):
+    table = {}
+    entries = []
+    ids = {}
+    for node in _nodes(dag):
+        kind = type(node).__name__
+        children = [ids[child] for child in node.children()]
+        attr = _attribute(node)
+        if with_names:
+            entry = [kind, node.name, children, attr]
+        else:
+            entry = [kind, node.name if kind == "Input" else None, children, attr]
+        key = json.dumps(entry)
+        if key not in table:
+            table[key] = len(entries)
+            entries.append(entry)
+        ids[node] = table[key]
+
+    return {
+        "version": FORMAT_VERSION,
+        "nodes": entries,
+        "inputs": [ids[node] for node in dag.inputs],
+        "outputs": [ids[node] for node in dag.roots()],
+    }
+
+
+def to_json(dag: Dag):
+    """ The canonical (JSON-compatible) form of a dag """
+    return _table(dag, with_names=True)
+
+
+def dumps(dag: Dag):
+    return json.dumps(to_json(dag), separators=(",", ":"))
+
+
+def digest(dag: Dag):
+    """ Hex hash of the structure of a dag (node kinds, constants, select indices,
+    topology, input names and output order); stable across runs and processes.
+    """
+    canonical = json.dumps(_table(dag, with_names=False), separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def from_json(obj):
+    """ Rebuilds a dag from its canonical form """
+    if obj.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported dag format version {obj.get('version')}")
+
+    kinds = _node_kinds()
+    nodes = []
+    for (kind, name, children, attr) in obj["nodes"]:
+        if kind not in kinds:
+            raise ValueError(f"Unknown node kind {kind}")
+        cls = kinds[kind]
+        node = cls.__new__(cls)
+        node.name = name
+        node._children = tuple(nodes[i] for i in children)
+        if kind in _attributes:
+            setattr(node, _attributes[kind], attr)
+        nodes.append(node)
+
+    return Dag(outputs=[nodes[i] for i in obj["outputs"]],
+               inputs=[nodes[i] for i in obj["inputs"]])
+
+
+def loads(s):
+    return from_json(json.loads(s))
+
+
+def dump(dag: Dag, path):
+    with open(path, "w") as f:
+        f.write(dumps(dag))
+
+
+def load(path):
+    with open(path) as f:
+        return loads(f.read())
@@ -0,0 +1,199 @@
+import math
+import numpy as np
+import torch
+
+from .Parallel import map_chunks
+
+'''
+Streaming verification of precision assignments.
+
+Inputs are drawn chunk by chunk from the range spec, each chunk from its own
+generator seeded by (seed, chunk index), so a run is reproducible, any chunk can be
+regenerated on its own, and chunks can be checked by a pool of workers. Only
+per-output counters and the worst sample seen so far are kept between chunks, so
+memory does not grow with the number of samples.
+'''
+
+
+def precision_scale(num, precision):
+    """ 2**precision shaped to broadcast one precision per output row of num """
+    scale = 2.0 ** torch.as_tensor(precision, dtype=num.dtype)
+    if scale.numel() > 1:
+        scale = scale.view(-1, *([1] * (num.dim() - 1)))
+    return scale
+
+
+def ulp_error(num, truth, precision):
+    """ |num - round(truth)| in ulps of the output precision.
+    Scaling by a power of two is exact, so this is computed as
+    |num*2**p - round(truth*2**p)| in one fused pass; a result is correct when it is <= 0.5.
+    """
+    with torch.no_grad():
+        scale = precision_scale(num, precision)
+        r = torch.mul(truth, scale).round_()
+        return torch.addcmul(r, num, scale, value=-1).abs_()
+
+
+def sample_inputs(data_range, range_bits, size, dist=0, generator=None):
+    """ Draws random values for every input.
+    Args:
+        data_range: Dict of input name to (lo, hi)
+        range_bits: Dict of input name to integer bits; samples are clamped to that range
+        size: Number of samples per input
+        dist: 0 ==> UNIFORM, 1 ==> NORMAL, 2 ==> ARCSINE
+        generator: torch.Generator to draw from (defaults to the global generator)
+    Returns:
+        Dict of input name to a [size] tensor
+    """
+    inputs = {}
+    for key in data_range:
+        input_range = data_range[key]
+
+        # calculate range bounds using range bits
+        ib = range_bits[key]
+        min_range = -1 * (2 ** (ib - 1))
+        max_range = 2 ** (ib - 1) - 1
+
+        if dist == 1:
+            mean = (input_range[1]+input_range[0])/2
+            std = (mean - input_range[0])/3
+            val = torch.normal(mean=mean, std=std, size=(size,), generator=generator)
+        elif dist == 2 and generator is None:
+            beta = torch.distributions.beta.Beta(
+                torch.tensor([0.5]), torch.tensor([0.5]))
+            val = (input_range[1] - input_range[0]) * \
+                beta.sample((size,)).reshape(size) + input_range[0]
+        elif dist == 2:
+            # sin(pi*u/2)**2 is Beta(0.5, 0.5) distributed
+            u = torch.sin(torch.rand(size, generator=generator) * (math.pi / 2)) ** 2
+            val = (input_range[1] - input_range[0]) * u + input_range[0]
+        else:
+            val = (input_range[1] - input_range[0]) * \
+                torch.rand(size, generator=generator) + input_range[0]
+
+        inputs[key] = torch.clamp(val, min_range, max_range)
+    return inputs
+
+
+def chunk_generator(seed, chunk):
+    """ Independent, reproducible generator for one chunk of a verification run """
+    state = np.random.SeedSequence([seed, chunk]).generate_state(1, dtype=np.uint64)[0]
+    return torch.Generator().manual_seed(int(state))
+
+
+def evaluate_rows(model, inputs, W, O, size):
+    """ Model results as a [outputs, size] tensor """
+    with torch.no_grad():
+        res = model(**inputs, W=W, O=O)
+    if not isinstance(res, (list, tuple)):
+        res = [res]
+    return torch.stack([torch.broadcast_to(y.reshape(-1), (size,)) for y in res])
+
+
+def check_chunk(model, W, O, true_width, data_range, range_bits, dist, seed, chunk, size):
+    """ Samples one chunk of a verification run and checks it.
+    Returns:
+        (size, passes, worst error, worst inputs), each per output
+    """
+    inputs = sample_inputs(data_range, range_bits, size, dist, chunk_generator(seed, chunk))
+    truth = evaluate_rows(model, inputs, torch.full_like(W, true_width),
+                          torch.full_like(O, true_width), size)
+    res = evaluate_rows(model, inputs, W, O, size)
+
+    err = ulp_error(res, truth, O)
+    worst, index = torch.max(err, dim=1)
+    worst_inputs = [{k: float(v[j]) for (k, v) in inputs.items()} for j in index.tolist()]
+    return size, torch.sum(err <= 0.5, dim=1), worst, worst_inputs
+
+
+class VerificationReport:
+    """ Running per-output results of a verification run
+    Attributes:
+        samples: Number of samples checked
+        passes: [outputs] number of samples within half an ulp of the truth
+        max_ulp_error: [outputs] largest error seen, in ulps of the output precision
+        worst_inputs: For each output, the inputs that produced max_ulp_error
+        certified: With a target accuracy, True/False once every output is known to
+            meet it / some output is known to miss it at the requested confidence, else None
+    """
+
+    def __init__(self, num_outputs):
+        self.samples = 0
+        self.passes = torch.zeros(num_outputs, dtype=torch.long)
+        self.max_ulp_error = torch.zeros(num_outputs)
+        self.worst_inputs = [None] * num_outputs
+        self.certified = None
+
+    @property
+    def accuracy(self):
+        return self.passes.double() / max(self.samples, 1)
+
+    def update(self, size, passes, worst, worst_inputs):
+        """ Adds the results of one chunk (see check_chunk) """
+        self.samples += size
+        self.passes += passes
+        for (i, e) in enumerate(worst.tolist()):
+            if self.worst_inputs[i] is None or e > self.max_ulp_error[i]:
+                self.max_ulp_error[i] = e
+                self.worst_inputs[i] = worst_inputs[i]
+
+    def hoeffding_radius(self, confidence):
+        """ Half-width of a two-sided confidence interval on every output's accuracy
+        (Hoeffding's inequality, union bound over outputs)
+        """
+        delta = (1 - confidence) / len(self.passes)
+        return math.sqrt(math.log(2 / delta) / (2 * max(self.samples, 1)))
+
+    def decide(self, target_accuracy, confidence):
+        radius = self.hoeffding_radius(confidence)
+        if torch.any(self.accuracy + radius < target_accuracy):
+            self.certified = False
+        elif torch.all(self.accuracy - radius >= target_accuracy):
+            self.certified = True
+        return self.certified is not None
+
+    def __str__(self):
+        return f"samples: {self.samples}, accuracy: {self.accuracy.tolist()}, " \
+            f"max ulp error: {self.max_ulp_error.tolist()}, worst inputs: {self.worst_inputs}"
+
+
+def verify(model, W, O, data_range, range_bits, num_samples, chunk_size=2**16, true_width=20., dist=0, seed=0, target_accuracy=None, confidence=0.99, workers=None, dag=None):
+    """ Checks a precision assignment against the full precision model on random inputs.
+    Args:
+        model: Rounded model (see BitFlow.gen_model)
+        W, O: Precisions under test; O is also the required output precision
+        data_range, range_bits: Input ranges to sample from (see sample_inputs)
+        num_samples: Maximum number of samples
+        chunk_size: Samples evaluated per model call
+        true_width: Precision of the reference results
+        dist: Input distribution (see sample_inputs)
+        seed: Seed of the run
+        target_accuracy: If given, stop as soon as every output is known to meet it, or
+            some output to miss it, with probability confidence
+        workers: If given, check chunks in this many processes, each compiling its own
+            model of dag; the report does not depend on the number of workers
+        dag: The dag of model (see BitFlow.gen_model), required with workers
+    Returns:
+        A VerificationReport
+    """
+    W = torch.as_tensor(W, dtype=torch.float).detach()
+    O = torch.as_tensor(O, dtype=torch.float).detach()
+    tasks = ((W, O, true_width, data_range, range_bits, dist, seed, chunk, min(chunk_size, num_samples - start))
+             for (chunk, start) in enumerate(range(0, num_samples, chunk_size)))
+    if workers is None:
+        results = (check_chunk(model, *args) for args in tasks)
+    elif dag is None:
+        raise ValueError("verifying with workers needs the dag of the model")
+    else:
+        results = map_chunks(dag, check_chunk, tasks, workers)
+
+    report = None
+    for result in results:
+        if report is None:
+            report = VerificationReport(len(result[1]))
+        report.update(*result)
+        if target_accuracy is not None and report.decide(target_accuracy, confidence):
+            break
+    if workers is not None:
+        results.close()
+    return report
@@ -1,14 +1,83 @@
 from DagVisitor import Visited, AbstractDag
+from contextlib import contextmanager
 import abc
+import hashlib
 import typing as tp
 
 
+# Stack of active interning tables (see interned)
+_intern_tables = []
+
+
+@contextmanager
+def interned():
+    """ Within this context the DagNode operators (+, -, *, []) return the existing node
+    for a structurally identical expression instead of allocating a new one, so repeated
+    subexpressions such as a[0][0] are shared.
+    Yields:
+        The table, mapping (kind, children ids, attribute) to nodes
+    """
+    table = {}
+    _intern_tables.append(table)
+    try:
+        yield table
+    finally:
+        _intern_tables.pop()
+
+
+def _intern(cls, *children, attr=None):
+    if not _intern_tables:
+        return cls(*children) if attr is None else cls(*children, attr)
+    # children are interned too (or leaves), so identity is structure; the table
+    # keeps them alive, so their ids are not reused
+    key = (cls.__name__, tuple(id(child) for child in children), attr)
+    table = _intern_tables[-1]
+    node = table.get(key)
+    if node is None:
+        node = cls(*children) if attr is None else cls(*children, attr)
+        table[key] = node
+    return node
+
+
 # Passes will be run on this
 class DagNode(Visited):
     def __init__(self, name, *children):
-        self.name = name
+        # name may be None: it is then derived from the children's names when first
+        # needed (see _format_name)
+        self._name = name
         self.set_children(*children)
 
+    @property
+    def name(self):
+        if self._name is None:
+            self._derive_names()
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._name = name
+
+    def _format_name(self, *child_names, attr=None):
+        # A short digest of the node's kind, attribute and children's names: derived
+        # names stay the same size at any depth, and structurally equal nodes (or dags
+        # built again) get the same names
+        kind = type(self).__name__.lower()
+        spec = repr((kind, attr, child_names)).encode()
+        return f"{kind}_{hashlib.blake2b(spec, digest_size=6).hexdigest()}"
+
+    def _derive_names(self):
+        # Derives every missing name below this node, children first (iteratively)
+        stack = [self]
+        while stack:
+            node = stack[-1]
+            missing = [child for child in node._children if child._name is None]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            if node._name is None:
+                node._name = node._format_name(*(child._name for child in node._children))
+
     def set_children(self, *children):
         self._children = children
 
@@ -26,19 +95,30 @@ class DagNode(Visited):
 
     def __add__(self, rhs):
         assert isinstance(rhs, DagNode)
-        return Add(self, rhs)
+        return _intern(Add, self, rhs)
 
     def __sub__(self, rhs):
         assert isinstance(rhs, DagNode)
-        return Sub(self, rhs)
+        return _intern(Sub, self, rhs)
 
     def __mul__(self, rhs):
         assert isinstance(rhs, DagNode)
-        return Mul(self, rhs)
+        return _intern(Mul, self, rhs)
 
     def __getitem__(self, rhs):
         assert isinstance(rhs,int)
-        return Select(self, rhs)
+        return _intern(Select, self, attr=rhs)
+
+    def __matmul__(self, rhs):
+        assert isinstance(rhs, DagNode)
+        return _intern(MatMul, self, rhs)
+
+    def dot(self, rhs):
+        assert isinstance(rhs, DagNode)
+        return _intern(Dot, self, rhs)
+
+    def sum(self):
+        return _intern(Sum, self)
 
 
 class Input(DagNode):
@@ -59,36 +139,46 @@ class Constant(DagNode):
 
 class Add(DagNode):
     def __init__(self, a: DagNode, b: DagNode, *, name=None):
-        if name is None:
-            name = f"{a.name}_add_{b.name}"
         super().__init__(name, a, b)
 
 
 class Sub(DagNode):
     def __init__(self, a: DagNode, b: DagNode, *, name=None):
-        if name is None:
-            name = f"{a.name}_sub_{b.name}"
         super().__init__(name, a, b)
 
 
 class Mul(DagNode):
     def __init__(self, a: DagNode, b: DagNode, *, name=None):
-        if name is None:
-            name = f"{a.name}_mul_{b.name}"
+        super().__init__(name, a, b)
+
+
+# Vector ops reduce over the last axis of their operands (Add, Sub and Mul are
+# elementwise and broadcast), so batched values evaluate as single tensor ops
+class Sum(DagNode):
+    def __init__(self, a: DagNode, *, name=None):
+        super().__init__(name, a)
+
+
+class Dot(DagNode):
+    def __init__(self, a: DagNode, b: DagNode, *, name=None):
+        super().__init__(name, a, b)
+
+
+class MatMul(DagNode):
+    def __init__(self, a: DagNode, b: DagNode, *, name=None):
         super().__init__(name, a, b)
 
 
 class Select(DagNode):
     def __init__(self, a: DagNode, index, name=None):
         self.index=index
-        if name is None:
-            name = f"{a.name}_getitem_{str(index)}"
         super().__init__(name, a)
 
+    def _format_name(self, a):
+        return super()._format_name(a, attr=self.index)
+
 class Round(DagNode):
     def __init__(self, val: DagNode, prec: DagNode, name=None):
-        if name is None:
-            name = f"{val.name}_round_{prec.name}"
         super().__init__(name, val, prec)
 
 
@@ -0,0 +1,48 @@
+from ..node import Dag
+from ..Program import Program
+from ..Eval.CompiledTorchEval import CompiledTorchEval
+from .functions import int_round
+import torch as t
+
+
+class RoundedDag(t.nn.Module):
+    """ A rounded dag (output of AddRoundNodes) as a plain torch module.
+    W is a trainable parameter and O a buffer, so the module only takes the data
+    inputs (positionally, in dag input order) and returns a tuple of outputs.
+    The forward pass is straight-line torch code, so the module can be traced,
+    scripted or handed to torch.compile.
+    """
+
+    def __init__(self, dag: Dag, W, O, weight_name="W", output_name="O"):
+        super().__init__()
+        program = Program.from_dag(dag)
+        self.input_names = [name for name in program.input_names
+                            if name not in (weight_name, output_name)]
+        arg_names = self.input_names + [weight_name, output_name]
+        self.source, self._fn = CompiledTorchEval.codegen(
+            program, round_fn=int_round, arg_names=arg_names)
+
+        self.W = t.nn.Parameter(t.as_tensor(W, dtype=t.float).detach().clone())
+        self.register_buffer("O", t.as_tensor(O, dtype=t.float).detach().clone())
+
+    def forward(self, *inputs):
+        return self._fn(*inputs, self.W, self.O)
+
+
+def export(dag: Dag, W, O, example_inputs, path=None):
+    """ Traces a rounded dag into a standalone TorchScript module.
+    The saved artifact (torch.jit.load) does not need BitFlow at runtime.
+    Args:
+        dag: Dag with Round nodes
+        W, O: Trained weight and output precisions
+        example_inputs: Data inputs (in dag input order) used for tracing; the
+            traced module is specialized to their ranks (e.g. batched or not)
+        path: If given, save the traced module to this path
+    Returns:
+        The traced module
+    """
+    module = RoundedDag(dag, W, O)
+    traced = t.jit.trace(module, tuple(example_inputs))
+    if path is not None:
+        t.jit.save(traced, path)
+    return traced
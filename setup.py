@@ -14,6 +14,7 @@ setup(
     ],
     install_requires=[
         "torch",
+        "numpy",
     ],
     python_requires='>=3.7'
 )
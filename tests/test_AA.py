@@ -1,5 +1,9 @@
-from BitFlow.AA import AInterval
-from BitFlow.IA import Interval
+from BitFlow.AA import AInterval, noise_symbols
+from BitFlow.IA import Interval, IntervalArray
+from BitFlow.Optimization import BitFlowVisitor
+from BitFlow.node import Input, Constant, Dag, Add, Sub, Mul
+from BitFlow.Eval import AAEval, IAEval
+import numpy as np
 
 def test_to_string():
     #Two different wyas to construct an AInterval
@@ -30,6 +34,7 @@ def test_sub():
     assert z == AInterval(-4.0, {1: 4.0, 2: -4.0})
 
 def test_mul():
+    noise_symbols.reset()
     x = AInterval(-2.0, 6.0, eps_idx=1)
     y = AInterval(2.0, 10.0, eps_idx=2)
     z = x * y
@@ -63,4 +68,122 @@ def test_paper_fig3():
 
     assert d.to_interval() == Interval(-24.0, 18.0)
     assert e.to_interval() == Interval(-19.7, 22.3)
-    assert z.to_interval() == Interval(-25.7, 16.3)
+    assert z.to_interval() == Interval(-27.7, 18.3)
+
+
+def test_no_mutation():
+    x = AInterval(0.0, 6.0, eps_idx=1)
+    y = AInterval(2.0, 8.0, eps_idx=2)
+    x - y
+    x * 5.0
+    assert x == AInterval(3.0, {1: 3.0})
+    assert x - x == AInterval(0.0, {})
+
+
+def test_AAEval():
+    a = Input(name="a")
+    b = Input(name="b")
+    z_1 = Sub(Add(Mul(a, b), Constant(4.3)), b)
+    z_2 = Sub(Add(a, b), a)
+    dag = Dag(outputs=[z_1, z_2], inputs=[a, b])
+
+    aa = AAEval(dag).eval(a=Interval(-3.0, 2.0), b=Interval(4.0, 8.0))
+    assert aa[0].to_interval() == Interval(-27.7, 18.3)
+
+    # affine forms keep the correlation between both uses of a
+    ia = IAEval(dag).eval(a=Interval(-3.0, 2.0), b=Interval(4.0, 8.0))
+    assert aa[1].to_interval() == Interval(4.0, 8.0)
+    assert ia[1] == Interval(-1.0, 13.0)
+
+
+def test_many_inputs():
+    # (sum of x_i) - (sum of x_i) over hundreds of inputs cancels exactly
+    inputs = [Input(name=f"x{i}") for i in range(300)]
+
+    def tree_sum(nodes):
+        while len(nodes) > 1:
+            nodes = [a + b for (a, b) in zip(nodes[::2], nodes[1::2])] + \
+                nodes[len(nodes) - len(nodes) % 2:]
+        return nodes[0]
+    dag = Dag(outputs=[tree_sum(inputs) - tree_sum(inputs)], inputs=inputs)
+
+    res = AAEval(dag).eval(**{x.name: Interval(-1.0, 1.0) for x in inputs})
+    assert res.to_interval() == Interval(0.0, 0.0)
+
+
+def test_AAEval_batch():
+    # Every box of a batch matches evaluating it on its own
+    a = Input(name="a")
+    b = Input(name="b")
+    c = Input(name="c")
+    z = Sub(Mul(Add(a, b), Sub(b, c)), Mul(a, Constant(2.5)))
+    dag = Dag(outputs=[z], inputs=[a, b, c])
+
+    rng = np.random.RandomState(0)
+    lo = {k: rng.uniform(-5, 5, 20) for k in "abc"}
+    hi = {k: lo[k] + rng.uniform(0, 3, 20) for k in "abc"}
+    res = AAEval(dag).eval(**{k: IntervalArray(lo[k], hi[k]) for k in "abc"})
+    assert res.coef.shape[0] == 20
+
+    ranges = res.to_interval()
+    for i in range(20):
+        gold = AAEval(dag).eval(**{k: Interval(lo[k][i], hi[k][i]) for k in "abc"})
+        assert np.isclose(ranges.lo[i], gold.to_interval().lo)
+        assert np.isclose(ranges.hi[i], gold.to_interval().hi)
+
+
+def test_AAEval_IBs():
+    a = Input(name="a")
+    b = Input(name="b")
+    z = Sub(Add(a, b, name="s"), a, name="z")
+    dag = Dag(outputs=[z], inputs=[a, b])
+
+    ranges = dict(a=Interval(-30.0, 20.0), b=Interval(4.0, 8.0))
+    evaluator = IAEval(dag)
+    evaluator.eval(**ranges)
+    ia = BitFlowVisitor(evaluator.node_values).run(dag)
+
+    evaluator = AAEval(dag)
+    evaluator.eval(**ranges)
+    aa = BitFlowVisitor(evaluator.node_values).run(dag)
+
+    assert ia.IBs["z"] == 7
+    assert aa.IBs["z"] == 5
+
+
+def test_vector_ops():
+    # Sums and products of affine forms enclose the interval results' points
+    a = Input(name="a")
+    b = Input(name="b")
+    M = Constant([[1., -2.], [0.5, 3.]], name="M")
+    dag = Dag(outputs=[(M @ a) @ b, a.dot(b).sum()], inputs=[a, b])
+
+    x = IntervalArray([[0, -1], [2, 1]], [[1, 1], [3, 2]])
+    y = IntervalArray([[1, 0], [-1, 2]], [[2, 1], [0, 3]])
+    aa = AAEval(dag, element_dims={"a": 2, "b": 2}).eval(a=x, b=y)
+    rng = np.random.RandomState(0)
+    for _ in range(100):
+        xs = rng.uniform(x.lo, x.hi)
+        ys = rng.uniform(y.lo, y.hi)
+        for (res, gold) in zip(aa, (np.array(M.value) @ xs @ ys, np.sum(xs * ys))):
+            bounds = res.to_interval()
+            assert np.all(bounds.lo <= gold + 1e-9) and np.all(gold <= bounds.hi + 1e-9)
+
+
+def test_vector_elements_independent():
+    # The product remainders of different elements are independent noise
+    x = Input(name="x")
+    y = Input(name="y")
+    p = x * y
+    dag = Dag(outputs=[p[0] - p[1]], inputs=[x, y])
+
+    v = IntervalArray([-1., -1.], [1., 1.])
+    res = AAEval(dag, element_dims={"x": 1, "y": 1}).eval(x=v, y=v)
+    assert res.to_interval() == IntervalArray(-2., 2.)
+    assert IAEval(dag).eval(x=v, y=v) == IntervalArray(-2., 2.)
+
+    # A batch of such vectors still shares one remainder symbol per element (the
+    # linear terms vanish around 0)
+    w = IntervalArray([[-1., -1.]] * 3, [[1., 1.]] * 3)
+    res = AAEval(Dag(outputs=[p], inputs=[x, y]), element_dims={"x": 1, "y": 1}).eval(x=w, y=w)
+    assert res.coef.shape == (3, 2, 2)
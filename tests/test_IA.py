@@ -1,4 +1,8 @@
-from BitFlow.IA import Interval
+from BitFlow.IA import Interval, IntervalArray
+from BitFlow.node import Input, Constant, Dag, Add, Sub, Mul
+from BitFlow.Eval import IAEval
+import numpy as np
+import pytest
 
 def test_add():
     x = Interval(0, 5)
@@ -46,3 +50,85 @@ def test_self_sub():
     x = Interval(-5,5)
     z = x-x
     assert z == Interval(-10, 10)
+
+
+def test_reflected_ops():
+    x = Interval(-1, 3)
+    assert 2 + x == Interval(1, 5)
+    assert 2 - x == Interval(-1, 3)
+    assert -2 * x == Interval(-6, 2)
+    assert x * -2 == Interval(-6, 2)
+    assert -x == Interval(-3, 1)
+
+    # Selects of interval vectors
+    a = Input(name="a")
+    dag = Dag(outputs=[Sub(a[0], a[1])], inputs=[a])
+    assert IAEval(dag).eval(a=[Interval(0, 1), Interval(2, 4)]) == Interval(-4, -1)
+
+
+def test_array_ops():
+    x = IntervalArray([0, -2], [5, 5])
+    y = IntervalArray([3, 3], [8, 8])
+    assert x + y == IntervalArray([3, 1], [13, 13])
+    assert x - y == IntervalArray([-8, -10], [2, 2])
+    assert x * y == IntervalArray([0, -16], [40, 40])
+    assert x * 10 == IntervalArray([0, -20], [50, 50])
+    assert -2 * x == IntervalArray([-10, -10], [0, 4])
+    assert 1 - x == IntervalArray([-4, -4], [1, 3])
+    assert x[1] == IntervalArray(-2, 5)
+    assert (x * y).hull() == Interval(-16, 40)
+
+
+def test_array_interval_ops():
+    # An Interval on the left defers to the array
+    i = Interval(1, 2)
+    x = IntervalArray([0, -2], [5, 5])
+    assert i + x == IntervalArray([1, -1], [7, 7])
+    assert i - x == IntervalArray([-4, -4], [2, 4])
+    assert i * x == IntervalArray([0, -4], [10, 10])
+    assert x - i == IntervalArray([-2, -4], [4, 4])
+    for op in (lambda a, b: a + b, lambda a, b: a - b, lambda a, b: a * b):
+        for (lhs, rhs) in ((x, "a"), ("a", x)):
+            with pytest.raises(TypeError):
+                op(lhs, rhs)
+
+
+def test_array_broadcast():
+    x = IntervalArray([[0], [1]], [[1], [2]])
+    y = IntervalArray([-1, 2, 3], [1, 4, 5])
+    z = x * y
+    assert z.shape == (2, 3)
+    for (i, j) in np.ndindex(*z.shape):
+        gold = Interval(x.lo[i, 0], x.hi[i, 0]) * Interval(y.lo[j], y.hi[j])
+        assert z[i, j].hull() == gold
+
+
+def test_array_IAEval():
+    # (a*b) + 4 - b, every box evaluated in a single walk
+    a = Input(name="a")
+    b = Input(name="b")
+    z = Sub(Add(Mul(a, b), Constant(4)), b)
+    evaluator = IAEval(Dag(outputs=[z], inputs=[a, b]))
+
+    rng = np.random.RandomState(0)
+    a_lo, b_lo = rng.randint(-10, 10, 50), rng.randint(-10, 10, 50)
+    a_hi, b_hi = a_lo + rng.randint(0, 5, 50), b_lo + rng.randint(0, 5, 50)
+    res = evaluator.eval(a=IntervalArray(a_lo, a_hi), b=IntervalArray(b_lo, b_hi))
+
+    for i in range(50):
+        gold = evaluator.eval(a=Interval(int(a_lo[i]), int(a_hi[i])),
+                              b=Interval(int(b_lo[i]), int(b_hi[i])))
+        assert res[i].hull() == gold
+
+
+def test_array_reductions():
+    x = IntervalArray([[0, -1], [2, 1]], [[1, 1], [3, 2]])
+    assert x.sum() == IntervalArray([-1, 3], [2, 5])
+
+    y = IntervalArray([[1, 0], [-1, 2]], [[2, 1], [0, 3]])
+    z = x @ y
+    for (i, j) in np.ndindex(*z.shape):
+        gold = x[i, 0].hull() * y[0, j].hull() + x[i, 1].hull() * y[1, j].hull()
+        assert z[i, j].hull() == gold
+    assert np.eye(2) @ x == x
+    assert x @ np.eye(2) == x
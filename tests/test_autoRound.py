@@ -3,9 +3,11 @@ import torch
 from BitFlow.node import Input, Constant, Dag, Add, Sub, Mul, Round, DagNode, Select, Output
 from BitFlow.IA import Interval
 from BitFlow.Eval.TorchEval import TorchEval
-from BitFlow.AddRoundNodes import AddRoundNodes
+from BitFlow.AddRoundNodes import AddRoundNodes, group_by_tensor, group_by_role
 from BitFlow.casestudies.caseStudies import caseStudy
 from BitFlow.Eval import IAEval, NumEval
+from BitFlow.Program import Program
+from BitFlow.Optimization import BitFlowVisitor
 
 
 def update_dag(dag):
@@ -285,9 +287,98 @@ def test_Matrix_Multiplication():
     return
 
 
+def test_groups():
+    def rounded(dag, groups):
+        rounder = AddRoundNodes(Input(name="W"), Input(name="O"), groups)
+        return rounder.doit(dag), rounder
+
+    _, rounder = rounded(caseStudy.RGB_to_YCbCr(), None)
+    assert rounder.round_count == 25
+
+    # a and its three elements share one slot
+    dag = caseStudy.RGB_to_YCbCr()
+    selects = [node.name for node in Program.topological_order(dag) if isinstance(node, Select)]
+    _, rounder = rounded(dag, group_by_tensor)
+    assert rounder.round_count == 22
+    assert len({rounder.slot_map[name] for name in ["a"] + selects}) == 1
+
+    # a; its elements; and the constants, products and partial sums of each row
+    dag = caseStudy.RGB_to_YCbCr()
+    _, rounder = rounded(dag, [{"a": "input"}, group_by_role(dag)])
+    assert rounder.round_count == 1 + 1 + 3 * 3
+
+    # A grouped dag computes what the ungrouped dag computes with the shared slots expanded
+    full, full_rounder = rounded(caseStudy.poly_approx(), None)
+    dag = caseStudy.poly_approx()
+    grouped, rounder = rounded(dag, [group_by_tensor, group_by_role(dag)])
+    assert rounder.round_count == 4
+
+    W = torch.linspace(4., 12., rounder.round_count)
+    W_full = torch.zeros(full_rounder.round_count)
+    for (name, slot) in full_rounder.slot_map.items():
+        W_full[slot] = W[rounder.slot_map[name]]
+    inputs = dict(a=torch.rand(8, 5) * 4 - 2, c=torch.rand(8), O=torch.tensor([8.]))
+    assert torch.equal(TorchEval(grouped).eval(W=W, **inputs), TorchEval(full).eval(W=W_full, **inputs))
+
+
+def test_derived_names():
+    # Nodes built without names keep the names of the dag before Round nodes are added
+    a = Input(name="a")
+    b = Input(name="b")
+    d = a * b
+    e = d + Constant(4.3, name="c")
+    z = e - b
+    rounder = AddRoundNodes(Input(name="W"), Input(name="O"))
+    rounded = rounder.doit(Dag(outputs=[z], inputs=[a, b]))
+
+    # The same expression built again (without Round nodes) has the same names
+    d2 = a * b
+    e2 = d2 + Constant(4.3, name="c")
+    z2 = e2 - b
+    assert (d.name, e.name, z.name) == (d2.name, e2.name, z2.name)
+    assert len({d.name, e.name, z.name}) == 3
+    assert [output.name for output in rounded.roots()] == [z.name + "_round"]
+    assert set(rounder.slot_map) == {"a", "b", d.name, "c", e.name}
+
+
+def test_deep_chain():
+    # Names stay short and no pass recurses, however deep the dag
+    depth = 20000
+    x = Input(name="x")
+    y = x
+    for i in range(depth):
+        y = y * Constant(1.0001, name="c") if i % 2 else y + Constant(0.5, name="h")
+    dag = Dag(outputs=[y], inputs=[x])
+    assert len(y.name) < 20
+
+    assert IAEval(dag).eval(x=Interval(0., 1.)).hi > 0
+    res = NumEval(dag).eval(x=1.)
+    rounder = AddRoundNodes(Input(name="W"), Input(name="O"))
+    rounded = rounder.doit(dag)
+    # Every operation and constant, and x (the output is rounded by O)
+    assert rounder.round_count == 2 * depth
+    assert max(len(name) for name in rounder.slot_map) < 30
+    W = torch.full((rounder.round_count,), 20.)
+    assert abs(TorchEval(rounded).eval(x=torch.tensor(1.), W=W, O=torch.tensor([20.])) / res - 1) < 1e-2
+
+    # Every node's error keeps the error terms of the nodes above it, so the error
+    # analysis is run on a shorter chain (still far deeper than Python's recursion limit)
+    y = x
+    for i in range(1500):
+        y = y + Constant(0.5, name="h")
+    dag = Dag(outputs=[y], inputs=[x])
+    evaluator = IAEval(dag)
+    evaluator.eval(x=Interval(0., 1.))
+    visitor = BitFlowVisitor(evaluator.node_values).run(dag)
+    assert visitor.IBs[y.name] == 11
+
+
 test_fig3()
 test_ex1()
 test_fig3_integers()
 test_poly_approx()
 test_RGB_to_YCbCr()
 test_Matrix_Multiplication()
+test_groups()
+test_derived_names()
+test_deep_chain()
@@ -4,7 +4,13 @@ from BitFlow.IA import Interval
 from BitFlow.Eval import IAEval, NumEval
 from BitFlow.Eval.TorchEval import TorchEval
 from BitFlow.BitFlow import BitFlow
+from BitFlow.DataCache import DatasetCache
+from BitFlow.AddRoundNodes import group_by_role
+from BitFlow.Parallel import map_chunks
+from BitFlow.Verification import evaluate_rows
+import os
 import torch
+import pytest
 
 
 def gen_fig3():
@@ -86,3 +92,165 @@ def test_rgb_case_study():
     print(bf.model(**test))
 
     return
+
+
+def test_groups():
+    # The coefficients, products and sums of each row share a precision
+    dag = RGB_to_YCbCr()
+    bf = BitFlow(dag, {"col_1": 10., "col_2": 10., "col_3": 10.}, {
+        'r': (-10., 10.), 'b': (-10., 10.), 'g': (-10., 10.)},
+        training_size=200, testing_size=50, epochs=2, groups=group_by_role(dag))
+    assert len(bf.W) == 3 + 3 * 3
+    assert bf.slots["C1"] == bf.slots["C3"] != bf.slots["C4"]
+
+
+def test_gen_data_batched():
+    dag = gen_ex1()
+    bf = BitFlow.__new__(BitFlow)
+    dag, weight_size, input_size, output_size = bf.update_dag(dag)
+    model = bf.gen_model(dag)
+
+    data_range = {'a': (-3., 2.), 'b': (4., 8.), 'c': (-1., 1.)}
+    range_bits = {'a': 3, 'b': 5, 'c': 2}
+    dataset = bf.gen_data(model, 100, weight_size,
+                          output_size, data_range, range_bits, chunk_size=32)
+    assert len(dataset) == 100
+    assert dataset.Y.shape == (2, 100)
+
+    empty = bf.gen_data(model, 0, weight_size, output_size, data_range, range_bits)
+    assert len(empty) == 0
+    assert empty.Y.shape == (2, 0)
+
+    # Every sample matches a per-sample evaluation of the reference model
+    W = torch.Tensor(weight_size).fill_(20.)
+    O = torch.Tensor(output_size).fill_(20.)
+    for i in (0, 31, 32, 99):
+        inputs, Y = dataset[i]
+        expected = model(**inputs, W=W, O=O)
+        for (y, e) in zip(Y, expected):
+            assert torch.equal(y, e.reshape(()))
+
+
+def test_ulp_pass_counts():
+    bf = BitFlow.__new__(BitFlow)
+    precision = torch.Tensor([2., 4., 6.])
+    truth = torch.Tensor([[1.3, 0.2, -0.7], [1.3, 0.2, -0.7], [1.3, 0.2, -0.7]])
+    rounded = bf.round_to_precision(truth, precision)
+    assert torch.equal(rounded[0], torch.Tensor([1.25, 0.25, -0.75]))
+    assert torch.equal(rounded[1], torch.Tensor([1.3125, 0.1875, -0.6875]))
+
+    # Half an ulp of output i is 2**-(precision[i] + 1)
+    num = rounded + torch.Tensor([[0.1, 0.2, 0.], [0.1, 0.01, 0.], [0., 0., 0.]])
+    mask = bf.is_within_ulp(num, truth, precision)
+    assert torch.equal(mask, torch.Tensor([[1, 0, 1], [0, 1, 1], [1, 1, 1]]))
+    assert bf.ulp_pass_counts(num, truth, precision).tolist() == [2, 2, 3]
+    assert bf.ulp_pass_counts(num[0], truth[0], precision[:1]).tolist() == [2]
+
+
+def test_verify():
+    dag = gen_ex1()
+    bf = BitFlow.__new__(BitFlow)
+    dag, weight_size, input_size, output_size = bf.update_dag(dag)
+    bf.dag = dag
+    bf.model = bf.gen_model(dag)
+    bf.data_range = {'a': (-3., 2.), 'b': (4., 8.), 'c': (-1., 1.)}
+    bf.range_bits = {'a': 3, 'b': 5, 'c': 2}
+    O = torch.Tensor([5., 8.])
+
+    # Full precision passes everywhere
+    report = bf.verify(10000, torch.Tensor(weight_size).fill_(20.), O, chunk_size=3000)
+    assert report.samples == 10000
+    assert report.passes.tolist() == [10000, 10000]
+    assert torch.all(report.max_ulp_error <= 0.5)
+
+    # Low precision fails; the worst inputs reproduce the worst error
+    W = torch.Tensor(weight_size).fill_(3.)
+    report = bf.verify(10000, W, O, chunk_size=3000, seed=1)
+    assert torch.all(report.passes < 10000)
+    inputs = {k: torch.Tensor([v]) for (k, v) in report.worst_inputs[1].items()}
+    full = bf.model(**inputs, W=torch.Tensor(weight_size).fill_(20.), O=torch.Tensor([20., 20.]))
+    res = bf.model(**inputs, W=W, O=O)
+    err = abs(float(res[1]) * 2**8 - round(float(full[1]) * 2**8))
+    assert abs(err - float(report.max_ulp_error[1])) < 1e-3
+
+    # Runs are reproducible, and stop early once the target is decided
+    again = bf.verify(10000, W, O, chunk_size=3000, seed=1)
+    assert torch.equal(again.passes, report.passes)
+    early = bf.verify(10**8, W, O, chunk_size=1000, seed=1, target_accuracy=0.999)
+    assert early.certified is False and early.samples < 10**8
+
+
+def test_parallel():
+    dag = gen_ex1()
+    bf = BitFlow.__new__(BitFlow)
+    dag, weight_size, input_size, output_size = bf.update_dag(dag)
+    bf.dag = dag
+    bf.model = bf.gen_model(dag)
+    bf.data_range = {'a': (-3., 2.), 'b': (4., 8.), 'c': (-1., 1.)}
+    bf.range_bits = {'a': 3, 'b': 5, 'c': 2}
+
+    serial = bf.gen_data(bf.model, 1000, weight_size, output_size,
+                         bf.data_range, bf.range_bits, chunk_size=300)
+    parallel = bf.gen_data(bf.model, 1000, weight_size, output_size,
+                           bf.data_range, bf.range_bits, chunk_size=300, workers=2, dag=dag)
+    assert torch.equal(serial.Y, parallel.Y)
+
+    W, O = torch.Tensor(weight_size).fill_(4.), torch.Tensor([5., 8.])
+    serial = bf.verify(5000, W, O, chunk_size=700, seed=3)
+    parallel = bf.verify(5000, W, O, chunk_size=700, seed=3, workers=2)
+    assert torch.equal(serial.passes, parallel.passes)
+    assert torch.equal(serial.max_ulp_error, parallel.max_ulp_error)
+    assert serial.worst_inputs == parallel.worst_inputs
+
+
+def test_parallel_window():
+    bf = BitFlow.__new__(BitFlow)
+    dag, weight_size, input_size, output_size = bf.update_dag(gen_ex1())
+    inputs = {'a': torch.tensor([1.]), 'b': torch.tensor([5.]), 'c': torch.tensor([0.5])}
+    W, O = torch.Tensor(weight_size).fill_(8.), torch.Tensor([8., 8.])
+    drawn = []
+
+    def tasks():
+        for k in range(1000):
+            drawn.append(k)
+            yield inputs, W, O, 1
+
+    # Tasks are drawn as results are consumed, and stopping early cancels the rest
+    results = map_chunks(dag, evaluate_rows, tasks(), workers=2)
+    first = next(results)
+    results.close()
+    assert first.shape == (2, 1)
+    assert len(drawn) == 4
+
+
+def test_dataset_cache(tmp_path):
+    bf = BitFlow.__new__(BitFlow)
+    dag, weight_size, input_size, output_size = bf.update_dag(gen_ex1())
+    model = bf.gen_model(dag)
+    data_range = {'a': (-3., 2.), 'b': (4., 8.), 'c': (-1., 1.)}
+    range_bits = {'a': 3, 'b': 5, 'c': 2}
+
+    cache = DatasetCache(str(tmp_path))
+    fresh = bf.gen_data(model, 500, weight_size, output_size,
+                        data_range, range_bits, cache=cache, dag=dag)
+    assert len(os.listdir(tmp_path)) == 1
+
+    # A structurally equal dag hits the same entry without evaluating the model
+    dag2, *_ = bf.update_dag(gen_ex1())
+
+    def unused(**kwargs):
+        raise AssertionError("cache miss")
+    cached = bf.gen_data(unused, 500, weight_size, output_size,
+                         data_range, range_bits, cache=str(tmp_path), dag=dag2)
+    assert torch.equal(cached.Y, fresh.Y)
+    for k in data_range:
+        assert torch.equal(cached.X[k], fresh.X[k])
+    assert [y.item() for y in cached[7][1]] == [y.item() for y in fresh[7][1]]
+
+    # Any other parameter is a different entry
+    bf.gen_data(model, 500, weight_size, output_size, data_range, range_bits, dist=1, cache=cache, dag=dag)
+    assert len(os.listdir(tmp_path)) == 2
+
+    # The key needs the dag of the model
+    with pytest.raises(ValueError):
+        bf.gen_data(model, 500, weight_size, output_size, data_range, range_bits, cache=cache)
@@ -1,5 +1,8 @@
 from BitFlow.casestudies.caseStudies import caseStudy
 from BitFlow.Eval import IAEval, NumEval
+from BitFlow.node import Input, Select, interned
+from BitFlow.Program import Program
+import numpy as np
 
 
 def test_poly_approx():
@@ -41,3 +44,38 @@ def test_Matrix_Multiplication():
     print(res)
     gold = [19, 22, 43, 50]
     assert res == gold
+
+
+def test_interned():
+    a = Input(name="a")
+    b = Input(name="b")
+    assert a[0] is not a[0]
+    with interned():
+        assert a[0][1] is a[0][1]
+        assert (a * b) + a is (a * b) + a
+        assert a * b is not b * a
+        assert a - b is not a + b
+    assert a + b is not a + b
+
+    # The three outputs of RGB_to_YCbCr share their selects
+    dag = caseStudy.RGB_to_YCbCr()
+    nodes = Program.topological_order(dag)
+    assert len([node for node in nodes if isinstance(node, Select)]) == 3
+
+    # Matrix_Multiplication selects each row of a and b once (4 selects fewer)
+    nodes = Program.topological_order(caseStudy.Matrix_Multiplication())
+    assert len([node for node in nodes if isinstance(node, Select)]) == 12
+    assert len(nodes) == 39
+
+
+def test_vector_case_studies():
+    # The vector ops compute the same results as the scalar trees
+    a = [22, 103, 200]
+    res = NumEval(caseStudy.RGB_to_YCbCr_vector()).eval(a=a)
+    gold = NumEval(caseStudy.RGB_to_YCbCr()).eval(a=a)
+    assert np.allclose(res, gold)
+
+    a = [[1, 2], [3, 4]]
+    b = [[5, 6], [7, 8]]
+    res = NumEval(caseStudy.Matrix_Multiplication_vector()).eval(a=a, b=b)
+    assert res.ravel().tolist() == [19, 22, 43, 50]
@@ -0,0 +1,108 @@
+import torch
+import pytest
+
+from BitFlow.node import Input, Constant, Dag, Add, Sub, Mul
+from BitFlow.Eval.TorchEval import TorchEval
+from BitFlow.Eval.CompiledTorchEval import CompiledTorchEval
+from BitFlow.AddRoundNodes import AddRoundNodes
+from BitFlow.casestudies.caseStudies import caseStudy
+
+
+def gen_fig3():
+    #(a*b) + 4 - b
+    a = Input(name="a")
+    b = Input(name="b")
+    c = Constant(4.3, name="c")
+    d = Mul(a, b, name="d")
+    e = Add(d, c, name="e")
+    z = Sub(e, b, name="z")
+
+    fig3_dag = Dag(outputs=[z], inputs=[a, b])
+    return fig3_dag
+
+
+def round_dag(dag):
+    rounder = AddRoundNodes(Input(name="W"), Input(name="O"))
+    return rounder.doit(dag), rounder.round_count, rounder.output_count
+
+
+def check_same(dag, weight_size, output_size, **inputs):
+    W_ref = torch.linspace(6., 12., weight_size).requires_grad_()
+    W_cmp = W_ref.detach().clone().requires_grad_()
+    O = torch.Tensor(output_size).fill_(10.)
+
+    ref = TorchEval(dag).eval(**inputs, W=W_ref, O=O)
+    res = CompiledTorchEval(dag).eval(**inputs, W=W_cmp, O=O)
+
+    if isinstance(ref, list):
+        assert isinstance(res, list)
+        ref, res = torch.stack(ref), torch.stack(res)
+    assert torch.equal(ref, res)
+
+    torch.sum(ref).backward()
+    torch.sum(res).backward()
+    assert torch.equal(W_ref.grad, W_cmp.grad)
+
+
+def test_fig3():
+    dag, weight_size, output_size = round_dag(gen_fig3())
+    check_same(dag, weight_size, output_size,
+               a=torch.rand(16) * 5 - 3, b=torch.rand(16) * 4 + 4)
+
+
+def test_poly_approx():
+    dag, weight_size, output_size = round_dag(caseStudy.poly_approx())
+    check_same(dag, weight_size, output_size,
+               a=torch.tensor([1., 3., -6., -10., -1.]), c=3.3)
+
+
+def test_RGB_to_YCbCr():
+    dag, weight_size, output_size = round_dag(caseStudy.RGB_to_YCbCr())
+    check_same(dag, weight_size, output_size, a=torch.rand(16, 3) * 255)
+
+
+def test_Matrix_Multiplication():
+    dag, weight_size, output_size = round_dag(
+        caseStudy.Matrix_Multiplication())
+    check_same(dag, weight_size, output_size,
+               a=torch.tensor([[1.1, 2.2], [3, 4]]), b=torch.tensor([[5., 6], [7, 8]]))
+
+
+def test_missing_input():
+    evaluator = CompiledTorchEval(gen_fig3())
+    with pytest.raises(ValueError):
+        evaluator.eval(a=1.)
+
+
+def test_vector_ops():
+    dag, weight_size, output_size = round_dag(caseStudy.RGB_to_YCbCr_vector())
+    check_same(dag, weight_size, output_size, a=torch.rand(16, 3) * 255)
+
+    # One precision for the whole product, and for each operand
+    dag, weight_size, output_size = round_dag(caseStudy.Matrix_Multiplication_vector())
+    assert (weight_size, output_size) == (2, 1)
+    check_same(dag, weight_size, output_size,
+               a=torch.rand(16, 2, 3) * 4, b=torch.rand(16, 3, 2) * 4)
+
+
+def test_fused_rounds():
+    dag, weight_size, output_size = round_dag(caseStudy.RGB_to_YCbCr())
+    W_ref = torch.linspace(6., 12., weight_size).requires_grad_()
+    W_cmp = W_ref.detach().clone().requires_grad_()
+    O = torch.Tensor(output_size).fill_(10.)
+    a = torch.rand(16, 3) * 255
+
+    evaluator = CompiledTorchEval(dag, fuse_rounds=True)
+    # The rounded inputs and constants are one level, each output round another,
+    # and W is gathered once per level instead of selected per node
+    assert "_round(" not in evaluator.source
+    assert "v1[" not in evaluator.source
+
+    ref = torch.stack(TorchEval(dag).eval(a=a, W=W_ref, O=O))
+    res = torch.stack(evaluator.eval(a=a, W=W_cmp, O=O))
+    assert torch.equal(ref, res)
+
+    # Gradients are summed in another order
+    torch.sum(ref).backward()
+    torch.sum(res).backward()
+    assert torch.allclose(W_ref.grad, W_cmp.grad, rtol=1e-4)
@@ -0,0 +1,96 @@
+from BitFlow.Expr import ExprGraph, compile_expr, compile_grad
+from BitFlow.IA import IntervalArray
+import numpy as np
+import torch
+
+
+def test_hash_consing():
+    g = ExprGraph()
+    x, y = g.var("x"), g.var("y")
+    assert g.var("x") is x
+    assert x * y is y * x
+    assert (x + y) * 2 is 2 * y + 2 * x
+    assert (x + 1) - 1 is x
+
+
+def test_folding():
+    g = ExprGraph()
+    x = g.var("x")
+    assert g.add(2, 3) is g.const(5)
+    assert x - x is g.const(0)
+    assert x * 0 is g.const(0)
+    assert x + x + x is 3 * x
+    assert g.exp2(g.const(-2)) is g.const(0.25)
+    assert g.max(x, x) is x
+
+
+def test_compile():
+    g = ExprGraph()
+    x, y = g.var("x"), g.var("y")
+    e = g.max(x + 2 * y, y * y) + g.exp2(-x)
+
+    def gold(x, y):
+        return max(x + 2 * y, y * y) + 2.0 ** -x
+
+    f = compile_expr(e, ["x", "y"])
+    for (a, b) in [(1., 2.), (3., 0.5), (-1., 4.)]:
+        assert np.isclose(f(np.array([a, b])), gold(a, b))
+
+    # Batched over trailing dimensions
+    X = np.random.RandomState(0).uniform(-4, 4, (2, 50))
+    assert np.allclose(f(X), [gold(a, b) for (a, b) in X.T])
+
+    f_torch = compile_expr(e, {"x": 0, "y": 1}, backend="torch")
+    assert np.allclose(f_torch(torch.Tensor(X)).numpy(), f(X), rtol=1e-5)
+
+
+def test_grad():
+    g = ExprGraph()
+    x, y, z = g.var("x"), g.var("y"), g.var("z")
+    e = g.exp2(-x) * y + g.max(x * z, y) * (x + 3 * z)
+    f = compile_expr(e, ["x", "y", "z"])
+    grad = compile_grad(e, ["x", "y", "z"])
+
+    h = 1e-6
+    for p in np.random.RandomState(1).uniform(0.5, 3, (10, 3)):
+        dp = grad(p)
+        assert dp.shape == (3,)
+        for i in range(3):
+            step = np.eye(3)[i] * h
+            fd = (f(p + step) - f(p - step)) / (2 * h)
+            assert np.isclose(dp[i], fd, rtol=1e-5)
+
+
+def test_interval_backend():
+    g = ExprGraph()
+    x, y = g.var("x"), g.var("y")
+    e = g.max(x - 2 * y, y * y) * g.exp2(-x)
+    f = compile_expr(e, ["x", "y"])
+    bounds = compile_expr(e, ["x", "y"], backend="interval")(
+        IntervalArray([1., -2.], [3., 1.]))
+
+    samples = np.random.RandomState(2).uniform([[1.], [-2.]], [[3.], [1.]], (2, 1000))
+    values = f(samples)
+    assert bounds.lo <= np.min(values) and np.max(values) <= bounds.hi
+
+
+def test_vector_backend():
+    g = ExprGraph()
+    x, y = g.var("x"), g.var("y")
+    e = g.max(x + 2 * y, y * y) * (x + y + 3) + g.exp2(-x) + x * y * x
+    f_torch = compile_expr(e, {"x": 0, "y": 1}, backend="torch")
+    f_vector = compile_expr(e, {"x": 0, "y": 1}, backend="vector")
+
+    X = torch.Tensor(np.random.RandomState(3).uniform(-4, 4, (2, 50)))
+    assert torch.allclose(f_vector(X), f_torch(X))
+
+    W = torch.tensor([1.5, -2.], requires_grad=True)
+    f_torch(W).backward()
+    grad = W.grad.clone()
+    W.grad = None
+    f_vector(W).backward()
+    assert torch.allclose(W.grad, grad)
+
+    # Plain lists, and names sharing an index
+    assert np.isclose(float(f_vector([1.5, -2.])), float(f_torch(torch.tensor([1.5, -2.]))))
+    assert float(compile_expr(x * y, {"x": 0, "y": 0}, backend="vector")([3.])) == 9.
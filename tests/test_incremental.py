@@ -0,0 +1,116 @@
+from BitFlow.node import Input, Constant, Dag
+from BitFlow.Eval import NumEval, IAEval
+from BitFlow.RangeAnalysis import input_boxes
+from BitFlow.Incremental import IncrementalAnalysis, AnalysisCache
+from BitFlow.BitFlow import BitFlow
+from BitFlow.Optimization import BitFlowOptimizer
+from BitFlow.Expr import compile_expr
+import numpy as np
+
+
+def gen_rgb(coefs):
+    r = Input(name="r")
+    g = Input(name="g")
+    b = Input(name="b")
+    outputs = []
+    for (i, row) in enumerate(coefs):
+        terms = [Constant(c, name=f"C{i}{j}") * x for (j, (c, x)) in enumerate(zip(row, (r, g, b)))]
+        outputs.append(terms[0] + terms[1] + terms[2])
+    return Dag(outputs=outputs, inputs=[r, g, b])
+
+
+coefs = [[.299, .587, .114], [-.16875, -.33126, .5], [.5, -.41869, -.08131]]
+inputs = dict(r=255, g=255, b=255)
+
+
+def check_same(bfo, dag, outputs, evaluator=NumEval, values=inputs):
+    evaluator = evaluator(dag)
+    evaluator.eval(**values)
+    gold = BitFlowOptimizer(evaluator, outputs)
+    assert bfo.vars == gold.vars
+    assert bfo.visitor.IBs == gold.visitor.IBs
+    assert {k: v.error for (k, v) in bfo.visitor.errors.items()} == \
+        {k: v.error for (k, v) in gold.visitor.errors.items()}
+
+    variables = [v for v in bfo.vars if v not in outputs]
+    x = np.random.RandomState(0).uniform(0, 16, (len(variables), 10))
+    for (fn, gold_fn) in ((bfo.area_fn, gold.area_fn), (bfo.error_fn, gold.error_fn)):
+        assert np.allclose(compile_expr(fn, variables)(x), compile_expr(gold_fn, variables)(x))
+
+
+def test_edits():
+    analysis = IncrementalAnalysis()
+    dag = gen_rgb(coefs)
+    outputs = {root.name: 8 for root in dag.roots()}
+    bfo = analysis.optimizer(dag, outputs, **inputs)
+    assert analysis.hits == 0
+    check_same(bfo, dag, outputs)
+    area = analysis.compile(bfo.area_fn, [v for v in bfo.vars if v not in outputs])
+
+    # Changing one coefficient only re-analyses its product and the sums above it
+    edited = [row[:] for row in coefs]
+    edited[1][2] = .25
+    dag = gen_rgb(edited)
+    outputs = {root.name: 8 for root in dag.roots()}
+    bfo = analysis.optimizer(dag, outputs, **inputs)
+    assert analysis.misses == 3
+    check_same(bfo, dag, outputs)
+
+    # Going back reuses everything, down to the compiled functions
+    dag = gen_rgb(coefs)
+    bfo = analysis.optimizer(dag, outputs, **inputs)
+    assert analysis.misses == 0
+    assert analysis.compile(bfo.area_fn, [v for v in bfo.vars if v not in outputs]) is area
+
+    # New input ranges change everything that depends on them
+    dag = gen_rgb(coefs)
+    bfo = analysis.optimizer(dag, outputs, r=100, g=255, b=255)
+    assert analysis.misses == 1 + 3 + 3 * 2
+
+
+def test_bounded():
+    # Only the results of the last max_versions dags are kept
+    analysis = IncrementalAnalysis(max_versions=2)
+    dag = gen_rgb(coefs)
+    analysis.analyze(dag, **inputs)
+    size = len(analysis.results)
+    for c in np.linspace(.1, .9, 20):
+        analysis.analyze(gen_rgb([[c] + row[1:] for row in coefs]), **inputs)
+    # The first coefficient of each row, its product and both sums differ
+    assert len(analysis.results) == size + 3 * 4
+    assert len(analysis.signatures) == len(analysis.results)
+
+    # The unchanged cones are still reused
+    analysis.analyze(gen_rgb([[.9] + row[1:] for row in coefs]), **inputs)
+    assert analysis.misses == 0
+    analysis.analyze(dag, **inputs)
+    assert analysis.misses == 3 * 4
+
+
+def test_analysis_cache():
+    cache = AnalysisCache(maxsize=2)
+    dag = gen_rgb(coefs)
+    outputs = {root.name: 8 for root in dag.roots()}
+    bfo = cache.optimizer(dag, outputs, **inputs)
+    check_same(bfo, dag, outputs)
+
+    # An equal dag (with equal names) and equal inputs skip the analysis
+    dag = gen_rgb(coefs)
+    assert cache.optimizer(dag, outputs, **inputs).visitor is bfo.visitor
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # The least recently used analysis is dropped
+    cache.analyze(dag, r=1, g=2, b=3)
+    cache.analyze(dag, r=3, g=2, b=1)
+    cache.analyze(dag, **inputs)
+    assert (cache.hits, cache.misses) == (1, 4)
+
+    # Misses can go through an incremental analysis
+    cache = AnalysisCache(analysis=IncrementalAnalysis(IAEval))
+    bf = BitFlow.__new__(BitFlow)
+    data_range = {k: (-v, v) for (k, v) in inputs.items()}
+    for i in range(2):
+        bfo, range_bits, filtered_vars = bf.constructOptimizationFunctions(gen_rgb(coefs), outputs, data_range, cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert range_bits == bfo.visitor.IBs and "r" in filtered_vars
+    check_same(bfo, dag, outputs, IAEval, input_boxes(data_range))
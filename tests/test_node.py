@@ -0,0 +1,32 @@
+from BitFlow.node import Input, Constant, Dag, Add, Sub, Mul, Select, Round, Sum, Dot, MatMul
+
+
+def test_names():
+    # Derived names are a digest of the node's kind and its children's names
+    a = Input(name="a")
+    b = Input(name="b")
+    assert (a + b).name == (a + b).name
+    assert (a + b).name.startswith("add_") and (a - b * a).name.startswith("sub_")
+    assert len({(a + b).name, (b + a).name, (a - b).name, (a * b).name}) == 4
+    assert a[1].name.startswith("select_") and a[1].name != a[2].name
+    assert Round(a[1], b).name.startswith("round_")
+    assert Add(a, b, name="z").name == "z"
+    assert (a @ b).name.startswith("matmul_")
+    assert a.dot(b).sum().name.startswith("sum_")
+    assert isinstance(a @ b, MatMul) and isinstance(a.dot(b), Dot) and isinstance(a.sum(), Sum)
+
+    z = a * b
+    z.name = "z"
+    assert (z + a).name == (Input(name="z") + a).name
+
+
+def test_deep_names():
+    # Names are derived lazily and iteratively, and stay short, so deep chains are
+    # cheap to build and name
+    x = Input(name="x")
+    c = Input(name="c")
+    acc = x
+    for i in range(5000):
+        acc = acc * c
+    assert acc._name is None
+    assert len(acc.name) == len("mul_") + 12
@@ -1,9 +1,13 @@
 from BitFlow.node import Input, Constant, Dag, Add, Sub, Mul
+from BitFlow.casestudies.caseStudies import caseStudy
 from DagVisitor import Visitor
 from BitFlow.IA import Interval
 from BitFlow.Eval.IAEval import IAEval
 from BitFlow.Eval.NumEval import NumEval
 from BitFlow.Optimization import BitFlowOptimizer
+from BitFlow.Expr import compile_expr, compile_grad
+from BitFlow.BranchAndBound import branch_and_bound
+import numpy as np
 
 
 def gen_fig3():
@@ -42,7 +46,7 @@ def test_fig3():
     bfo = BitFlowOptimizer(evaluator, {'z': 8})
     bfo.solve()
 
-    assert bfo.visitor.IBs == {'a': 4, 'b': 5, 'd': 7, 'c': 4, 'e': 6, 'z': 7}
+    assert bfo.visitor.IBs == {'a': 3, 'b': 5, 'd': 6, 'c': 4, 'e': 6, 'z': 6}
     assert bfo.initial == 12
 
 
@@ -77,3 +81,67 @@ def test_print():
     print("node, IB, FB ")
     for node in bfo.fb_sols.keys():
         print(f"{node}, {bfo.visitor.IBs[node]}, {bfo.fb_sols[node]}")
+
+
+def test_jacobians():
+    dag1 = gen_dag1()
+    evaluator = NumEval(dag1)
+    evaluator.eval(x=2, y=5, z=3)
+
+    bfo = BitFlowOptimizer(evaluator, {'k': 5})
+    variables = [v for v in bfo.vars if v not in bfo.outputs]
+
+    h = 1e-6
+    x0 = np.linspace(2., 9., len(variables))
+    for fn in (bfo.error_fn, bfo.area_fn):
+        f = compile_expr(fn, variables)
+        jac = compile_grad(fn, variables)(x0)
+        for i in range(len(variables)):
+            step = np.eye(len(variables))[i] * h
+            assert np.isclose(jac[i], (f(x0 + step) - f(x0 - step)) / (2 * h), rtol=1e-5, atol=1e-9)
+
+
+def test_bnb():
+    dag1 = gen_dag1()
+    evaluator = NumEval(dag1)
+    evaluator.eval(x=2, y=5, z=3)
+
+    bfo = BitFlowOptimizer(evaluator, {'k': 5})
+    bfo.solve(method="bnb")
+    assert bfo.optimal
+    assert all(isinstance(v, int) for v in bfo.fb_sols.values())
+
+    variables = list(bfo.fb_sols.keys())
+    x = np.array(list(bfo.fb_sols.values()), dtype=float)
+    area = compile_expr(bfo.area_fn, variables)
+    error = compile_expr(bfo.error_fn, variables)
+    assert error(x) >= 0
+
+    # Exhaustive check of every point within 3 bits of the optimum
+    grid = np.stack(np.meshgrid(*[np.arange(max(v - 3, 0), v + 4) for v in x], indexing="ij"))
+    grid = grid.reshape(len(variables), -1)
+    feasible = error(grid) >= 0
+    assert np.min(area(grid)[feasible]) == area(x)
+
+    # Out of time, the search returns the greedy incumbent
+    solution, optimal = branch_and_bound(bfo.area_fn, bfo.error_fn, variables, time_limit=0)
+    assert not optimal
+    assert error(np.array(solution, dtype=float)) >= 0
+
+
+def test_vector_ops():
+    # A Dot is analysed as the sum of its products, rounded once
+    dag = caseStudy.RGB_to_YCbCr_vector()
+    evaluator = NumEval(dag)
+    evaluator.eval(a=[255, 255, 255])
+
+    outputs = {output.name: 8 for output in dag.roots()}
+    bfo = BitFlowOptimizer(evaluator, outputs)
+    assert sorted(v for v in bfo.vars if v not in outputs) == ["Cb", "Cr", "Y", "a"]
+    y = dag.roots()[0].name
+    assert bfo.visitor.IBs[y] == 9
+    error = bfo.visitor.errors[y].error
+    assert error[("Y",)] == 3 * 255 and error[("Y", "a")] == 3
+
+    bfo.solve(method="bnb")
+    assert bfo.optimal
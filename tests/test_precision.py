@@ -1,4 +1,6 @@
 from BitFlow.Precision import PrecisionNode, FPEpsilon, FPEpsilonMultiplier
+from BitFlow.Expr import ExprGraph, compile_expr
+import numpy as np
 
 def test_add():
     x = PrecisionNode(5, "x", [])
@@ -16,7 +18,7 @@ def test_mul():
     x = PrecisionNode(3, "x", [])
     y = PrecisionNode(4, "y", [])
     z = x.mul(y, "z")
-    assert z == PrecisionNode(12, "z", [FPEpsilon("x", 4), FPEpsilon("y", 3), FPEpsilonMultiplier([FPEpsilon("x")], [FPEpsilon("x")])])
+    assert z == PrecisionNode(12, "z", [FPEpsilon("x", 4), FPEpsilon("y", 3), FPEpsilonMultiplier([FPEpsilon("x")], [FPEpsilon("y")])])
 
 def test_paper_fig3():
     a = PrecisionNode(2, "a", [])
@@ -52,6 +54,57 @@ def test_example_2():
     assert e == PrecisionNode(16, "e", [FPEpsilon("a"), FPEpsilon("b"), FPEpsilon("c"), FPEpsilon("a", -1), FPEpsilon("b"),  FPEpsilon("d")])
 
 
+def test_operands_unchanged():
+    x = PrecisionNode(3, "x", [])
+    y = PrecisionNode(4, "y", [])
+    z = x.sub(y, "z").mul(x, "w")
+    assert x == PrecisionNode(3, "x", [])
+    assert y == PrecisionNode(4, "y", [])
+    assert z.error[("x", "y")] == -1
+
+
+def test_like_terms():
+    x = PrecisionNode(3, "x", [])
+    y = PrecisionNode(4, "y", [])
+    z = x.add(y, "a").add(x, "b").sub(y, "c")
+    assert z.error == {("x",): 2, ("a",): 1, ("b",): 1, ("c",): 1}
+
+
+def test_horner_chain():
+    # like monomials merge, so a deep chain of multiplies grows polynomially
+    depth = 40
+    x = PrecisionNode(1.5, "a0", [])
+    c = PrecisionNode(3, "c", [])
+    for i in range(1, depth):
+        x = x.mul(c, f"m{i}").add(PrecisionNode(2, f"a{i}", []), f"s{i}")
+    assert len(x.error) < 2 * depth**2
+
+
+def test_squaring_chain():
+    # Products beyond first order stay factored, so y = y*y does not expand its whole history
+    depth = 8
+    y = PrecisionNode(1.5, "x", [])
+    names = ["x"]
+    for i in range(depth):
+        y = y.mul(y, f"y{i}")
+        names.append(f"y{i}")
+    assert len(y.error) < 100
+
+    # Factored products reference the (shared) parts of their operands' errors
+    z = y.mul(y, "z")
+    products = [term for term in z.error if isinstance(term, FPEpsilonMultiplier) and term not in y.error]
+    assert products and all(any(part is y.parts()[i] for i in (0, 1)) for term in products
+                            for part in (term.Ex, term.Ey))
+
+    # The error model is still exact: E' = 2*v*E + E*E + ε (without the output's own ε)
+    fb = 8.
+    value, error = 1.5, 2 ** -(fb + 1)
+    for i in range(depth):
+        error, value = 2 * value * error + error * error + (2 ** -(fb + 1) if i < depth - 1 else 0), value * value
+    f = compile_expr(y.getErrorExpr(ExprGraph()), names)
+    assert np.isclose(f([fb] * len(names)), error)
+
+
 # def test_paper_fig3():
 #     a = PrecisionNode(2, "a", [])
 #     print(a)
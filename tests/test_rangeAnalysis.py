@@ -0,0 +1,106 @@
+from BitFlow.node import Input, Constant, Dag, Add, Sub, Mul
+from BitFlow.Eval import NumEval
+from BitFlow.BitFlow import BitFlow
+from BitFlow.Eval.IAEval import IAEval
+from BitFlow.IA import IntervalArray
+from BitFlow.RangeAnalysis import input_boxes, RangeRefinement
+from BitFlow.casestudies.caseStudies import caseStudy
+import numpy as np
+import pytest
+
+
+def gen_fig3():
+    # (a*b) + 4.3 - b
+    a = Input(name="a")
+    b = Input(name="b")
+    c = Constant(4.3, name="c")
+    d = Mul(a, b, name="d")
+    e = Add(d, c, name="e")
+    z = Sub(e, b, name="z")
+    return Dag(outputs=[z], inputs=[a, b])
+
+
+def gen_square():
+    # x*x - x, where x appearing twice makes plain interval bounds loose
+    x = Input(name="x")
+    z = Sub(Mul(x, x, name="y"), x, name="z")
+    return Dag(outputs=[z], inputs=[x])
+
+
+def range_bits(dag, outputs, data_range, subdivisions=1, refine=None):
+    bf = BitFlow.__new__(BitFlow)
+    _, bits, _ = bf.constructOptimizationFunctions(dag, outputs, data_range, subdivisions=subdivisions, refine=refine)
+    return bits
+
+
+def check_sound(dag, bits, data_range):
+    # Every node of the dag fits its integer bits at random points of the box
+    rng = np.random.RandomState(0)
+    for _ in range(200):
+        evaluator = NumEval(dag)
+        evaluator.eval(**{k: rng.uniform(lo, hi) for (k, (lo, hi)) in data_range.items()})
+        for (node, value) in evaluator.node_values.items():
+            ib = bits[node.name]
+            assert -2 ** (ib - 1) <= value < 2 ** (ib - 1)
+
+
+def test_sound_IBs():
+    data_range = {"a": (-3., 2.), "b": (4., 8.)}
+    bits = range_bits(gen_fig3(), {"z": 8}, data_range)
+    check_sound(gen_fig3(), bits, data_range)
+    # a*b spans [-24, 16] (the probe point a=3, b=8 only saw positive values)
+    assert bits["d"] == 6
+
+    # Fractional and zero ranges
+    x = Input(name="x")
+    dag = Dag(outputs=[Add(Mul(x, Constant(0., name="zero")), x, name="z")], inputs=[x])
+    bits = range_bits(dag, {"z": 8}, {"x": (0., .25)})
+    assert bits["zero"] == 1
+    check_sound(dag, bits, {"x": (0., .25)})
+
+
+def test_subdivisions():
+    boxes = input_boxes({"a": (0., 1.), "b": (-2., 2.)}, 4)
+    assert boxes["a"].shape == boxes["b"].shape == (16,)
+    assert boxes["a"].hull().interval == [0., 1.] and boxes["b"].hull().interval == [-2., 2.]
+    with pytest.raises(ValueError):
+        input_boxes({k: (0., 1.) for k in "abcdefgh"}, 8)
+
+    data_range = {"x": (-1., 3.)}
+    bits = range_bits(gen_square(), {"z": 8}, data_range)
+    tight = range_bits(gen_square(), {"z": 8}, data_range, subdivisions=16)
+    check_sound(gen_square(), tight, data_range)
+    assert all(tight[k] <= bits[k] for k in bits)
+    assert tight["z"] < bits["z"]
+
+
+def test_refinement():
+    data_range = {"x": (-1., 3.)}
+    bits = range_bits(gen_square(), {"z": 8}, data_range)
+    tight = range_bits(gen_square(), {"z": 8}, data_range, refine={})
+    check_sound(gen_square(), tight, data_range)
+    assert tight["z"] < bits["z"]
+
+    # Strassen's form: outputs are within [-2, 2] for entries in [-1, 1]
+    dag = caseStudy.Matrix_Multiplication()
+    box = IntervalArray(-np.ones((2, 2)), np.ones((2, 2)))
+    loose = [y.hull() for y in IAEval(dag).eval(a=box, b=box)]
+    refinement = RangeRefinement(dag, max_boxes=512)
+    refined = refinement.eval(a=box, b=box)
+    assert len(refinement.boxes[0]) <= 512
+    assert all(y.lo >= l.lo and y.hi <= l.hi and y.hi - y.lo < l.hi - l.lo for (y, l) in zip(refined, loose))
+
+    rng = np.random.RandomState(0)
+    for _ in range(100):
+        evaluator = NumEval(dag)
+        evaluator.eval(a=rng.uniform(-1, 1, (2, 2)), b=rng.uniform(-1, 1, (2, 2)))
+        for (node, value) in evaluator.node_values.items():
+            x = refinement.node_values[node]
+            if isinstance(x, IntervalArray):
+                assert np.all(x.lo <= value) and np.all(value <= x.hi)
+            elif not isinstance(value, np.ndarray):
+                assert x.lo <= value <= x.hi
+
+    # The same boxes and ranges with a process pool
+    pooled = RangeRefinement(dag, max_boxes=512, workers=2, chunk_size=64)
+    assert [y.interval for y in pooled.eval(a=box, b=box)] == [y.interval for y in refined]
@@ -0,0 +1,73 @@
+from BitFlow.node import Input, Constant, Dag, Add, Sub, Mul, Select, Round
+from BitFlow.Serialization import dumps, loads, dump, load, digest, to_json
+from BitFlow.Eval import NumEval
+from BitFlow.AddRoundNodes import AddRoundNodes
+from BitFlow.Eval.CompiledTorchEval import CompiledTorchEval
+import torch
+
+
+def gen_ex1():
+    a = Input(name="a")
+    b = Input(name="b")
+    c = Input(name="c")
+    d = Mul(a, b, name="d")
+    e = Mul(b, c, name="e")
+    z_1 = Add(e, d, name="z_1")
+    z_2 = Sub(a, Mul(d, Constant(0.3, name="k"), name="f"), name="z_2")
+    return Dag(outputs=[z_1, z_2], inputs=[a, b, c])
+
+
+def test_roundtrip(tmp_path):
+    dag = gen_ex1()
+    loaded = loads(dumps(dag))
+    assert [n.name for n in loaded.inputs] == ["a", "b", "c"]
+    assert [n.name for n in loaded.roots()] == ["z_1", "z_2"]
+    assert dumps(loaded) == dumps(dag)
+    assert NumEval(loaded).eval(a=1.5, b=2, c=-3) == NumEval(dag).eval(a=1.5, b=2, c=-3)
+
+    path = str(tmp_path / "ex1.json")
+    dump(dag, path)
+    assert dumps(load(path)) == dumps(dag)
+
+
+def test_roundtrip_rounded():
+    rounder = AddRoundNodes(Input(name="W"), Input(name="O"))
+    dag = rounder.doit(gen_ex1())
+    loaded = loads(dumps(dag))
+
+    inputs = dict(a=torch.rand(8), b=torch.rand(8), c=torch.rand(8),
+                  W=torch.Tensor(rounder.round_count).fill_(6.), O=torch.Tensor([5., 5.]))
+    for (x, y) in zip(CompiledTorchEval(loaded).eval(**inputs), CompiledTorchEval(dag).eval(**inputs)):
+        assert torch.equal(x, y)
+
+
+def test_hash_consing():
+    a = Input(name="a")
+    b = Input(name="b")
+    # a_add_b built twice is stored once
+    dag = Dag(outputs=[Mul(a + b, a + b)], inputs=[a, b])
+    assert len(to_json(dag)["nodes"]) == 4
+    loaded = loads(dumps(dag))
+    x, y = loaded.roots()[0].children()
+    assert x is y
+
+
+def test_digest():
+    assert digest(gen_ex1()) == digest(gen_ex1())
+
+    # Internal names do not matter, structure and input names do
+    a, b = Input(name="a"), Input(name="b")
+    dag0 = Dag(outputs=[Add(a, Mul(a, b, name="x"), name="y")], inputs=[a, b])
+    a, b = Input(name="a"), Input(name="b")
+    dag1 = Dag(outputs=[Add(a, Mul(a, b))], inputs=[a, b])
+    dag2 = Dag(outputs=[Add(a, Sub(a, b))], inputs=[a, b])
+    dag3 = Dag(outputs=[Add(a, Select(Mul(a, b), 1))], inputs=[a, b])
+    c = Input(name="c")
+    dag4 = Dag(outputs=[Add(c, Mul(c, b))], inputs=[c, b])
+    digests = [digest(d) for d in (dag0, dag1, dag2, dag3, dag4)]
+    assert digests[0] == digests[1]
+    assert len(set(digests)) == 4
+
+    k0 = Dag(outputs=[Constant(0.5) * a], inputs=[a])
+    k1 = Dag(outputs=[Constant(0.25) * a], inputs=[a])
+    assert digest(k0) != digest(k1)
@@ -0,0 +1,60 @@
+import torch
+
+from BitFlow.node import Input, Constant, Dag, Add, Sub, Mul
+from BitFlow.Eval.CompiledTorchEval import CompiledTorchEval
+from BitFlow.AddRoundNodes import AddRoundNodes
+from BitFlow.torch.export import RoundedDag, export
+from BitFlow.torch.functions import IntRound, int_round
+
+
+def gen_ex1():
+    # (a * b) + (b * c)
+    a = Input(name="a")
+    b = Input(name="b")
+    c = Input(name="c")
+    d = Mul(a, b, name="d")
+    e = Mul(b, c, name="e")
+    z_1 = Add(e, d, name="z_1")
+    z_2 = Sub(a, Mul(d, Constant(0.3, name="k"), name="f"), name="z_2")
+
+    dag = Dag(outputs=[z_1, z_2], inputs=[a, b, c])
+    return dag
+
+
+def test_int_round():
+    x = torch.randn(100) * 10
+    a = x.clone().requires_grad_()
+    b = x.clone().requires_grad_()
+    ra, rb = IntRound(a), torch.jit.script(int_round)(b)
+    assert torch.equal(ra, rb)
+
+    dy = torch.randn(100)
+    ra.backward(dy)
+    rb.backward(dy)
+    assert torch.equal(a.grad, b.grad)
+
+
+def test_export(tmp_path):
+    rounder = AddRoundNodes(Input(name="W"), Input(name="O"))
+    dag = rounder.doit(gen_ex1())
+    W = torch.linspace(4., 12., rounder.round_count)
+    O = torch.Tensor(rounder.output_count).fill_(8.)
+    inputs = [torch.rand(32) * 4 - 2 for _ in range(3)]
+
+    gold = CompiledTorchEval(dag).eval(
+        a=inputs[0], b=inputs[1], c=inputs[2], W=W, O=O)
+
+    module = RoundedDag(dag, W, O)
+    assert module.input_names == ["a", "b", "c"]
+    for (res, y) in zip(module(*inputs), gold):
+        assert torch.equal(res, y)
+
+    path = str(tmp_path / "ex1.pt")
+    export(dag, W, O, inputs, path=path)
+    loaded = torch.jit.load(path)
+    for (res, y) in zip(loaded(*inputs), gold):
+        assert torch.equal(res, y)
+
+    # W stays trainable in the exported artifact
+    torch.sum(loaded(*inputs)[0]).backward()
+    assert loaded.W.grad is not None